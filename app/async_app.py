@@ -0,0 +1,72 @@
+# Файл: async_app.py
+"""
+Асинхронный режим работы бота на AsyncTeleBot.
+
+Используется вместо синхронного бота из app.factory: один цикл событий обслуживает все чаты,
+а CPU-работа (отрисовка штрих-кодов) уходит в пул процессов/потоков.
+"""
+import logging
+from typing import List, Union
+
+import telebot.asyncio_filters
+from telebot import asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+
+from . import config
+from .entities import stamp_received
+from .handlers import register_all_async_handlers
+from .middlewares import AsyncAdministatorMiddleware, AsyncMetricsMiddleware
+from .utils.metrics import instrument_async_telegram_api, metrics
+from .utils.saving_and_loading import create_barcode_storage, FileIdIndex
+from .utils.state_storage import AsyncTTLStateStorage, TTLStateStorage
+
+logger = logging.getLogger(__name__)
+
+
+# Класс живет здесь, а не в entities.py: AsyncTeleBot тянет aiohttp, который синхронному боту не нужен
+class AsyncAppTeleBot(AsyncTeleBot):
+    """
+    Кастомный класс AsyncTeleBot с теми же дополнительными атрибутами, что и AppTeleBot.
+    """
+    auth_middleware_instance_ref: Union[AsyncAdministatorMiddleware, None]
+
+    def __init__(self, token: str, *args, **kwargs):
+        super().__init__(token, *args, **kwargs)
+        self.auth_middleware_instance_ref = None
+        self.user_barcodes = create_barcode_storage(config.STORAGE_BACKEND, sqlite_path=config.STORAGE_SQLITE_PATH,
+                                                    cache_size=config.STORAGE_CACHE_SIZE)
+        self.photo_file_ids = FileIdIndex(max_entries=config.FILE_ID_MAX_ENTRIES)
+
+    async def process_new_updates(self, updates: List[types.Update]):
+        stamp_received(updates)
+        await super().process_new_updates(updates)
+
+
+def create_async_bot() -> AsyncAppTeleBot:
+    """
+    Создает и настраивает AsyncAppTeleBot с теми же middleware, фильтрами и командами, что и синхронный бот.
+    """
+    if config.API_URL:
+        asyncio_helper.API_URL = config.API_URL
+    if config.API_FILE_URL:
+        asyncio_helper.FILE_URL = config.API_FILE_URL
+    instrument_async_telegram_api()
+    state_storage = TTLStateStorage(config.STATE_TTL, config.STATE_MAX_ENTRIES, config.STATE_SNAPSHOT_PATH)
+    state_storage.start_sweeper(config.STATE_SWEEP_INTERVAL)
+    state = AsyncTTLStateStorage(state_storage)
+    auth_middleware_instance = AsyncAdministatorMiddleware()
+
+    async_bot = AsyncAppTeleBot(config.TOKEN, parse_mode='HTML', state_storage=state)
+    async_bot.auth_middleware_instance_ref = auth_middleware_instance
+    async_bot.photo_file_ids.start_flusher(config.FILE_ID_FLUSH_INTERVAL)
+
+    metrics_middleware_instance = AsyncMetricsMiddleware(metrics)
+
+    async_bot.setup_middleware(auth_middleware_instance)
+    async_bot.setup_middleware(metrics_middleware_instance)
+    async_bot.add_custom_filter(telebot.asyncio_filters.StateFilter(async_bot))
+
+    register_all_async_handlers(async_bot)
+    metrics_middleware_instance.set_known_commands(async_bot.message_handlers)
+    logger.info("Async bot initialized.")
+    return async_bot
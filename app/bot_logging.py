@@ -1,22 +1,137 @@
 # Файл: bot_logging.py
+import atexit
 import logging
+import logging.handlers
+import queue
+import random
 import sys
 
 # Флаг, чтобы гарантировать, что основная настройка выполняется только один раз.
 # Последующие вызовы setup_app_logging могут обновлять уровни.
 _logging_configured_globally = False
 
-def setup_app_logging(log_level_str: str, log_file: str = "app.log", force_reconfigure: bool = False):
+# Фоновый поток, который пишет записи из очереди в файл и консоль
+_queue_listener: logging.handlers.QueueListener | None = None
+
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Пропускает только долю rate записей уровня DEBUG; остальные уровни проходят всегда.
+
+    Фильтр стоит на QueueHandler, поэтому отброшенные записи не форматируются и не попадают в очередь.
+    """
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class ProcessLabelFilter(logging.Filter):
+    """
+    Добавляет метку процесса к имени логгера: в общем app.log видно, какой воркер сделал запись.
+    """
+
+    def __init__(self, label: str):
+        super().__init__()
+        self.label = label
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.name = f"{self.label}:{record.name}"
+        return True
+
+
+class _ForwardingHandler(logging.Handler):
+    """
+    Передает записи из дочерних процессов обработчикам QueueListener этого процесса.
+    Записи уже отфильтрованы и отформатированы в дочернем процессе (QueueHandler.prepare).
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        listener = _queue_listener
+        if listener is None:
+            return
+        for handler in listener.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def _build_file_handler(log_file: str, max_bytes: int, backup_count: int, rotate_when: str) -> logging.Handler:
+    if rotate_when:
+        # Ротация по времени, например "midnight" или "H"
+        return logging.handlers.TimedRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_count, encoding='utf-8')
+    # Ротация по размеру; max_bytes = 0 отключает ротацию
+    return logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+
+
+def stop_app_logging():
+    """
+    Останавливает фоновый поток логирования, дописав все записи из очереди.
+    """
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+def setup_worker_logging(log_queue, log_level_str: str, label: str, debug_sample_rate: float = 1.0):
+    """
+    Настраивает логирование дочернего процесса (воркера app/sharding.py): записи уходят в
+    межпроцессную очередь log_queue, а в файл и консоль их пишет родитель (forward_worker_logs).
+
+    Последующие вызовы setup_app_logging (перезагрузка конфигурации) только меняют уровень
+    и долю DEBUG-записей.
+    """
+    global _logging_configured_globally
+    numeric_level = getattr(logging, log_level_str.upper(), None)
+    if not isinstance(numeric_level, int):
+        numeric_level = logging.INFO
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+    queue_handler.addFilter(ProcessLabelFilter(label))
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(numeric_level)
+    _logging_configured_globally = True
+
+
+def forward_worker_logs(log_queue) -> logging.handlers.QueueListener:
+    """
+    Запускает поток, который пишет записи дочерних процессов из log_queue в те же файл и консоль,
+    что и записи этого процесса. Останавливается вызовом stop() у возвращенного QueueListener.
+    """
+    listener = logging.handlers.QueueListener(log_queue, _ForwardingHandler())
+    listener.start()
+    return listener
+
+
+def setup_app_logging(log_level_str: str, log_file: str = "app.log", force_reconfigure: bool = False,
+                      max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, rotate_when: str = "",
+                      debug_sample_rate: float | None = None):
     """
     Настраивает или перенастраивает корневой логгер приложения.
 
+    Потоки обработчиков только кладут запись в очередь (QueueHandler); запись в файл и
+    консоль выполняет отдельный поток QueueListener, поэтому диск и stdout не задерживают ответы.
+
     :param log_level_str: Уровень логирования в виде строки (например, "INFO", "DEBUG").
     :param log_file: Имя файла для логирования.
+    :param max_bytes: Размер файла, после которого он ротируется (0 — без ротации по размеру).
+    :param backup_count: Сколько старых файлов хранить.
+    :param rotate_when: Интервал ротации по времени (например, "midnight"); если задан, заменяет ротацию по размеру.
+    :param debug_sample_rate: Доля сохраняемых DEBUG-записей (1.0 — все). None — при первой настройке
+                              все записи, при повторном вызове доля не меняется.
     :param force_reconfigure: Если True, удаляет существующие обработчики и настраивает заново.
                               Используется, например, при перезагрузке конфига, чтобы применить новые пути к файлам или форматы.
                               Если False и логирование уже настроено, только обновит уровни.
     """
-    global _logging_configured_globally
+    global _logging_configured_globally, _queue_listener
 
     # Преобразуем строковый уровень в числовой logging уровень
     numeric_level = getattr(logging, log_level_str.upper(), None)
@@ -31,19 +146,33 @@ def setup_app_logging(log_level_str: str, log_file: str = "app.log", force_recon
         root_logger.setLevel(numeric_level)
         for handler in root_logger.handlers:
             handler.setLevel(numeric_level) 
+        if _queue_listener is not None:
+            for handler in _queue_listener.handlers:
+                handler.setLevel(numeric_level)
+        if debug_sample_rate is not None:
+            # Фильтр выборки стоит на QueueHandler этого процесса (и воркера — см. setup_worker_logging)
+            for handler in root_logger.handlers:
+                for log_filter in handler.filters:
+                    if isinstance(log_filter, DebugSamplingFilter):
+                        log_filter.rate = debug_sample_rate
         logging.info(f"Уровень логирования динамически обновлен на {log_level_str.upper()}.")
         return
 
+    if debug_sample_rate is None:
+        debug_sample_rate = 1.0
+
     if force_reconfigure and root_logger.hasHandlers():
         logging.info("Принудительная перенастройка логирования. Удаление существующих обработчиков.")
         for handler in list(root_logger.handlers): 
             root_logger.removeHandler(handler)
             handler.close() 
+        stop_app_logging()
 
     handlers = []
+    file_handler = None
 
     try:
-        file_handler = logging.FileHandler(log_file, encoding='utf-8', mode='a') 
+        file_handler = _build_file_handler(log_file, max_bytes, backup_count, rotate_when)
         file_handler.setFormatter(logging.Formatter(
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
@@ -63,12 +192,13 @@ def setup_app_logging(log_level_str: str, log_file: str = "app.log", force_recon
     handlers.append(stream_handler)
     
     if not root_logger.hasHandlers() or force_reconfigure:
-        logging.basicConfig(
-            level=numeric_level,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S',
-            handlers=handlers if handlers else None 
-        )
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+        _queue_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _queue_listener.start()
+        root_logger.addHandler(queue_handler)
+        root_logger.setLevel(numeric_level)
     else: 
         root_logger.setLevel(numeric_level)
 
@@ -76,6 +206,12 @@ def setup_app_logging(log_level_str: str, log_file: str = "app.log", force_recon
 
     _logging_configured_globally = True
     logging.info(f"Логирование настроено. Уровень: {log_level_str.upper()}. Файл: '{log_file if file_handler in handlers else 'N/A'}'")
+    if debug_sample_rate < 1.0:
+        logging.info(f"DEBUG-записи сохраняются выборочно: {debug_sample_rate:.0%}.")
+
+
+# Дописываем очередь при обычном завершении процесса, даже если stop_app_logging не вызван явно
+atexit.register(stop_app_logging)
 
 
 logger = logging.getLogger(__name__)
\ No newline at end of file
@@ -1,7 +1,10 @@
 # Файл: config.py
 import configparser
 import os
+import re
 import logging # Добавим логгирование и сюда
+import threading
+from typing import Callable, NamedTuple
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +18,9 @@ CONFIG_SECTION_NAME = 'Settings'
 # Этот путь должен быть корректным относительно места запуска скрипта или абсолютным.
 # Для простоты, если config.py в корне пакета, а config.ini рядом:
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE_PATH = os.path.join(SCRIPT_DIR, CONFIG_FILE_NAME)
+# Переменная окружения BOT_CONFIG задает другой файл (например, для нагрузочного теста tools/load_test.py)
+CONFIG_ENV_VAR = 'BOT_CONFIG'
+CONFIG_FILE_PATH = os.environ.get(CONFIG_ENV_VAR) or os.path.join(SCRIPT_DIR, CONFIG_FILE_NAME)
 
 
 # --- Значения по умолчанию ---
@@ -23,22 +28,176 @@ DEFAULT_TOKEN = "YOUR_DEFAULT_TOKEN_IF_NOT_IN_CONFIG"
 DEFAULT_ADMIN_IDS_LIST = [] # Пустой список по умолчанию
 DEFAULT_LOG_LEVEL = "DEBUG"
 
+
+class Setting(NamedTuple):
+    """
+    Параметр секции [Settings]: имя (оно же имя глобальной переменной модуля), значение по умолчанию,
+    тип (str, int или float) и нормализация строкового значения.
+    """
+    name: str
+    default: object
+    value_type: type = str
+    normalize: Callable[[str], str] | None = None
+
+
+# Единственный список параметров: по нему заполняются значения по умолчанию и разбирается config.ini.
+# ADMIN_IDS разбирается отдельно (список через запятую) и единственный записывается ботом в файл.
+SETTINGS: tuple[Setting, ...] = (
+    Setting("TOKEN", DEFAULT_TOKEN),
+    Setting("LOG_LEVEL", DEFAULT_LOG_LEVEL, normalize=str.upper),
+    Setting("LOG_MAX_MB", 10, int), # Размер app.log, после которого файл ротируется; 0 — без ротации по размеру
+    Setting("LOG_BACKUP_COUNT", 5, int),
+    Setting("LOG_ROTATE_WHEN", ""), # Ротация по времени (например, midnight) вместо ротации по размеру
+    Setting("LOG_DEBUG_SAMPLE_RATE", 1.0, float), # Доля сохраняемых DEBUG-записей, от 0 до 1
+    Setting("CONFIG_WATCH_INTERVAL", 2, float), # Период проверки изменения config.ini, секунды; 0 — без автоперезагрузки
+    Setting("BARCODE_CACHE_DIR", "barcode_cache"), # Пустая строка отключает дисковый уровень кэша
+    Setting("BARCODE_CACHE_MAX_MB", 32, int),
+    Setting("BARCODE_CACHE_DISK_MAX_MB", 256, int), # Лимит дискового уровня кэша; сверх него удаляются давно не использованные; 0 — без ограничения
+    Setting("BARCODE_ENGINE", "imagewriter", normalize=str.lower), # imagewriter (python-barcode) или fast (встроенный растеризатор)
+    Setting("RENDER_POOL_SIZE", 2, int), # Количество процессов отрисовки (при SHARD_WORKERS — в каждом воркере); 0 — рисовать в потоке обработчика
+    Setting("RENDER_QUEUE_DEPTH", 32, int), # Максимум одновременно ожидающих задач отрисовки
+    Setting("RENDER_TIMEOUT", 10.0, float), # Таймаут одной задачи отрисовки, секунды
+    Setting("NUM_THREADS", 2, int), # Потоки обработчиков TeleBot
+    Setting("UPDATE_MODE", "polling", normalize=str.lower), # polling или webhook
+    Setting("WEBHOOK_LISTEN", "127.0.0.1"),
+    Setting("WEBHOOK_PORT", 8443, int),
+    Setting("WEBHOOK_PATH", "/webhook"),
+    Setting("WEBHOOK_URL", ""), # Публичный URL для setWebhook; пустая строка — webhook настраивается вручную
+    Setting("WEBHOOK_SECRET", ""),
+    Setting("WEBHOOK_MAX_BODY_KB", 1024, int),
+    Setting("STORAGE_BACKEND", "json", normalize=str.lower), # json (data.json целиком) или sqlite
+    Setting("STORAGE_SQLITE_PATH", "data.sqlite3"),
+    Setting("STORAGE_CACHE_SIZE", 1024, int), # Сколько пользователей держать в кэше чтения SQLite
+    Setting("FILE_ID_MAX_ENTRIES", 50000, int), # Сколько file_id хранить в file_ids.json; давно не использованные вытесняются
+    Setting("FILE_ID_FLUSH_INTERVAL", 30, float), # Период записи file_ids.json на диск, секунды; 0 — при каждом новом file_id
+    Setting("STATE_TTL", 3600, float), # Время жизни состояния (например, ожидания кодов) без обращений, секунды; 0 — бессрочно
+    Setting("STATE_MAX_ENTRIES", 10000, int),
+    Setting("STATE_SWEEP_INTERVAL", 60, float), # Период фоновой очистки истекших состояний, секунды
+    Setting("STATE_SNAPSHOT_PATH", ""), # Файл снимка состояний для переживания перезапуска; пустая строка — без снимка
+    Setting("UNAUTHORIZED_MAX_TRACKED", 1000, int), # Сколько нарушителей хранить для /unauthorized
+    Setting("UNAUTHORIZED_LOG_INTERVAL", 300, float), # Не чаще одной записи в лог об одном нарушителе за столько секунд
+    Setting("UNAUTHORIZED_PERSIST_PATH", ""), # Файл для сохранения списка нарушителей; пустая строка — только в памяти
+    Setting("UNAUTHORIZED_PERSIST_INTERVAL", 60, float),
+    Setting("API_URL", ""), # Адрес Bot API в формате telebot (https://host/bot{0}/{1}); пустая строка — api.telegram.org
+    Setting("OUTBOUND_GLOBAL_RATE", 30, float), # Исходящих запросов в секунду суммарно
+    Setting("OUTBOUND_PRIVATE_RATE", 1, float), # Запросов в секунду в один личный чат
+    Setting("OUTBOUND_GROUP_PER_MINUTE", 20, float), # Запросов в минуту в одну группу
+    Setting("OUTBOUND_MAX_RETRIES", 3, int), # Повторов запроса после ответа 429
+    Setting("OUTBOUND_WORKERS", 4, int), # Одновременных запросов в разные чаты
+    Setting("API_FILE_URL", ""), # Адрес скачивания файлов (https://host/file/bot{0}/{1}); пустая строка — api.telegram.org
+    Setting("IMPORT_MAX_FILE_MB", 20, int), # Максимальный размер файла со списком кодов (Bot API отдает ботам файлы до 20 МБ)
+    Setting("IMPORT_MAX_CODES", 50000, int), # Максимум кодов в списке пользователя после импорта из файла
+    Setting("SHEET_COLUMNS", 3, int), # Колонок на листе /sheet по умолчанию
+    Setting("SHEET_PAGE_SIZE", "A4"), # Формат страницы /sheet: A4, A5 или Letter
+    Setting("SHEET_FORMAT", "pdf", normalize=str.lower), # Формат файла /sheet по умолчанию: pdf (один документ) или png (страницы картинками)
+    Setting("SHEET_DPI", 300, int), # Разрешение страниц /sheet
+    Setting("SHEET_MAX_CODES", 5000, int), # Максимум кодов на листах одной команды /sheet
+    Setting("METRICS_ENABLED", 1, int), # 0 — не собирать метрики (гистограммы задержек, ошибки Bot API)
+    Setting("METRICS_PORT", 0, int), # Порт HTTP-выдачи /metrics в формате Prometheus; 0 — не запускать
+    Setting("METRICS_LISTEN", "127.0.0.1"),
+    Setting("PROFILE_ENABLED", 1, int), # 0 — команда /profile отключена
+    Setting("PROFILE_MAX_SECONDS", 300, int), # Максимальная длительность окна /profile, секунды
+    Setting("PREWARM_ENABLED", 1, int), # Прогревать отрисовку и хранилище в фоне после запуска опроса (1/0)
+    Setting("PREWARM_DELAY", 1.0, float), # Через сколько секунд после запуска начинать прогрев
+    Setting("SHARD_WORKERS", 0, int), # Процессов-воркеров за одним диспетчером обновлений; 0 — один процесс
+    Setting("SHARD_QUEUE_SIZE", 1000, int), # Обновлений в очереди одного воркера, после которых диспетчер ждет
+    Setting("SHARD_DRAIN_TIMEOUT", 30.0, float), # Сколько секунд при остановке ждать, пока воркеры обработают полученное
+    Setting("UPDATES_OFFSET_PATH", "update_offset.json"), # Номер последнего обработанного обновления; пустая строка — не сохранять
+    Setting("UPDATES_STALE_SECONDS", 300, int), # Сообщения старше стольких секунд считаются устаревшими; 0 — не проверять
+    Setting("UPDATES_STALE_POLICY", "collapse", normalize=str.lower), # keep, drop (отбросить устаревшие) или collapse (схлопнуть повторы)
+    Setting("UPDATES_LONG_POLL_TIMEOUT", 25, int), # Таймаут long polling getUpdates, секунды
+    Setting("PRERENDER_MAX_PER_USER", 100, int), # Сколько кодов нового списка отрисовать заранее в фоне; 0 — не отрисовывать
+    Setting("PRERENDER_CPU_BUDGET", 0.25, float), # Доля времени одного процесса отрисовки, которую может занимать фоновая отрисовка (0..1]
+)
+
 # --- Инициализация переменных конфигурации значениями по умолчанию ---
-TOKEN = DEFAULT_TOKEN
-ADMIN_IDS = list(DEFAULT_ADMIN_IDS_LIST) # Используем list() для создания копии
-LOG_LEVEL = DEFAULT_LOG_LEVEL
+# TOKEN, LOG_LEVEL, NUM_THREADS и остальные параметры из SETTINGS — глобальные переменные модуля (config.X)
+globals().update({setting.name: setting.default for setting in SETTINGS})
+ADMIN_IDS = frozenset(DEFAULT_ADMIN_IDS_LIST) # Неизменяемое множество: при изменении заменяется целиком
+
+class ConfigSnapshot(NamedTuple):
+    """
+    Неизменяемый снимок настроек, которые читаются на каждом сообщении.
+
+    Публикуется вместе с остальными параметрами одним присваиванием в конце load_config() и при
+    изменении списка администраторов, поэтому потоки обработчиков никогда не видят частично
+    загруженную конфигурацию.
+    """
+    admin_ids: frozenset
+    log_level: str
+
+
+SNAPSHOT = ConfigSnapshot(ADMIN_IDS, LOG_LEVEL)
+
+# Сериализует изменения конфигурации (загрузка, /addadmin, /deladmin, автоперезагрузка); чтение без блокировок
+_write_lock = threading.RLock()
+_file_signature = None # (mtime_ns, size) файла на момент последней загрузки/сохранения
+
+
+def is_admin_id(user_id) -> bool:
+    return user_id in SNAPSHOT.admin_ids
+
+
+def _publish_snapshot() -> None:
+    global SNAPSHOT
+    SNAPSHOT = ConfigSnapshot(ADMIN_IDS, LOG_LEVEL)
+
+
+def _read_file_signature(file_path: str):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _get_number(config_parser: configparser.ConfigParser, option: str, default, file_path: str, number_type=int):
+    """
+    Читает числовой параметр из секции настроек; при неверном формате возвращает значение по умолчанию.
+    """
+    getter = config_parser.getfloat if number_type is float else config_parser.getint
+    try:
+        return getter(CONFIG_SECTION_NAME, option, fallback=default)
+    except ValueError:
+        logger.warning(
+            f"Неверный формат {option} в '{file_path}'. "
+            f"Используется значение по умолчанию: {default}"
+        )
+        return default
+
+def _get_setting(config_parser: configparser.ConfigParser, setting: Setting, file_path: str):
+    if setting.value_type is not str:
+        return _get_number(config_parser, setting.name, setting.default, file_path, setting.value_type)
+    value = config_parser.get(CONFIG_SECTION_NAME, setting.name, fallback=setting.default).strip()
+    return setting.normalize(value) if setting.normalize else value
+
+def _parse_admin_ids(admin_ids_str: str, file_path: str) -> frozenset:
+    if not admin_ids_str or not admin_ids_str.strip():
+        return frozenset(DEFAULT_ADMIN_IDS_LIST)
+    try:
+        return frozenset(int(admin_id.strip()) for admin_id in admin_ids_str.split(',') if admin_id.strip())
+    except ValueError:
+        logger.warning(
+            f"Неверный формат ADMIN_IDS в '{file_path}'. "
+            f"Используется значение по умолчанию: {DEFAULT_ADMIN_IDS_LIST}"
+        )
+        return frozenset(DEFAULT_ADMIN_IDS_LIST)
 
 def load_config(file_path: str = CONFIG_FILE_PATH):
     """
     Загружает конфигурацию из INI-файла в глобальные переменные этого модуля.
     """
-    global TOKEN, ADMIN_IDS, LOG_LEVEL
+    with _write_lock:
+        _load_config_locked(file_path)
+
+
+def _load_config_locked(file_path: str):
+    global _file_signature
 
-    # Сначала установим значения по умолчанию
-    TOKEN = DEFAULT_TOKEN
-    ADMIN_IDS[:] = DEFAULT_ADMIN_IDS_LIST # Очищаем и заполняем существующий список
-    LOG_LEVEL = DEFAULT_LOG_LEVEL
-    
+    # Значения собираются в словарь и публикуются разом: потоки обработчиков читают config.X
+    # без блокировки и не должны увидеть значения по умолчанию посреди перезагрузки
+    values = {setting.name: setting.default for setting in SETTINGS}
+    admin_ids = frozenset(DEFAULT_ADMIN_IDS_LIST)
     config_parser = configparser.ConfigParser()
 
     if os.path.exists(file_path):
@@ -46,22 +205,9 @@ def load_config(file_path: str = CONFIG_FILE_PATH):
             config_parser.read(file_path, encoding='utf-8') # Добавим encoding
 
             if config_parser.has_section(CONFIG_SECTION_NAME):
-                TOKEN = config_parser.get(CONFIG_SECTION_NAME, 'TOKEN', fallback=DEFAULT_TOKEN)
-                
-                admin_ids_str = config_parser.get(CONFIG_SECTION_NAME, 'ADMIN_IDS', fallback='')
-                if admin_ids_str and admin_ids_str.strip():
-                    try:
-                        ADMIN_IDS[:] = [int(admin_id.strip()) for admin_id in admin_ids_str.split(',') if admin_id.strip()]
-                    except ValueError:
-                        logger.warning(
-                            f"Неверный формат ADMIN_IDS в '{file_path}'. "
-                            f"Используется значение по умолчанию: {DEFAULT_ADMIN_IDS_LIST}"
-                        )
-                        ADMIN_IDS[:] = DEFAULT_ADMIN_IDS_LIST
-                else:
-                    ADMIN_IDS[:] = DEFAULT_ADMIN_IDS_LIST
-
-                LOG_LEVEL = config_parser.get(CONFIG_SECTION_NAME, 'LOG_LEVEL', fallback=DEFAULT_LOG_LEVEL).upper()
+                parsed = {setting.name: _get_setting(config_parser, setting, file_path) for setting in SETTINGS}
+                admin_ids = _parse_admin_ids(config_parser.get(CONFIG_SECTION_NAME, 'ADMIN_IDS', fallback=''), file_path)
+                values = parsed
             else:
                 logger.info(f"Секция '[{CONFIG_SECTION_NAME}]' не найдена в '{file_path}'. Используются значения по умолчанию.")
         except configparser.Error as e:
@@ -72,26 +218,61 @@ def load_config(file_path: str = CONFIG_FILE_PATH):
         logger.warning(f"Файл конфигурации '{file_path}' не найден. Используются значения по умолчанию. "
                        "Пожалуйста, создайте файл config.ini или укажите правильный путь.")
 
-    logger.info(f"Конфигурация загружена: ADMIN_IDS={ADMIN_IDS}, LOG_LEVEL={LOG_LEVEL}")
+    _file_signature = _read_file_signature(file_path)
+    # dict.update выполняется целиком под GIL: другие потоки видят либо прежние значения, либо новые
+    globals().update(values, ADMIN_IDS=admin_ids, SNAPSHOT=ConfigSnapshot(admin_ids, values['LOG_LEVEL']))
+    logger.info(f"Конфигурация загружена: ADMIN_IDS={sorted(ADMIN_IDS)}, LOG_LEVEL={LOG_LEVEL}")
 
 
 def save_config(file_path: str = CONFIG_FILE_PATH):
     """
-    Сохраняет текущие значения TOKEN, ADMIN_IDS, LOG_LEVEL в INI-файл.
+    Сохраняет в INI-файл ADMIN_IDS — единственный параметр, который бот меняет сам (/addadmin, /deladmin).
+
+    Остальные строки файла (комментарии, порядок, прочие параметры) не меняются.
     """
-    config_parser = configparser.ConfigParser()
-    
-    if not config_parser.has_section(CONFIG_SECTION_NAME):
-        config_parser.add_section(CONFIG_SECTION_NAME)
-        
-    config_parser.set(CONFIG_SECTION_NAME, 'TOKEN', str(TOKEN)) # Убедимся, что токен это строка
-    admin_ids_str = ",".join(map(str, ADMIN_IDS))
-    config_parser.set(CONFIG_SECTION_NAME, 'ADMIN_IDS', admin_ids_str)
-    config_parser.set(CONFIG_SECTION_NAME, 'LOG_LEVEL', str(LOG_LEVEL))
+    with _write_lock:
+        return _save_config_locked(file_path)
+
+
+def _set_option_line(lines: list[str], option: str, value: str) -> list[str]:
+    """
+    Заменяет строку option в секции настроек на "option = value" или добавляет ее в начало секции.
+    """
+    new_line = f"{option} = {value}\n"
+    section_header = f"[{CONFIG_SECTION_NAME}]"
+    option_pattern = re.compile(rf"\s*{re.escape(option)}\s*[=:]", re.IGNORECASE)
+    section_index = None
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith("["):
+            if section_index is not None:
+                break # Секция настроек закончилась, параметра в ней нет
+            if stripped == section_header:
+                section_index = index
+        elif section_index is not None and option_pattern.match(line):
+            return lines[:index] + [new_line] + lines[index + 1:]
+    if section_index is None:
+        if lines and not lines[-1].endswith("\n"):
+            lines = lines + ["\n"]
+        return lines + [f"{section_header}\n", new_line]
+    return lines[:section_index + 1] + [new_line] + lines[section_index + 1:]
 
+
+def _save_config_locked(file_path: str) -> bool:
+    global _file_signature
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            config_parser.write(f)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            lines = []
+        lines = _set_option_line(lines, 'ADMIN_IDS', ",".join(map(str, sorted(ADMIN_IDS))))
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, file_path)
+        # Собственная запись не должна вызывать автоперезагрузку
+        _file_signature = _read_file_signature(file_path)
         logger.info(f"Конфигурация успешно сохранена в '{file_path}'.")
         return True
     except IOError as e:
@@ -101,4 +282,82 @@ def save_config(file_path: str = CONFIG_FILE_PATH):
         logger.error(f"Непредвиденная ошибка при сохранении конфигурации '{file_path}': {e}")
         return False
 
-load_config()
\ No newline at end of file
+def _update_admin_ids(new_admin_ids: frozenset, file_path: str) -> bool:
+    global ADMIN_IDS
+    with _write_lock:
+        previous_admin_ids = ADMIN_IDS
+        ADMIN_IDS = new_admin_ids
+        if not _save_config_locked(file_path):
+            ADMIN_IDS = previous_admin_ids # Откатываем изменение, если сохранение не удалось
+            return False
+        _publish_snapshot()
+        return True
+
+
+def add_admin(user_id: int, file_path: str = CONFIG_FILE_PATH) -> bool:
+    """
+    Добавляет администратора и сохраняет конфигурацию. Возвращает False, если сохранить не удалось.
+    """
+    with _write_lock:
+        return _update_admin_ids(ADMIN_IDS | {user_id}, file_path)
+
+
+def remove_admin(user_id: int, file_path: str = CONFIG_FILE_PATH) -> bool:
+    """
+    Удаляет администратора и сохраняет конфигурацию. Возвращает False, если сохранить не удалось.
+    """
+    with _write_lock:
+        return _update_admin_ids(ADMIN_IDS - {user_id}, file_path)
+
+
+class ConfigWatcher:
+    """
+    Следит за временем изменения config.ini и перезагружает конфигурацию без /reloadcfg.
+
+    Опрос mtime раз в interval секунд — один os.stat, без сторонних зависимостей (inotify и т.п.).
+    """
+
+    def __init__(self, interval: float, on_reload: Callable[[], None] | None = None, file_path: str = CONFIG_FILE_PATH):
+        self.interval = interval
+        self.on_reload = on_reload
+        self.file_path = file_path
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Автоперезагрузка '{self.file_path}' включена (проверка каждые {self.interval} с).")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def check(self) -> bool:
+        """
+        Перезагружает конфигурацию, если файл изменился. Возвращает True, если была перезагрузка.
+        """
+        with _write_lock:
+            signature = _read_file_signature(self.file_path)
+            if signature is None or signature == _file_signature:
+                return False
+            logger.info(f"Файл конфигурации '{self.file_path}' изменен, перезагружаем.")
+            _load_config_locked(self.file_path)
+        if self.on_reload is not None:
+            self.on_reload()
+        return True
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Ошибка автоперезагрузки конфигурации: {e}", exc_info=True)
+
+
+load_config()
@@ -1,7 +1,40 @@
-from telebot import TeleBot
-from .middlewares import AdministatorMiddleware
-from typing import Union
-from .utils.saving_and_loading import load_json
+import os
+import time
+from telebot import TeleBot, types
+from .middlewares import AdministatorMiddleware, RECEIVED_AT_ATTR
+from . import config
+from typing import List, NamedTuple, Union
+from .utils.saving_and_loading import create_barcode_storage, FileIdIndex, STORAGE_BACKEND_SQLITE
+from .utils.outbound import OutboundScheduler
+
+
+class WorkerShard(NamedTuple):
+    """
+    Номер процесса-воркера в режиме нескольких процессов (SHARD_WORKERS, см. app/sharding.py).
+    """
+    index: int
+    count: int
+
+    def path(self, path: str) -> str:
+        """
+        Отдельный файл воркера: 'file_ids.json' -> 'file_ids.shard1.json'. Пустой путь остается пустым.
+        """
+        if not path:
+            return path
+        root, extension = os.path.splitext(path)
+        return f"{root}.shard{self.index}{extension}"
+
+
+def stamp_received(updates: List[types.Update]) -> None:
+    """
+    Запоминает время получения сообщений и callback-запросов: MetricsMiddleware считает по нему ожидание в пуле потоков.
+    """
+    received_at = time.perf_counter()
+    for update in updates:
+        for item in (update.message, update.callback_query):
+            # Воркер (app/sharding.py) отмечает обновление при получении из канала, до очереди пользователя
+            if item is not None and not hasattr(item, RECEIVED_AT_ATTR):
+                setattr(item, RECEIVED_AT_ATTR, received_at)
 
 class AppTeleBot(TeleBot):
     """
@@ -9,8 +42,31 @@ class AppTeleBot(TeleBot):
     """
     auth_middleware_instance_ref: Union[AdministatorMiddleware, None]
 
-    def __init__(self, token: str, *args, **kwargs):
+    def __init__(self, token: str, *args, shard: WorkerShard | None = None, **kwargs):
         super().__init__(token, *args, **kwargs)
         # Инициализируем атрибут значением по умолчанию (например, None)
         self.auth_middleware_instance_ref = None
-        self.user_barcodes = load_json()
\ No newline at end of file
+        self.shard = shard
+        storage_backend, file_ids_path = config.STORAGE_BACKEND, None
+        global_rate, group_per_minute = config.OUTBOUND_GLOBAL_RATE, config.OUTBOUND_GROUP_PER_MINUTE
+        if shard is not None:
+            # data.json переписывается целиком и не выдержит записи из нескольких процессов, а SQLite выдержит
+            storage_backend = STORAGE_BACKEND_SQLITE
+            file_ids_path = shard.path('file_ids.json')
+            # Лимит Telegram общий на бота: делим его между воркерами поровну. Участники одной группы
+            # попадают в разные воркеры (маршрут по from_user.id), поэтому лимит группы делится так же
+            global_rate = global_rate / shard.count
+            group_per_minute = group_per_minute / shard.count
+        # Хранилище списков кодов пользователей (data.json или SQLite, см. STORAGE_BACKEND)
+        self.user_barcodes = create_barcode_storage(storage_backend, sqlite_path=config.STORAGE_SQLITE_PATH,
+                                                    cache_size=config.STORAGE_CACHE_SIZE)
+        # Индекс уже загруженных в Telegram изображений: ключ отрисовки -> file_id
+        self.photo_file_ids = FileIdIndex(file_ids_path, max_entries=config.FILE_ID_MAX_ENTRIES)
+        # Исходящая очередь с учетом лимитов Telegram; запускается в app/factory.py
+        self.outbound = OutboundScheduler(global_rate, config.OUTBOUND_PRIVATE_RATE,
+                                          group_per_minute, config.OUTBOUND_MAX_RETRIES,
+                                          config.OUTBOUND_WORKERS)
+
+    def process_new_updates(self, updates: List[types.Update]):
+        stamp_received(updates)
+        super().process_new_updates(updates)
@@ -0,0 +1,250 @@
+# Файл: factory.py
+"""
+Сборка приложения: логирование, автоперезагрузка конфигурации, пул отрисовки, метрики и бот.
+
+Импорт пакета app ничего не запускает — main.py и main_async.py явно вызывают create_app()
+или start_runtime(). Тяжелые зависимости отрисовки (python-barcode, Pillow, NumPy) и данные
+пользователей загружаются при первом обращении, а prewarm() делает это в фоне, когда бот
+уже принимает обновления.
+"""
+import logging
+import threading
+import time
+
+import telebot.custom_filters
+from telebot import apihelper
+
+from . import config
+from .bot_logging import setup_app_logging
+from .entities import AppTeleBot, WorkerShard
+from .handlers import register_all_handlers, shutdown_handler_pools
+from .middlewares import AdministatorMiddleware, MetricsMiddleware, ProfilingMiddleware
+from .updates import OffsetStore, StalenessFilter, UpdatePoller
+from .utils.barcode_sheet import SAMPLE_CODE
+from .utils.barcode_utils import (
+    configure_barcode_cache,
+    configure_barcode_engine,
+    load_numpy,
+    render_ean13_png,
+    resolve_barcode_engine,
+)
+from .utils.metrics import MetricsServer, instrument_telegram_api, metrics
+from .utils.prerender import prerenderer
+from .utils.profiling import profiler
+from .utils.render_executor import render_executor
+from .utils.state_storage import TTLStateStorage
+
+logger = logging.getLogger(__name__)
+
+
+class Runtime:
+    """
+    Общая для синхронного и асинхронного бота инфраструктура: автоперезагрузка конфигурации,
+    пул процессов отрисовки с фоновой отрисовкой списков и HTTP-сервер метрик.
+    """
+
+    def __init__(self, config_watcher: config.ConfigWatcher, metrics_server: MetricsServer | None):
+        self.config_watcher = config_watcher
+        self.metrics_server = metrics_server
+
+    def stop(self) -> None:
+        self.config_watcher.stop()
+        profiler.cancel() # Прерываем ожидание окна /profile, чтобы его поток не задерживал выход
+        prerenderer.stop()
+        render_executor.shutdown()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+
+class Application:
+    """
+    Синхронный бот вместе с инфраструктурой, которую он использует.
+    """
+
+    def __init__(self, runtime: Runtime, bot: AppTeleBot):
+        self.runtime = runtime
+        self.bot = bot
+
+    def start_prewarm(self) -> threading.Thread | None:
+        return start_prewarm(self.bot)
+
+    def shutdown(self) -> None:
+        shutdown_handler_pools() # Импорт, /sheet и /profile еще отправляют ответы и пишут списки кодов
+        self.bot.outbound.stop() # Досылаем поставленные в очередь ответы
+        self.bot.photo_file_ids.stop() # Записываем file_id, полученные при досылке
+        self.runtime.stop()
+        self.bot.user_barcodes.close()
+        self.bot.current_states.stop()
+        self.bot.auth_middleware_instance_ref.access_tracker.stop()
+
+
+# Параметры ротации app.log, с которыми настроено логирование; None в процессе-воркере (файл пишет диспетчер)
+_log_rotation: tuple[int, int, str] | None = None
+
+
+def _current_log_rotation() -> tuple[int, int, str]:
+    return config.LOG_MAX_MB, config.LOG_BACKUP_COUNT, config.LOG_ROTATE_WHEN
+
+
+def _apply_reloaded_config():
+    # Уровень логирования, выборка DEBUG-записей и сбор метрик применяются вручную после автоперезагрузки
+    setup_app_logging(config.LOG_LEVEL, debug_sample_rate=config.LOG_DEBUG_SAMPLE_RATE)
+    metrics.enabled = bool(config.METRICS_ENABLED)
+    if _log_rotation is not None and _current_log_rotation() != _log_rotation:
+        # Файловый обработчик создается один раз при запуске, пересоздавать его на ходу небезопасно
+        max_mb, backup_count, rotate_when = _log_rotation
+        logger.warning(f"Параметры ротации app.log (LOG_MAX_MB, LOG_BACKUP_COUNT, LOG_ROTATE_WHEN) изменены, "
+                       f"но применятся только после перезапуска бота. Сейчас действуют: LOG_MAX_MB={max_mb}, "
+                       f"LOG_BACKUP_COUNT={backup_count}, LOG_ROTATE_WHEN='{rotate_when}'.")
+
+
+def start_runtime(shard: WorkerShard | None = None) -> Runtime:
+    """
+    Настраивает логирование, кэш и пул отрисовки, фоновую отрисовку списков, адрес Bot API и метрики.
+
+    В процессе-воркере (shard) логирование уже направлено в диспетчер (sharding.run_worker),
+    а HTTP-сервер метрик слушает METRICS_PORT + 1 + номер воркера.
+    """
+    global _log_rotation
+    if shard is None:
+        _log_rotation = _current_log_rotation()
+        setup_app_logging(config.LOG_LEVEL, max_bytes=config.LOG_MAX_MB * 1024 * 1024,
+                          backup_count=config.LOG_BACKUP_COUNT, rotate_when=config.LOG_ROTATE_WHEN,
+                          debug_sample_rate=config.LOG_DEBUG_SAMPLE_RATE)
+    logger.info("Initializing bot...")
+    logger.debug("Загруженные ADMIN_IDS: %s", sorted(config.ADMIN_IDS))
+
+    config_watcher = config.ConfigWatcher(config.CONFIG_WATCH_INTERVAL, on_reload=_apply_reloaded_config)
+    config_watcher.start()
+
+    configure_barcode_cache(config.BARCODE_CACHE_MAX_MB * 1024 * 1024, config.BARCODE_CACHE_DIR,
+                            config.BARCODE_CACHE_DISK_MAX_MB * 1024 * 1024)
+    configure_barcode_engine(config.BARCODE_ENGINE)
+    render_executor.start(config.RENDER_POOL_SIZE, config.RENDER_QUEUE_DEPTH, config.RENDER_TIMEOUT)
+    prerenderer.start(config.PRERENDER_MAX_PER_USER, config.PRERENDER_CPU_BUDGET)
+
+    if config.API_URL:
+        # Например, локальный Bot API сервер или tools/fake_bot_api.py для нагрузочных тестов
+        apihelper.API_URL = config.API_URL
+        logger.info(f"Bot API: {config.API_URL}")
+    if config.API_FILE_URL:
+        apihelper.FILE_URL = config.API_FILE_URL
+
+    # Обертка вокруг запросов к Bot API ставится всегда: при METRICS_ENABLED = 0 она только проверяет флаг
+    metrics.enabled = bool(config.METRICS_ENABLED)
+    instrument_telegram_api()
+    metrics_server = None
+    if config.METRICS_PORT > 0:
+        metrics_port = config.METRICS_PORT if shard is None else config.METRICS_PORT + 1 + shard.index
+        try:
+            metrics_server = MetricsServer(config.METRICS_LISTEN, metrics_port)
+            metrics_server.start()
+        except OSError as e:
+            logger.error(f"Не удалось запустить HTTP-сервер метрик на {config.METRICS_LISTEN}:{metrics_port}: {e}")
+    return Runtime(config_watcher, metrics_server)
+
+
+def create_bot(shard: WorkerShard | None = None) -> AppTeleBot:
+    """
+    Создает AppTeleBot с middleware, фильтрами и обработчиками и запускает его исходящую очередь.
+
+    Данные пользователей (data.json или SQLite) при этом не читаются: хранилище загружается
+    при первом обращении или в prewarm(). Бот воркера (shard) не имеет своего пула потоков:
+    обновления в него передает sharding.UserLanes, сохраняя порядок по пользователю.
+    """
+    snapshot_path, persist_path = config.STATE_SNAPSHOT_PATH, config.UNAUTHORIZED_PERSIST_PATH
+    if shard is not None:
+        snapshot_path, persist_path = shard.path(snapshot_path), shard.path(persist_path)
+    # Состояния с ограниченным временем жизни: брошенный /codes не остается в памяти навсегда
+    state = TTLStateStorage(config.STATE_TTL, config.STATE_MAX_ENTRIES, snapshot_path)
+    state.start_sweeper(config.STATE_SWEEP_INTERVAL)
+    auth_middleware_instance = AdministatorMiddleware(persist_path)
+    metrics_middleware_instance = MetricsMiddleware(metrics)
+
+    bot = AppTeleBot(config.TOKEN, parse_mode='HTML', use_class_middlewares=True, state_storage=state,
+                     num_threads=config.NUM_THREADS, threaded=shard is None, shard=shard)
+    bot.auth_middleware_instance_ref = auth_middleware_instance
+    bot.outbound.start()
+    # file_ids.json пишется фоновым потоком, а не исходящими воркерами на каждый новый file_id
+    bot.photo_file_ids.start_flusher(config.FILE_ID_FLUSH_INTERVAL)
+
+    bot.setup_middleware(auth_middleware_instance)
+    # После auth middleware: отклоненные обновления не попадают в метрики обработчиков
+    bot.setup_middleware(metrics_middleware_instance)
+    bot.setup_middleware(ProfilingMiddleware(profiler))
+    bot.add_custom_filter(telebot.custom_filters.StateFilter(bot))
+
+    register_all_handlers(bot)
+    metrics_middleware_instance.set_known_commands(bot.message_handlers)
+
+    def outbound_metrics():
+        stats = bot.outbound.stats()
+        return [
+            ("bot_outbound_pending", "gauge", {}, stats["pending"]),
+            ("bot_outbound_in_flight", "gauge", {}, stats["in_flight"]),
+            ("bot_outbound_requests_total", "counter", {"result": "sent"}, stats["sent"]),
+            ("bot_outbound_requests_total", "counter", {"result": "failed"}, stats["failed"]),
+            ("bot_outbound_requests_total", "counter", {"result": "retried_429"}, stats["retried_429"]),
+            ("bot_outbound_requests_total", "counter", {"result": "merged"}, stats["merged"]),
+        ]
+
+    metrics.add_collector(outbound_metrics)
+    return bot
+
+
+def create_app(shard: WorkerShard | None = None) -> Application:
+    runtime = start_runtime(shard)
+    return Application(runtime, create_bot(shard))
+
+
+def create_update_poller(handle, allowed_updates: list[str]) -> UpdatePoller:
+    """
+    UpdatePoller с настройками UPDATES_*: сохранение номера последнего обновления,
+    политика устаревших сообщений и таймаут long polling.
+    """
+    return UpdatePoller(config.TOKEN, handle, allowed_updates, OffsetStore(config.UPDATES_OFFSET_PATH),
+                        StalenessFilter(config.UPDATES_STALE_SECONDS, config.UPDATES_STALE_POLICY),
+                        config.UPDATES_LONG_POLL_TIMEOUT)
+
+
+def prewarm(bot) -> None:
+    """
+    Загружает то, что иначе загрузилось бы на первом запросе: данные пользователей, индекс file_id,
+    python-barcode, Pillow и шрифт, NumPy и процессы пула отрисовки.
+
+    Подходит и для AsyncAppTeleBot: вызывается из отдельного потока, а не из цикла событий.
+    """
+    started = time.perf_counter()
+    steps = (
+        ("хранилище кодов", bot.user_barcodes.load),
+        ("индекс file_id", bot.photo_file_ids.load),
+        # Отрисовка мимо кэша: импортирует движок и загружает шрифт в основном процессе
+        ("отрисовка", lambda: render_ean13_png(SAMPLE_CODE, None, resolve_barcode_engine())),
+        ("NumPy", load_numpy),
+        ("пул отрисовки", lambda: render_executor.warm_up(SAMPLE_CODE)),
+    )
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            # Прогрев необязателен: то же самое повторится при первом запросе
+            logger.warning(f"Прогрев: шаг '{name}' не выполнен: {e}")
+    logger.info(f"Прогрев завершен за {time.perf_counter() - started:.2f} с.")
+
+
+def _prewarm_after(bot, delay: float) -> None:
+    # Задержка дает боту сначала начать опрос и ответить на накопившиеся обновления
+    if delay > 0:
+        time.sleep(delay)
+    prewarm(bot)
+
+
+def start_prewarm(bot) -> threading.Thread | None:
+    """
+    Запускает prewarm() в фоновом потоке через PREWARM_DELAY секунд, если он включен (PREWARM_ENABLED).
+    """
+    if not config.PREWARM_ENABLED:
+        return None
+    thread = threading.Thread(target=_prewarm_after, args=(bot, config.PREWARM_DELAY), name="prewarm", daemon=True)
+    thread.start()
+    return thread
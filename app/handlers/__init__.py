@@ -8,10 +8,42 @@ def register_all_handlers(bot: TeleBot):
     bot.register_message_handler(help_handler, commands=['help'], pass_bot=True)
     bot.register_message_handler(cancel_handler_state, commands=['cancel'], state='*', pass_bot=True)
     bot.register_message_handler(codes_handler, commands=['codes'], pass_bot=True)
+    # Обработчик файлов регистрируется раньше process_codes_input, который принимает сообщения любого типа
+    bot.register_message_handler(document_codes_handler, content_types=['document'], state=CodesStates.waiting_for_codes, pass_bot=True)
     bot.register_message_handler(process_codes_input, state=CodesStates.waiting_for_codes, pass_bot=True)
+    bot.register_callback_query_handler(import_mode_callback, func=is_import_callback, pass_bot=True)
     bot.register_message_handler(gen_handler, commands=['gen'], pass_bot=True)
     bot.register_message_handler(mycodes_handler, commands=['mycodes'], pass_bot=True)
+    bot.register_callback_query_handler(mycodes_page_callback, func=is_mycodes_callback, pass_bot=True)
+    bot.register_message_handler(sheet_handler, commands=['sheet'], pass_bot=True)
     bot.register_message_handler(unauthorized_list_handler, commands=['unauthorized'], pass_bot=True)
     bot.register_message_handler(add_admin_handler, commands=['addadmin'], pass_bot=True)
     bot.register_message_handler(del_admin_handler, commands=['deladmin'], pass_bot=True)
-    bot.register_message_handler(reload_config_handler, commands=['reloadcfg'], pass_bot=True)
\ No newline at end of file
+    bot.register_message_handler(reload_config_handler, commands=['reloadcfg'], pass_bot=True)
+    bot.register_message_handler(stats_handler, commands=['stats'], pass_bot=True)
+    bot.register_message_handler(profile_handler, commands=['profile'], pass_bot=True)
+
+def register_all_async_handlers(bot):
+    """
+    Registers async versions of all command handlers with an AsyncTeleBot instance.
+    """
+    from . import async_common
+
+    bot.register_message_handler(async_common.start_handler, commands=['start'], pass_bot=True)
+    bot.register_message_handler(async_common.help_handler, commands=['help'], pass_bot=True)
+    bot.register_message_handler(async_common.cancel_handler_state, commands=['cancel'], state='*', pass_bot=True)
+    bot.register_message_handler(async_common.codes_handler, commands=['codes'], pass_bot=True)
+    bot.register_message_handler(async_common.document_codes_handler, content_types=['document'],
+                                 state=CodesStates.waiting_for_codes, pass_bot=True)
+    bot.register_message_handler(async_common.process_codes_input, state=CodesStates.waiting_for_codes, pass_bot=True)
+    bot.register_callback_query_handler(async_common.import_mode_callback, func=is_import_callback, pass_bot=True)
+    bot.register_message_handler(async_common.gen_handler, commands=['gen'], pass_bot=True)
+    bot.register_message_handler(async_common.mycodes_handler, commands=['mycodes'], pass_bot=True)
+    bot.register_callback_query_handler(async_common.mycodes_page_callback, func=is_mycodes_callback, pass_bot=True)
+    bot.register_message_handler(async_common.sheet_handler, commands=['sheet'], pass_bot=True)
+    bot.register_message_handler(async_common.unauthorized_list_handler, commands=['unauthorized'], pass_bot=True)
+    bot.register_message_handler(async_common.add_admin_handler, commands=['addadmin'], pass_bot=True)
+    bot.register_message_handler(async_common.del_admin_handler, commands=['deladmin'], pass_bot=True)
+    bot.register_message_handler(async_common.reload_config_handler, commands=['reloadcfg'], pass_bot=True)
+    bot.register_message_handler(async_common.stats_handler, commands=['stats'], pass_bot=True)
+    bot.register_message_handler(async_common.profile_handler, commands=['profile'], pass_bot=True)
@@ -0,0 +1,497 @@
+"""
+Асинхронные версии обработчиков для AsyncTeleBot.
+
+Логика команд (разбор аргументов, тексты ответов, изменение конфигурации) берется из common.py,
+здесь только вызовы Bot API через await. Отрисовка и работа с файлами выполняются в пуле потоков,
+чтобы не блокировать цикл событий.
+"""
+import asyncio
+import html
+import logging
+import tempfile
+
+from telebot import types
+from telebot.asyncio_helper import ApiTelegramException
+
+from ..async_app import AsyncAppTeleBot
+from .. import config
+from ..states import CodesStates
+from ..utils.code_import import CodeImporter
+from ..utils.barcode_utils import parse_codes, barcode_render_key
+from ..utils.profiling import MODE_CPU, ProfilerBusyError, profiler
+from ..utils.prerender import prerenderer
+from ..utils.render_executor import render_executor, RenderQueueFullError
+from .common import (
+    ADMIN_ONLY_TEXT,
+    BATCH_SEND_ERROR_TEXT,
+    IMPORT_CALLBACK_PREFIX,
+    CODES_PROMPT_TEXT,
+    MEDIA_GROUP_LIMIT,
+    NO_STATE_TEXT,
+    NO_UNAUTHORIZED_TEXT,
+    PROFILE_BUSY_TEXT,
+    PROFILE_DISABLED_TEXT,
+    PROFILE_ERROR_TEXT,
+    PROFILE_TOP_N,
+    MYCODES_FOREIGN_TEXT,
+    NO_CODES_TEXT,
+    RENDER_BUSY_TEXT,
+    SHEET_ERROR_TEXT,
+    START_TEXT,
+    STATE_CANCELLED_TEXT,
+    apply_add_admin,
+    apply_del_admin,
+    apply_reload_config,
+    batch_problems_text,
+    build_album_media,
+    build_help_text,
+    build_import_mode_markup,
+    build_mycodes_page,
+    build_stats_text,
+    build_unauthorized_chunks,
+    codes_loaded_text,
+    codes_not_recognized_text,
+    check_import_document,
+    import_progress_text,
+    import_report_text,
+    gen_error_text,
+    gen_failed_text,
+    is_admin,
+    is_message_not_modified_error,
+    is_stale_file_id_error,
+    iter_sheet_pages,
+    parse_profile_args,
+    parse_sheet_args,
+    prepare_sheet,
+    profile_caption,
+    profile_file_names,
+    profile_started_text,
+    parse_mycodes_callback,
+    prepare_batch_item,
+    remember_album_file_ids,
+    remember_photo_file_id,
+    resolve_batch_codes,
+    resolve_gen_request,
+    run_code_import,
+    sheet_caption,
+    sheet_progress_text,
+    store_user_codes,
+    write_sheet_pdf,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def send_barcode_photo(bot: AsyncAppTeleBot, chat_id: int, code: str, caption: str, reply_to_message_id: int | None = None) -> bool:
+    """
+    Асинхронный аналог common.send_barcode_photo: отправка по file_id с повторной загрузкой при устаревшем id.
+    """
+    render_key = barcode_render_key(code)
+    file_id = bot.photo_file_ids.get(render_key) if render_key else None
+    if file_id:
+        try:
+            await bot.send_photo(chat_id, file_id, caption=caption, reply_to_message_id=reply_to_message_id, parse_mode="HTML")
+            return True
+        except ApiTelegramException as e:
+            if not is_stale_file_id_error(e):
+                raise
+            logger.info(f"file_id для {code} отклонен Telegram ({e.description}), загружаем изображение заново.")
+            bot.photo_file_ids.discard(render_key)
+
+    barcode_image_bytes = await asyncio.to_thread(render_executor.render, code)
+    if not barcode_image_bytes:
+        return False
+    sent_message = await bot.send_photo(chat_id, barcode_image_bytes, caption=caption,
+                                        reply_to_message_id=reply_to_message_id, parse_mode="HTML")
+    await asyncio.to_thread(remember_photo_file_id, bot, render_key, sent_message)
+    return True
+
+
+async def send_barcode_batch(bot: AsyncAppTeleBot, chat_id: int, codes: list[str], reply_to_message_id: int | None = None) -> list[str]:
+    """
+    Асинхронный аналог common.send_barcode_batch.
+    """
+    results = await asyncio.gather(
+        *(asyncio.to_thread(prepare_batch_item, bot, code) for code in codes),
+        return_exceptions=True,
+    )
+    ready, failed = [], []
+    for code, item in zip(codes, results):
+        if isinstance(item, BaseException):
+            logger.error(f"Ошибка генерации штрих-кода для {code} в пакетном режиме: {item}")
+            failed.append(code)
+        elif item[2] is None:
+            failed.append(code)
+        else:
+            ready.append(item)
+
+    for start in range(0, len(ready), MEDIA_GROUP_LIMIT):
+        chunk = ready[start:start + MEDIA_GROUP_LIMIT]
+        if len(chunk) == 1 or not await _send_album(bot, chat_id, chunk, reply_to_message_id):
+            # Одиночный код или альбом с устаревшим file_id — отправляем по одному с повторной загрузкой
+            for code, _, _ in chunk:
+                if not await send_barcode_photo(bot, chat_id, code, f"<code>{code}</code>", reply_to_message_id):
+                    failed.append(code)
+    return failed
+
+
+async def _send_album(bot: AsyncAppTeleBot, chat_id: int, items: list[tuple[str, str, object]], reply_to_message_id: int | None) -> bool:
+    try:
+        sent_messages = await bot.send_media_group(chat_id, build_album_media(items), reply_to_message_id=reply_to_message_id)
+    except ApiTelegramException as e:
+        if not is_stale_file_id_error(e) or not any(isinstance(photo, str) for _, _, photo in items):
+            raise
+        logger.info(f"Альбом с file_id отклонен Telegram ({e.description}), загружаем изображения заново.")
+        for _, render_key, photo in items:
+            if isinstance(photo, str):
+                bot.photo_file_ids.discard(render_key)
+        return False
+    await asyncio.to_thread(remember_album_file_ids, bot, items, sent_messages)
+    return True
+
+
+async def help_handler(message: types.Message, bot: AsyncAppTeleBot):
+    user_id = message.from_user.id if message.from_user else None
+    await bot.send_message(message.chat.id, build_help_text(user_id), parse_mode="HTML")
+
+
+async def start_handler(message: types.Message, bot: AsyncAppTeleBot):
+    await bot.send_message(message.chat.id, START_TEXT)
+
+
+async def codes_handler(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user:
+        logger.warning("Codes command received without from_user in message: %s", message.message_id)
+        return
+    await bot.set_state(message.from_user.id, CodesStates.waiting_for_codes, message.chat.id)
+    await bot.send_message(message.chat.id, CODES_PROMPT_TEXT, reply_to_message_id=message.message_id)
+
+
+async def process_codes_input(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user: return
+    if message.text and message.text.startswith('/'):
+        await bot.delete_state(message.from_user.id, message.chat.id)
+        return # Важно, чтобы другая команда могла быть обработана, не отправляем сообщение здесь
+
+    report = parse_codes(message.text or "")
+    logger.debug("Parsed codes for user %s: %d accepted, %d rejected", message.from_user.id,
+                 len(report.codes), len(report.bad_checksum) + len(report.rejected))
+
+    if not report.codes:
+        await bot.send_message(message.chat.id, codes_not_recognized_text(report), reply_to_message_id=message.message_id)
+        return
+
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    await asyncio.to_thread(store_user_codes, bot, message.from_user.id, report.codes)
+    await bot.send_message(message.chat.id, codes_loaded_text(report), reply_to_message_id=message.message_id)
+
+
+async def mycodes_handler(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user:
+        logger.warning("Mycodes command received without from_user in message: %s", message.message_id)
+        return
+    codes = bot.user_barcodes.get(message.from_user.id, [])
+    text, markup = build_mycodes_page(codes, message.from_user.id)
+    await bot.send_message(message.chat.id, text, reply_to_message_id=message.message_id, reply_markup=markup, parse_mode="HTML")
+
+
+async def mycodes_page_callback(call: types.CallbackQuery, bot: AsyncAppTeleBot):
+    parsed = parse_mycodes_callback(call.data)
+    if parsed is not None and parsed[0] != call.from_user.id:
+        await bot.answer_callback_query(call.id, MYCODES_FOREIGN_TEXT, show_alert=True)
+        return
+    await bot.answer_callback_query(call.id)
+    if parsed is None or call.message is None:
+        return
+    owner_id, cursor = parsed
+    codes = bot.user_barcodes.get(owner_id, [])
+    text, markup = build_mycodes_page(codes, owner_id, cursor)
+    try:
+        await bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup, parse_mode="HTML")
+    except ApiTelegramException as e:
+        if not is_message_not_modified_error(e):
+            raise
+
+
+async def _edit_message_quietly(bot: AsyncAppTeleBot, chat_id: int, message_id: int, text: str) -> None:
+    try:
+        await bot.edit_message_text(text, chat_id, message_id, parse_mode="HTML")
+    except ApiTelegramException as e:
+        if not is_message_not_modified_error(e):
+            logger.warning(f"Не удалось обновить сообщение {message_id} в чате {chat_id}: {e}")
+
+
+async def document_codes_handler(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user or not message.document: return
+    error_text = check_import_document(message.document)
+    if error_text:
+        await bot.reply_to(message, error_text)
+        return
+
+    user_id, chat_id = message.from_user.id, message.chat.id
+    existing_count = len(await asyncio.to_thread(bot.user_barcodes.get, user_id, []))
+    if not existing_count:
+        await bot.delete_state(user_id, chat_id)
+        status_message = await bot.send_message(chat_id, "Импорт файла...", reply_to_message_id=message.message_id)
+        await import_codes(bot, chat_id, user_id, message.document.file_id, message.document.file_size, False,
+                           status_message.message_id)
+        return
+
+    await bot.set_state(user_id, CodesStates.confirming_import, chat_id)
+    await bot.add_data(user_id, chat_id, import_file_id=message.document.file_id, import_file_size=message.document.file_size)
+    await bot.send_message(chat_id, f"Получен файл <code>{html.escape(message.document.file_name or '')}</code>. "
+                                    "Добавить коды к текущему списку или заменить его?",
+                           reply_to_message_id=message.message_id, reply_markup=build_import_mode_markup(existing_count),
+                           parse_mode="HTML")
+
+
+async def import_mode_callback(call: types.CallbackQuery, bot: AsyncAppTeleBot):
+    await bot.answer_callback_query(call.id)
+    user_id = call.from_user.id
+    if call.message is None:
+        return
+    chat_id = call.message.chat.id
+    if await bot.get_state(user_id, chat_id) != CodesStates.confirming_import.name:
+        return
+    async with bot.retrieve_data(user_id, chat_id) as data:
+        file_id, file_size = (data or {}).get("import_file_id"), (data or {}).get("import_file_size")
+    await bot.delete_state(user_id, chat_id)
+    if not file_id:
+        return
+    await _edit_message_quietly(bot, chat_id, call.message.message_id, "Импорт файла...")
+    await import_codes(bot, chat_id, user_id, file_id, file_size, call.data == f"{IMPORT_CALLBACK_PREFIX}append",
+                       call.message.message_id)
+
+
+async def import_codes(bot: AsyncAppTeleBot, chat_id: int, user_id: int, file_id: str, file_size: int | None,
+                       append: bool, status_message_id: int) -> None:
+    """
+    Асинхронный аналог common._import_codes_job: скачивание и разбор выполняются в потоке,
+    правки прогресса планируются обратно в цикл событий.
+    """
+    loop = asyncio.get_running_loop()
+
+    def on_progress(importer: CodeImporter) -> None:
+        asyncio.run_coroutine_threadsafe(
+            _edit_message_quietly(bot, chat_id, status_message_id, import_progress_text(importer, file_size)), loop)
+
+    try:
+        existing = await asyncio.to_thread(bot.user_barcodes.get, user_id, []) if append else ()
+        importer = CodeImporter(config.IMPORT_MAX_CODES, existing)
+        file_info = await bot.get_file(file_id)
+        error_text = await asyncio.to_thread(run_code_import, bot.token, file_info.file_path, importer, on_progress)
+        if error_text:
+            await _edit_message_quietly(bot, chat_id, status_message_id, error_text)
+            return
+        await asyncio.to_thread(store_user_codes, bot, user_id, importer.codes)
+        logger.info(f"Пользователь {user_id} импортировал {importer.added_count} кодов из файла "
+                    f"({importer.bytes_read} байт, режим {'append' if append else 'replace'}).")
+        await _edit_message_quietly(bot, chat_id, status_message_id, import_report_text(importer, append))
+    except Exception as e:
+        logger.error(f"Ошибка импорта файла для пользователя {user_id}: {e}", exc_info=True)
+        await _edit_message_quietly(bot, chat_id, status_message_id, "Произошла ошибка при импорте файла. Список не изменен.")
+
+
+async def sheet_handler(message: types.Message, bot: AsyncAppTeleBot):
+    """
+    Асинхронный аналог common.sheet_handler: страницы рисуются в потоке (через пул процессов),
+    отправка и правки прогресса — в цикле событий.
+    """
+    if not message.from_user: return
+    chat_id = message.chat.id
+    all_codes = await asyncio.to_thread(bot.user_barcodes.get, message.from_user.id, [])
+    if not all_codes:
+        await bot.reply_to(message, NO_CODES_TEXT)
+        return
+    request = parse_sheet_args(message.text.split()[1:])
+    if request.error_text:
+        await bot.reply_to(message, request.error_text, parse_mode="HTML")
+        return
+
+    codes = all_codes[:config.SHEET_MAX_CODES]
+    status_message = await bot.send_message(chat_id, "Подготовка листа...", reply_to_message_id=message.message_id)
+    loop = asyncio.get_running_loop()
+
+    def on_page(page_number: int) -> None:
+        asyncio.run_coroutine_threadsafe(
+            _edit_message_quietly(bot, chat_id, status_message.message_id, sheet_progress_text(page_number, page_count)), loop)
+
+    try:
+        layout, engine, error_text = await asyncio.to_thread(prepare_sheet, request, len(codes))
+        if error_text:
+            await _edit_message_quietly(bot, chat_id, status_message.message_id, error_text)
+            return
+        page_count = layout.page_count(len(codes))
+        caption = sheet_caption(len(codes), len(all_codes), page_count)
+
+        if request.sheet_format == "pdf":
+            with tempfile.TemporaryFile() as pdf_file:
+                await asyncio.to_thread(write_sheet_pdf, pdf_file, codes, layout, engine, on_page)
+                pdf_file.seek(0)
+                await bot.send_document(chat_id, pdf_file, caption=caption, reply_to_message_id=message.message_id,
+                                        visible_file_name="barcodes.pdf")
+        else:
+            pages = iter_sheet_pages(codes, layout, "png", engine)
+            for page_number in range(1, page_count + 1):
+                page_data = await asyncio.to_thread(next, pages)
+                await bot.send_document(chat_id, page_data, caption=caption if page_number == 1 else None,
+                                        reply_to_message_id=message.message_id,
+                                        visible_file_name=f"barcodes_{page_number}.png")
+                await _edit_message_quietly(bot, chat_id, status_message.message_id,
+                                            sheet_progress_text(page_number, page_count))
+        logger.info(f"Лист штрих-кодов отправлен в чат {chat_id}: {len(codes)} кодов, {page_count} стр., "
+                    f"формат {request.sheet_format}.")
+        await _edit_message_quietly(bot, chat_id, status_message.message_id,
+                                    f"Готово: {len(codes)} кодов на {page_count} стр.")
+    except Exception as e:
+        logger.error(f"Ошибка подготовки листа штрих-кодов для чата {chat_id}: {e}", exc_info=True)
+        await _edit_message_quietly(bot, chat_id, status_message.message_id, SHEET_ERROR_TEXT)
+
+
+async def gen_handler(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user: return
+
+    request = resolve_gen_request(message, bot.user_barcodes)
+    if request.batch_args is not None:
+        await gen_batch_handler(message, bot, request.batch_args)
+        return
+    if request.error_text:
+        await bot.send_message(message.chat.id, request.error_text, reply_to_message_id=message.message_id, parse_mode="HTML")
+        return
+
+    code_to_gen = request.code
+    try:
+        sent = await send_barcode_photo(bot, message.chat.id, code_to_gen, f"Штрих-код для: <code>{code_to_gen}</code>",
+                                        reply_to_message_id=message.message_id)
+        if not sent:
+            await bot.send_message(message.chat.id, gen_failed_text(code_to_gen), reply_to_message_id=message.message_id, parse_mode="HTML")
+    except RenderQueueFullError as e:
+        logger.warning(f"Отрисовка {code_to_gen} отклонена: {e}")
+        await bot.send_message(message.chat.id, RENDER_BUSY_TEXT, reply_to_message_id=message.message_id)
+    except Exception as e:
+        logger.error(f"Ошибка генерации штрих-кода для {code_to_gen}: {e}")
+        await bot.send_message(message.chat.id, gen_error_text(code_to_gen), reply_to_message_id=message.message_id, parse_mode="HTML")
+
+
+async def gen_batch_handler(message: types.Message, bot: AsyncAppTeleBot, args: list[str]):
+    codes, rejected, error_text = resolve_batch_codes(message, args, bot.user_barcodes)
+    if error_text:
+        await bot.send_message(message.chat.id, error_text, reply_to_message_id=message.message_id, parse_mode="HTML")
+        return
+
+    try:
+        failed = await send_barcode_batch(bot, message.chat.id, codes, reply_to_message_id=message.message_id)
+    except Exception as e:
+        logger.error(f"Ошибка пакетной генерации штрих-кодов: {e}")
+        await bot.send_message(message.chat.id, BATCH_SEND_ERROR_TEXT, reply_to_message_id=message.message_id)
+        return
+
+    problems_text = batch_problems_text(rejected + failed)
+    if problems_text:
+        await bot.send_message(message.chat.id, problems_text, reply_to_message_id=message.message_id, parse_mode="HTML")
+
+
+async def cancel_handler_state(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user:
+        logger.warning("Cancel attempt without from_user in message: %s", message.message_id)
+        return
+
+    prerenderer.cancel(message.from_user.id)
+    current_state = await bot.get_state(message.from_user.id, message.chat.id)
+    if current_state is None:
+        await bot.send_message(message.chat.id, NO_STATE_TEXT)
+        return
+
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    await bot.send_message(message.chat.id, STATE_CANCELLED_TEXT)
+
+
+async def unauthorized_list_handler(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user or not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+
+    auth_middleware = getattr(bot, 'auth_middleware_instance_ref', None)
+    if auth_middleware is None:
+        logger.error("auth_middleware_instance_ref is None on bot object for unauthorized_list_handler.")
+        await bot.reply_to(message, "Ошибка: Middleware не найден.")
+        return
+
+    unknown_users_data = auth_middleware.access_tracker.snapshot()
+    if not unknown_users_data:
+        await bot.reply_to(message, NO_UNAUTHORIZED_TEXT)
+        return
+
+    for chunk in build_unauthorized_chunks(unknown_users_data):
+        await bot.send_message(message.chat.id, chunk, parse_mode="HTML")
+
+
+async def add_admin_handler(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user or not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    # Сохранение config.ini — файловая операция, выполняем вне цикла событий
+    await bot.reply_to(message, await asyncio.to_thread(apply_add_admin, message), parse_mode="HTML")
+
+
+async def del_admin_handler(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user or not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    await bot.reply_to(message, await asyncio.to_thread(apply_del_admin, message), parse_mode="HTML")
+
+
+async def reload_config_handler(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user or not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    await bot.reply_to(message, await asyncio.to_thread(apply_reload_config, message))
+
+
+async def stats_handler(message: types.Message, bot: AsyncAppTeleBot):
+    if not message.from_user or not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    await bot.reply_to(message, build_stats_text(), parse_mode="HTML")
+
+
+async def profile_handler(message: types.Message, bot: AsyncAppTeleBot):
+    """
+    Асинхронный аналог common.profile_handler: все обработчики выполняются в потоке цикла событий,
+    поэтому cProfile включается в нем на все окно.
+    """
+    if not message.from_user or not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    if not config.PROFILE_ENABLED:
+        await bot.reply_to(message, PROFILE_DISABLED_TEXT)
+        return
+    request = parse_profile_args(message.text.split()[1:])
+    if request.error_text:
+        await bot.reply_to(message, request.error_text, parse_mode="HTML")
+        return
+    try:
+        profiler.start(request.mode)
+    except ProfilerBusyError:
+        await bot.reply_to(message, PROFILE_BUSY_TEXT)
+        return
+    logger.info(f"Профилирование ({request.mode}, {request.seconds} с) запущено администратором {message.from_user.id}.")
+
+    try:
+        await bot.reply_to(message, profile_started_text(request))
+        if request.mode == MODE_CPU:
+            profiler.enter()
+        try:
+            await asyncio.sleep(request.seconds)
+        finally:
+            profiler.exit()
+        report = await asyncio.to_thread(profiler.stop, PROFILE_TOP_N)
+        text_name, raw_name = profile_file_names(report)
+        await bot.send_document(message.chat.id, report.text.encode("utf-8"), caption=profile_caption(report),
+                                reply_to_message_id=message.message_id, visible_file_name=text_name)
+        await bot.send_document(message.chat.id, report.raw, reply_to_message_id=message.message_id,
+                                visible_file_name=raw_name)
+    except Exception as e:
+        logger.error(f"Ошибка профилирования для чата {message.chat.id}: {e}", exc_info=True)
+        profiler.stop()
+        await bot.reply_to(message, PROFILE_ERROR_TEXT)
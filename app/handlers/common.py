@@ -1,27 +1,100 @@
 from telebot import TeleBot, types
+from telebot.apihelper import ApiTelegramException
 from ..states import CodesStates # Убедитесь, что путь к states правильный
 import logging
-from ..utils.barcode_utils import parse_codes_input, generate_ean13_barcode_image_bytes
-from ..utils.saving_and_loading import save_json, load_json
+from typing import NamedTuple
+from ..utils.barcode_utils import ParsedCodes, parse_codes, barcode_render_key, validate_ean13
+from ..utils.render_executor import render_executor, RenderQueueFullError
+from ..utils.prerender import prerenderer
+from ..utils.pagination import page_bounds, find_page, iter_chunks
+from ..utils.code_import import CodeImporter, ImportLimitError, is_importable_document, iter_download, telegram_file_url
+from ..utils.barcode_sheet import PAGE_SIZES_MM, SHEET_FORMATS, PdfStreamWriter, SheetLayout, build_sheet_layout, render_sheet_page
+from ..utils.barcode_utils import resolve_barcode_engine
+from ..utils.metrics import metrics, histogram_summary_lines
+from ..utils.profiling import PROFILE_MODES, MODE_CPU, ProfileReport, ProfilerBusyError, profiler
+import html
+import itertools
 import random
+import requests
+import tempfile
+from datetime import datetime
+from io import BytesIO
+from concurrent.futures import Future, ThreadPoolExecutor
 from .. import config
 from ..entities import AppTeleBot
 
 
 logger = logging.getLogger(__name__)
 
-# --- Вспомогательная функция для проверки админских прав ---
-def is_admin(user_id: int) -> bool:
-    return user_id in config.ADMIN_IDS
+MEDIA_GROUP_LIMIT = 10 # Telegram принимает в альбоме от 2 до 10 фото
+MAX_BATCH_CODES = 100 # Ограничение на количество кодов в одной пакетной команде /gen
+MESSAGE_CHUNK_LIMIT = 4050 # Лимит Telegram 4096 символов, оставляем небольшой запас
+CODES_REPORT_SAMPLE = 10 # Сколько отклоненных кодов показывать в отчете о загрузке списка
+MYCODES_PAGE_SIZE = 100 # Кодов на одной странице /mycodes
+MYCODES_HEADER_RESERVE = 200 # Запас на заголовок страницы и теги <code>
+MYCODES_CALLBACK_PREFIX = "mycodes:" # callback_data кнопок листания: префикс + id владельца списка + ":" + индекс первого кода страницы
+# Фрагменты описания ошибки 400, с которыми Telegram отклоняет устаревший или чужой file_id
+STALE_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file", "file reference", "file_reference", "file_id")
 
-# --- Существующие хендлеры (start, codes, process_codes, mycodes, gen, cancel) ---
-# Модифицируем help_handler
-def help_handler(message: types.Message, bot: TeleBot):
+# Пул потоков для параллельной отрисовки штрих-кодов в пакетном режиме /gen
+_batch_render_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="barcode-render")
+# Пул потоков для импорта списков из файлов: скачивание не занимает потоки обработчиков
+_import_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="code-import")
+IMPORT_CALLBACK_PREFIX = "import:" # callback_data кнопок выбора режима импорта: import:append или import:replace
+# Листы /sheet собираются по одному: страницы и так рисуются в пуле процессов
+_sheet_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="barcode-sheet")
+SHEET_MAX_COLUMNS = 8
+SHEET_MAX_PNG_PAGES = 10 # PNG-страницы уходят отдельными документами; для длинных списков — PDF
+SHEET_PAGE_TIMEOUT = 120 # Таймаут отрисовки одной страницы листа, секунды
+_profile_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile") # Ожидание окна /profile и сборка отчета
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_TOP_N = 40 # Строк в текстовом отчете /profile
+
+def shutdown_handler_pools() -> None:
     """
-    Handles the /help command.
+    Дожидается фоновых задач обработчиков (/gen, импорт файлов, /sheet, /profile).
+
+    Задачи отправляют ответы через bot.outbound, поэтому вызывается до его остановки
+    и до закрытия хранилища кодов.
     """
-    user_id = message.from_user.id if message.from_user else None
+    profiler.cancel() # Окно /profile закрывается сразу, а не по истечении заданного времени
+    for pool in (_batch_render_pool, _import_pool, _sheet_pool, _profile_pool):
+        pool.shutdown(wait=True)
+
+# --- Тексты ответов (общие для синхронных и асинхронных обработчиков) ---
+ADMIN_ONLY_TEXT = "Эта команда доступна только администраторам."
+START_TEXT = "Привет! Используйте /help для просмотра доступных команд."
+CODES_PROMPT_TEXT = (
+    "Введите список EAN-кодов (12 или 13 цифр).\n"
+    "Разделители: пробел, запятая, новая строка.\n"
+    "Большой список можно отправить файлом .txt или .csv.\n"
+    "Этот список будет временным. Отмените ввод командой /cancel."
+)
+CODES_NOT_RECOGNIZED_TEXT = "Не удалось распознать коды. Убедитесь, что ввели их правильно (12 или 13 цифр, разделены пробелом/запятой/новой строкой)."
+NO_CODES_TEXT = "У вас нет временного списка EAN-кодов. Используйте /codes для загрузки."
+MYCODES_FOREIGN_TEXT = "Это список другого пользователя. Отправьте /mycodes, чтобы увидеть свой."
+NO_STATE_TEXT = "Нет активной операции для отмены."
+STATE_CANCELLED_TEXT = "Операция отменена."
+RENDER_BUSY_TEXT = "Сейчас генерируется слишком много штрих-кодов. Попробуйте еще раз через несколько секунд."
+BATCH_SEND_ERROR_TEXT = "Произошла ошибка при отправке штрих-кодов."
+NO_UNAUTHORIZED_TEXT = "Записей о неавторизованных попытках доступа нет."
+SHEET_USAGE_TEXT = (
+    "Использование: /sheet <code>[pdf|png]</code> <code>[колонки]</code> <code>[A4|A5|Letter]</code>\n"
+    f"Например: <code>/sheet pdf 4 A4</code>. Колонок от 1 до {SHEET_MAX_COLUMNS}."
+)
+SHEET_ERROR_TEXT = "Произошла ошибка при подготовке листа штрих-кодов."
+METRICS_DISABLED_TEXT = "Сбор метрик отключен (METRICS_ENABLED = 0 в конфигурации)."
+PROFILE_DISABLED_TEXT = "Профилирование отключено (PROFILE_ENABLED = 0 в конфигурации)."
+PROFILE_BUSY_TEXT = "Профилирование уже запущено. Дождитесь отчета."
+PROFILE_ERROR_TEXT = "Произошла ошибка при профилировании."
+
+# --- Вспомогательная функция для проверки админских прав ---
+def is_admin(user_id: int) -> bool:
+    return config.is_admin_id(user_id)
+
+# --- Общая логика команд (используется синхронными и асинхронными обработчиками) ---
 
+def build_help_text(user_id: int | None) -> str:
     help_text_parts = [
         "<b>Доступные команды:</b>",
         "/start - Приветственное сообщение",
@@ -31,7 +104,11 @@ def help_handler(message: types.Message, bot: TeleBot):
         "  Этот список будет использован командой /gen, если ей не передать код напрямую.",
         "/gen <code>[код]</code> - Сгенерировать штрих-код для указанного EAN.",
         "  Если <code>[код]</code> не указан, будет использован случайный код из временного списка.",
+        "/gen <code>all</code> | <code>N</code> | <code>[код] [код] ...</code> - Пакетная генерация альбомами:",
+        "  все коды из списка, N случайных кодов из списка или перечисленные коды.",
         "/mycodes - Показать текущий временный список кодов.",
+        "/sheet <code>[pdf|png]</code> <code>[колонки]</code> <code>[A4|A5|Letter]</code> - Все коды из списка",
+        "  на листах для печати: один PDF или страницы PNG.",
         "/cancel - Отменить текущую операцию (например, ввод кодов)."
     ]
 
@@ -41,33 +118,719 @@ def help_handler(message: types.Message, bot: TeleBot):
             "/unauthorized - Показать список неавторизованных попыток доступа.",
             "/addadmin <code>[user_id]</code> - Добавить администратора.",
             "/deladmin <code>[user_id]</code> - Удалить администратора.",
-            "/reloadcfg - Перезагрузить конфигурацию из файла."
+            "/reloadcfg - Перезагрузить конфигурацию из файла.",
+            "/stats - Задержки обработчиков, отрисовки и Bot API.",
+            "/profile <code>[секунды]</code> <code>[cpu|mem]</code> - Профилировать обработчики и прислать отчет."
         ])
-    
-    bot.send_message(chat_id=message.chat.id, text="\n".join(help_text_parts), parse_mode="HTML")
+    return "\n".join(help_text_parts)
 
-# ... (остальные ваши start_handler, codes_handler, и т.д. остаются как есть)
-def start_handler(message: types.Message, bot: TeleBot):
-    bot.send_message(
-        chat_id=message.chat.id,
-        text="Привет! Используйте /help для просмотра доступных команд."
+def _codes_sample_text(codes: list[str], count: int) -> str:
+    sample = ", ".join(html.escape(code[:20]) for code in codes[:CODES_REPORT_SAMPLE])
+    if count > CODES_REPORT_SAMPLE:
+        sample += ", ..."
+    return f"<code>{sample}</code>"
+
+def _problems_lines(bad_checksum: list[str], bad_checksum_count: int, rejected: list[str], rejected_count: int) -> list[str]:
+    lines = []
+    if bad_checksum_count:
+        lines.append(f"Неверная контрольная цифра ({bad_checksum_count} шт.): {_codes_sample_text(bad_checksum, bad_checksum_count)}")
+    if rejected_count:
+        lines.append(f"Не распознано ({rejected_count} шт.): {_codes_sample_text(rejected, rejected_count)}")
+    return lines
+
+def codes_problems_lines(report: ParsedCodes) -> list[str]:
+    return _problems_lines(report.bad_checksum, len(report.bad_checksum), report.rejected, len(report.rejected))
+
+def codes_loaded_text(report: ParsedCodes) -> str:
+    lines = [f"Коды успешно загружены ({len(report.codes)} шт.)."]
+    if report.fixed:
+        lines.append(f"Дополнено контрольной цифрой: {len(report.fixed)}.")
+    if report.duplicates:
+        lines.append(f"Пропущено повторов: {report.duplicates}.")
+    lines.extend(codes_problems_lines(report))
+    lines.append("Теперь используйте /gen для генерации штрих-кодов.")
+    return "\n".join(lines)
+
+def codes_not_recognized_text(report: ParsedCodes) -> str:
+    return "\n".join([CODES_NOT_RECOGNIZED_TEXT, *codes_problems_lines(report)])
+
+def import_limit_bytes() -> int:
+    return config.IMPORT_MAX_FILE_MB * 1024 * 1024
+
+def check_import_document(document: types.Document) -> str | None:
+    """
+    Текст ошибки, если файл нельзя импортировать, иначе None.
+    """
+    if not is_importable_document(document.file_name, document.mime_type):
+        return "Поддерживаются только текстовые файлы .txt и .csv."
+    if document.file_size and document.file_size > import_limit_bytes():
+        return f"Файл слишком большой: максимум {config.IMPORT_MAX_FILE_MB} МБ."
+    return None
+
+def build_import_mode_markup(existing_count: int) -> types.InlineKeyboardMarkup:
+    markup = types.InlineKeyboardMarkup()
+    markup.row(
+        types.InlineKeyboardButton(f"Добавить к списку ({existing_count} шт.)", callback_data=f"{IMPORT_CALLBACK_PREFIX}append"),
+        types.InlineKeyboardButton("Заменить список", callback_data=f"{IMPORT_CALLBACK_PREFIX}replace"),
+    )
+    return markup
+
+def is_import_callback(call: types.CallbackQuery) -> bool:
+    return bool(call.data) and call.data.startswith(IMPORT_CALLBACK_PREFIX)
+
+def import_progress_text(importer: CodeImporter, file_size: int | None) -> str:
+    read_mb = importer.bytes_read / (1024 * 1024)
+    size_text = f"{read_mb:.1f} из {file_size / (1024 * 1024):.1f} МБ" if file_size else f"{read_mb:.1f} МБ"
+    return f"Импорт файла: прочитано {size_text}, новых кодов: {importer.added_count}."
+
+def import_report_text(importer: CodeImporter, append: bool) -> str:
+    total = importer.existing_count + importer.added_count
+    if append:
+        lines = [f"Импорт завершен: добавлено {importer.added_count} шт., в списке {total} шт."]
+    else:
+        lines = [f"Импорт завершен: загружено {total} шт."]
+    if importer.fixed_count:
+        lines.append(f"Дополнено контрольной цифрой: {importer.fixed_count}.")
+    if importer.duplicates:
+        lines.append(f"Пропущено повторов: {importer.duplicates}.")
+    if importer.truncated:
+        lines.append(f"Не вошло из-за лимита {config.IMPORT_MAX_CODES} кодов: {importer.truncated}.")
+    lines.extend(_problems_lines(importer.bad_checksum_sample, importer.bad_checksum_count,
+                                 importer.rejected_sample, importer.rejected_count))
+    return "\n".join(lines)
+
+def run_code_import(token: str, file_path: str, importer: CodeImporter, on_progress=None) -> str | None:
+    """
+    Скачивает файл и разбирает его в importer. Возвращает текст ошибки для пользователя или None.
+    """
+    try:
+        importer.feed_stream(iter_download(telegram_file_url(token, file_path, config.API_FILE_URL or None)),
+                             import_limit_bytes(), on_progress)
+    except ImportLimitError:
+        return f"Файл слишком большой: максимум {config.IMPORT_MAX_FILE_MB} МБ. Список не изменен."
+    except requests.RequestException as e:
+        logger.error(f"Ошибка скачивания файла {file_path}: {e}")
+        return "Не удалось скачать файл. Список не изменен."
+    if not importer.added_count and not importer.existing_count:
+        return "В файле не найдено корректных EAN-кодов. Список не изменен."
+    return None
+
+class SheetRequest(NamedTuple):
+    sheet_format: str
+    columns: int
+    page_size: str
+    error_text: str | None = None
+
+def parse_sheet_args(args: list[str]) -> SheetRequest:
+    """
+    Аргументы /sheet в любом порядке: формат файла, число колонок, формат страницы.
+    """
+    sheet_format = config.SHEET_FORMAT if config.SHEET_FORMAT in SHEET_FORMATS else SHEET_FORMATS[0]
+    columns, page_size = config.SHEET_COLUMNS, config.SHEET_PAGE_SIZE
+    for arg in args:
+        value = arg.lower()
+        if value in SHEET_FORMATS:
+            sheet_format = value
+        elif value.upper() in PAGE_SIZES_MM:
+            page_size = value.upper()
+        elif value.isdigit() and 1 <= int(value) <= SHEET_MAX_COLUMNS:
+            columns = int(value)
+        else:
+            return SheetRequest(sheet_format, columns, page_size, SHEET_USAGE_TEXT)
+    return SheetRequest(sheet_format, columns, page_size)
+
+class ProfileRequest(NamedTuple):
+    seconds: int
+    mode: str
+    error_text: str | None = None
+
+def profile_usage_text() -> str:
+    return ("Использование: /profile <code>[секунды]</code> <code>[cpu|mem]</code>\n"
+            f"Например: <code>/profile 30 cpu</code>. Длительность от 1 до {config.PROFILE_MAX_SECONDS} с.")
+
+def parse_profile_args(args: list[str]) -> ProfileRequest:
+    """
+    Аргументы /profile в любом порядке: длительность окна в секундах и режим.
+    """
+    seconds, mode = min(PROFILE_DEFAULT_SECONDS, config.PROFILE_MAX_SECONDS), MODE_CPU
+    for arg in args:
+        value = arg.lower()
+        if value in PROFILE_MODES:
+            mode = value
+        elif value.isdigit() and 1 <= int(value) <= config.PROFILE_MAX_SECONDS:
+            seconds = int(value)
+        else:
+            return ProfileRequest(seconds, mode, profile_usage_text())
+    return ProfileRequest(seconds, mode)
+
+def profile_started_text(request: ProfileRequest) -> str:
+    what = "время CPU (cProfile)" if request.mode == MODE_CPU else "выделения памяти (tracemalloc)"
+    return f"Профилирование запущено на {request.seconds} с: {what}. Отчет придет документом."
+
+def profile_file_names(report: ProfileReport) -> tuple[str, str]:
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"profile_{report.mode}_{stamp}.txt", f"profile_{report.mode}_{stamp}.{report.raw_extension}"
+
+def profile_caption(report: ProfileReport) -> str:
+    return f"Профиль {report.mode} за {report.seconds:.0f} с."
+
+def sheet_progress_text(page_number: int, page_count: int) -> str:
+    return f"Подготовка листа: страница {page_number} из {page_count}..."
+
+def sheet_caption(code_count: int, total_count: int, page_count: int) -> str:
+    caption = f"Штрих-коды: {code_count} шт., страниц: {page_count}."
+    if total_count > code_count:
+        caption += f" В список не вошли последние {total_count - code_count} кодов (лимит {code_count})."
+    return caption
+
+def iter_sheet_pages(codes: list[str], layout: SheetLayout, sheet_format: str, engine: str):
+    """
+    Отрисовывает страницы по одной в пуле процессов; в памяти одновременно только текущая страница.
+    """
+    for start in range(0, len(codes), layout.per_page):
+        yield render_executor.call(render_sheet_page, codes[start:start + layout.per_page], layout, sheet_format, engine,
+                                   timeout=SHEET_PAGE_TIMEOUT)
+
+def prepare_sheet(request: SheetRequest, code_count: int) -> tuple[SheetLayout | None, str, str | None]:
+    """
+    Раскладка листа и движок отрисовки или текст ошибки, если лист с такими параметрами не собрать.
+    """
+    engine = resolve_barcode_engine()
+    try:
+        layout = build_sheet_layout(request.page_size, request.columns, config.SHEET_DPI, engine)
+    except ValueError as e:
+        return None, engine, f"{html.escape(str(e))}\n{SHEET_USAGE_TEXT}"
+    page_count = layout.page_count(code_count)
+    if request.sheet_format == "png" and page_count > SHEET_MAX_PNG_PAGES:
+        return None, engine, (f"Получится {page_count} страниц, а PNG отправляется не больше {SHEET_MAX_PNG_PAGES}. "
+                              "Используйте <code>/sheet pdf</code> или увеличьте число колонок.")
+    return layout, engine, None
+
+def write_sheet_pdf(pdf_file, codes: list[str], layout: SheetLayout, engine: str, on_page=None) -> None:
+    """
+    Пишет PDF в pdf_file постранично. on_page(номер страницы) вызывается после каждой страницы.
+    """
+    writer = PdfStreamWriter(pdf_file)
+    for page_number, page_data in enumerate(iter_sheet_pages(codes, layout, "pdf", engine), 1):
+        writer.add_page(layout.page_width, layout.page_height, page_data, layout.dpi)
+        if on_page is not None:
+            on_page(page_number)
+    writer.close()
+
+def store_user_codes(bot: AppTeleBot, user_id: int, codes: list[str]) -> None:
+    # Сохраняем коды в хранилище (запись сразу попадает на диск); для личных чатов user_id == chat_id
+    bot.user_barcodes[user_id] = codes
+    if codes:
+        schedule_prerender(bot, user_id, codes)
+    else:
+        prerenderer.cancel(user_id) # Пустой список: коды прежнего списка больше не нужны
+
+def schedule_prerender(bot: AppTeleBot, user_id: int, codes: list[str]) -> None:
+    """
+    Ставит коды нового списка в фоновую отрисовку вместо кодов прежнего списка пользователя.
+    Коды, уже загруженные в Telegram, пропускаются: /gen отправит их по file_id без отрисовки.
+    """
+    if not prerenderer.running:
+        return
+    not_uploaded = (code for code in codes if not bot.photo_file_ids.get(barcode_render_key(code) or ""))
+    prerenderer.schedule(user_id, list(itertools.islice(not_uploaded, prerenderer.max_per_user)))
+
+def build_mycodes_page(codes: list[str], owner_id: int, cursor: int = 0) -> tuple[str, types.InlineKeyboardMarkup | None]:
+    """
+    Текст страницы /mycodes, на которой находится код с индексом cursor, и кнопки листания.
+    Кнопки несут id владельца списка: в группе их может нажать любой участник.
+    """
+    if not codes:
+        return NO_CODES_TEXT, None
+    bounds = page_bounds(map(len, codes), MESSAGE_CHUNK_LIMIT - MYCODES_HEADER_RESERVE, max_items=MYCODES_PAGE_SIZE)
+    page = find_page(bounds, cursor)
+    codes_text = "\n".join(codes[page.start:page.end])
+    if page.total == 1:
+        return f"Ваш временный список EAN-кодов ({len(codes)} шт.):\n<code>{codes_text}</code>", None
+
+    text = (f"Ваш временный список EAN-кодов ({len(codes)} шт.), страница {page.number + 1} из {page.total} "
+            f"(коды {page.start + 1}–{page.end}):\n<code>{codes_text}</code>")
+    buttons = []
+    if page.number > 0:
+        buttons.append(types.InlineKeyboardButton(
+            "« Назад", callback_data=f"{MYCODES_CALLBACK_PREFIX}{owner_id}:{bounds[page.number - 1][0]}"))
+    if page.number < page.total - 1:
+        buttons.append(types.InlineKeyboardButton(
+            "Вперед »", callback_data=f"{MYCODES_CALLBACK_PREFIX}{owner_id}:{bounds[page.number + 1][0]}"))
+    markup = types.InlineKeyboardMarkup()
+    markup.row(*buttons)
+    return text, markup
+
+def parse_mycodes_callback(data: str | None) -> tuple[int, int] | None:
+    """
+    (id владельца списка, индекс первого кода страницы) из callback_data кнопки листания.
+    """
+    if not data or not data.startswith(MYCODES_CALLBACK_PREFIX):
+        return None
+    owner, _, cursor = data[len(MYCODES_CALLBACK_PREFIX):].partition(":")
+    try:
+        return int(owner), max(0, int(cursor))
+    except ValueError:
+        return None # В том числе кнопки старого формата без владельца
+
+def is_mycodes_callback(call: types.CallbackQuery) -> bool:
+    return bool(call.data) and call.data.startswith(MYCODES_CALLBACK_PREFIX)
+
+def is_message_not_modified_error(e: ApiTelegramException) -> bool:
+    # Повторное нажатие на кнопку текущей страницы
+    return e.error_code == 400 and "message is not modified" in (e.description or "")
+
+def is_single_ean(value: str) -> bool:
+    return value.isdigit() and (len(value) == 12 or len(value) == 13)
+
+def uses_user_list(args: list[str]) -> bool:
+    """
+    True для форм /gen all и /gen N, которые берут коды из списка пользователя.
+    """
+    return len(args) == 1 and not is_single_ean(args[0]) and (args[0].lower() == "all" or args[0].isdigit())
+
+def is_batch_gen_request(args: list[str]) -> bool:
+    return len(args) > 1 or uses_user_list(args)
+
+class GenRequest(NamedTuple):
+    """
+    Разобранная команда /gen: ровно одно из полей заполнено.
+    """
+    code: str | None = None # Один код для генерации
+    batch_args: list[str] | None = None # Аргументы пакетной генерации
+    error_text: str | None = None # Текст ошибки для пользователя
+
+def resolve_gen_request(message: types.Message, user_barcodes) -> GenRequest:
+    args = (message.text or "").split()[1:]
+
+    if is_batch_gen_request(args):
+        return GenRequest(batch_args=args)
+
+    if len(args) == 1:
+        potential_code = args[0].strip()
+        if is_single_ean(potential_code):
+            if validate_ean13(potential_code) is None:
+                return GenRequest(error_text=f"У кода <code>{potential_code}</code> неверная контрольная цифра.")
+            return GenRequest(code=potential_code)
+        return GenRequest(error_text="Пожалуйста, укажите корректный EAN-код (12 или 13 цифр) после команды /gen, например: <code>/gen 123456789012</code>")
+
+    # Генерация из списка пользователя (только если это личный чат)
+    if message.from_user.id != message.chat.id:
+        return GenRequest(error_text="В групповых чатах необходимо явно указать код для генерации: <code>/gen <код></code>")
+    codes = user_barcodes.get(message.from_user.id, [])
+    if not codes:
+        return GenRequest(error_text="Укажите EAN-код (например, <code>/gen 123456789012</code>) "
+                                     "или загрузите список кодов через /codes.")
+    return GenRequest(code=random.choice(codes))
+
+def gen_failed_text(code: str) -> str:
+    return f"Не удалось сгенерировать штрих-код для <code>{code}</code>. Проверьте корректность кода (12 или 13 цифр)."
+
+def gen_error_text(code: str) -> str:
+    return f"Произошла ошибка при генерации штрих-кода для <code>{code}</code>."
+
+def select_batch_codes(args: list[str], user_codes: list[str]) -> tuple[list[str], list[str]]:
+    """
+    Определяет список кодов для пакетной генерации по аргументам команды /gen.
+
+    Поддерживаемые формы:
+        /gen all                — все коды из списка пользователя;
+        /gen N                  — N случайных кодов из списка (в порядке списка);
+        /gen <код> <код> ...    — перечисленные коды.
+
+    Returns:
+        tuple: (коды для генерации в порядке отправки, отклоненные аргументы)
+    """
+    if uses_user_list(args) and args[0].lower() == "all":
+        return list(user_codes[:MAX_BATCH_CODES]), []
+    if uses_user_list(args):
+        count = min(int(args[0]), len(user_codes), MAX_BATCH_CODES)
+        # Случайная выборка, но альбом собирается в порядке списка пользователя
+        picked_indexes = sorted(random.sample(range(len(user_codes)), count))
+        return [user_codes[i] for i in picked_indexes], []
+
+    codes, rejected = [], []
+    for arg in args:
+        (codes if is_single_ean(arg) and validate_ean13(arg) else rejected).append(arg)
+    return codes[:MAX_BATCH_CODES], rejected
+
+def resolve_batch_codes(message: types.Message, args: list[str], user_barcodes) -> tuple[list[str], list[str], str | None]:
+    """
+    Returns:
+        tuple: (коды, отклоненные аргументы, текст ошибки или None)
+    """
+    user_codes = []
+    if uses_user_list(args):
+        if message.from_user.id != message.chat.id:
+            return [], [], "В групповых чатах необходимо явно перечислить коды: <code>/gen <код> <код> ...</code>"
+        user_codes = user_barcodes.get(message.from_user.id, [])
+        if not user_codes:
+            return [], [], NO_CODES_TEXT
+
+    codes, rejected = select_batch_codes(args, user_codes)
+    if not codes:
+        return [], rejected, "Не найдено корректных EAN-кодов (12 или 13 цифр) для генерации."
+    return codes, rejected, None
+
+def batch_problems_text(problems: list[str]) -> str | None:
+    if not problems:
+        return None
+    problems_text = "\n".join(problems)
+    return f"Не удалось сгенерировать штрих-коды ({len(problems)} шт.):\n<code>{problems_text}</code>"
+
+def prepare_batch_item(bot: AppTeleBot, code: str) -> tuple[str, str | None, object | None]:
+    """
+    Готовит один элемент альбома: file_id, если изображение уже загружено, иначе отрисованный PNG.
+    Возвращает (код, ключ отрисовки, file_id или BytesIO либо None при ошибке).
+    """
+    render_key = barcode_render_key(code)
+    if render_key is None:
+        return code, None, None
+    file_id = bot.photo_file_ids.get(render_key)
+    if file_id:
+        return code, render_key, file_id
+    return code, render_key, render_executor.render(code)
+
+def build_album_media(items: list[tuple[str, str, object]]) -> list[types.InputMediaPhoto]:
+    return [
+        types.InputMediaPhoto(photo, caption=f"<code>{code}</code>", parse_mode="HTML")
+        for code, _, photo in items
+    ]
+
+def remember_album_file_ids(bot: AppTeleBot, items: list[tuple[str, str, object]], sent_messages) -> None:
+    for (_, render_key, photo), sent_message in zip(items, sent_messages or []):
+        if not isinstance(photo, str) and sent_message.photo:
+            bot.photo_file_ids.set(render_key, sent_message.photo[-1].file_id)
+
+def remember_photo_file_id(bot: AppTeleBot, render_key: str, sent_message) -> None:
+    if sent_message and sent_message.photo:
+        # Самый большой размер — последний в списке; его file_id переиспользуем при следующих отправках
+        bot.photo_file_ids.set(render_key, sent_message.photo[-1].file_id)
+
+def is_stale_file_id_error(e: ApiTelegramException) -> bool:
+    # Остальные 400 (ошибка разметки подписи, чат не найден) повторятся и при повторной загрузке
+    description = (e.description or "").lower()
+    return e.error_code == 400 and any(marker in description for marker in STALE_FILE_ID_ERRORS)
+
+def build_unauthorized_chunks(unknown_users_data: dict) -> list[str]:
+    """
+    Формирует отчет о неавторизованных попытках доступа, разбитый на сообщения до 4096 символов.
+    Запись об одном пользователе не разрывается между сообщениями.
+    """
+    response_parts = itertools.chain(["<b>Неавторизованные попытки доступа:</b>\n"], (
+        f"\n<b>ID:</b> <code>{user_id_str}</code>\n"
+        f"  Username: <code>@{info.get('username', 'N/A')}</code>\n"
+        f"  Full Name: {info.get('full_name', 'N/A')}\n"
+        f"  Attempts: {info.get('attempts', 1)}\n"
+        f"  Chat ID: {info.get('chat_id', 'N/A')}"
+        for user_id_str, info in unknown_users_data.items()
+    ))
+    return list(iter_chunks(response_parts, MESSAGE_CHUNK_LIMIT))
+
+def apply_add_admin(message: types.Message) -> str:
+    """
+    Выполняет /addadmin и возвращает текст ответа.
+    """
+    parts = (message.text or "").split()
+    if len(parts) < 2:
+        return "Использование: <code>/addadmin [user_id]</code>"
+
+    try:
+        new_admin_id = int(parts[1])
+        if new_admin_id <= 0: # Простая проверка на валидность ID
+            raise ValueError("User ID must be a positive integer.")
+    except ValueError:
+        return "Неверный ID пользователя. ID должен быть целым положительным числом."
+
+    if config.is_admin_id(new_admin_id):
+        return f"Пользователь с ID <code>{new_admin_id}</code> уже является администратором."
+
+    # Новый набор администраторов публикуется только после успешного сохранения в файл
+    if config.add_admin(new_admin_id):
+        logger.info(f"Admin {new_admin_id} added by {message.from_user.id}. ADMIN_IDS in memory: {sorted(config.ADMIN_IDS)}")
+        return (f"Пользователь с ID <code>{new_admin_id}</code> успешно добавлен в администраторы.\n"
+                "Изменения применены и сохранены в конфигурации.")
+    return "Произошла ошибка при сохранении изменений в файл конфигурации. Администратор не добавлен."
+
+def apply_del_admin(message: types.Message) -> str:
+    """
+    Выполняет /deladmin и возвращает текст ответа.
+    """
+    parts = (message.text or "").split()
+    if len(parts) < 2:
+        return "Использование: <code>/deladmin [user_id]</code>"
+
+    try:
+        admin_id_to_remove = int(parts[1])
+    except ValueError:
+        return "Неверный ID пользователя. ID должен быть числом."
+
+    if admin_id_to_remove == message.from_user.id:
+        return "Вы не можете удалить самого себя из администраторов этой командой."
+
+    # Проверяем, есть ли такой ID в текущем списке админов в памяти
+    if not config.is_admin_id(admin_id_to_remove):
+        return f"Пользователь с ID <code>{admin_id_to_remove}</code> не найден в списке администраторов."
+
+    if config.remove_admin(admin_id_to_remove):
+        logger.info(f"Admin {admin_id_to_remove} removed by {message.from_user.id}. ADMIN_IDS in memory: {sorted(config.ADMIN_IDS)}")
+        return (f"Пользователь с ID <code>{admin_id_to_remove}</code> успешно удален из администраторов.\n"
+                "Изменения применены и сохранены в конфигурации.")
+    return "Произошла ошибка при сохранении изменений в файл конфигурации. Администратор не удален."
+
+def apply_reload_config(message: types.Message) -> str:
+    """
+    Выполняет /reloadcfg и возвращает текст ответа.
+    """
+    try:
+        config.load_config() # Вызываем функцию перезагрузки из модуля config
+        # Обновляем уровень логгера для основного логгера приложения (если он настраивался глобально)
+        # и для логгера текущего модуля
+        logging.getLogger().setLevel(config.LOG_LEVEL)
+        logger.setLevel(config.LOG_LEVEL)
+        metrics.enabled = bool(config.METRICS_ENABLED)
+
+        logger.info(f"Config reloaded by admin {message.from_user.id}. New ADMIN_IDS: {sorted(config.ADMIN_IDS)}, LOG_LEVEL: {config.LOG_LEVEL}")
+        return "Конфигурация успешно перезагружена из файла. Уровень логирования обновлен."
+    except Exception as e:
+        logger.error(f"Ошибка при перезагрузке конфигурации: {e}", exc_info=True)
+        return f"Произошла ошибка при перезагрузке конфигурации: {e}"
+
+def build_stats_text(outbound_stats: dict | None = None) -> str:
+    """
+    Сводка метрик для /stats: перцентили задержек по корзинам гистограмм и счетчики ошибок.
+    """
+    if not metrics.enabled:
+        return METRICS_DISABLED_TEXT
+    sections = [
+        ("Обработчики", "bot_handler_seconds", "command"),
+        ("Ожидание в пуле потоков", "bot_update_queue_wait_seconds", None),
+        ("Отрисовка (промахи кэша)", "bot_render_seconds", "where"),
+        ("Запросы к Bot API", "bot_telegram_api_seconds", "method"),
+        ("Ожидание в исходящей очереди", "bot_outbound_queue_wait_seconds", None),
+    ]
+    parts = ["<b>Метрики</b> (n, p50/p95/p99 в мс)"]
+    for title, name, label in sections:
+        lines = histogram_summary_lines(metrics, name, label)
+        if lines:
+            parts.append(f"\n<b>{title}:</b>")
+            parts.extend(html.escape(line) for line in lines)
+
+    cache = metrics.counters("bot_render_cache_total")
+    hits, misses = cache.get((("result", "hit"),), 0), cache.get((("result", "miss"),), 0)
+    if hits or misses:
+        parts.append(f"\n<b>Кэш изображений:</b> попаданий {hits:.0f}, промахов {misses:.0f}")
+
+    errors = []
+    for counter_name, label in (("bot_handler_errors_total", "command"), ("bot_telegram_api_errors_total", "method")):
+        for label_key, value in sorted(metrics.counters(counter_name).items()):
+            labels = dict(label_key)
+            suffix = f" ({labels['code']})" if "code" in labels else ""
+            errors.append(html.escape(f"{labels.get(label, '—')}{suffix}: {value:.0f}"))
+    if errors:
+        parts.append("\n<b>Ошибки:</b>")
+        parts.extend(errors)
+
+    if outbound_stats:
+        parts.append("\n<b>Исходящая очередь:</b> " + ", ".join(f"{key}={value}" for key, value in outbound_stats.items()))
+    return "\n".join(parts)
+
+# --- Отправка штрих-кодов ---
+
+def queue_message(bot: AppTeleBot, chat_id: int, text: str, **kwargs) -> Future:
+    """
+    Ставит send_message в исходящую очередь бота (с учетом лимитов Telegram) и не ждет отправки.
+    """
+    return bot.outbound.submit(chat_id, bot.send_message, chat_id, text, **kwargs)
+
+def queue_reply(bot: AppTeleBot, message: types.Message, text: str, **kwargs) -> Future:
+    return bot.outbound.submit(message.chat.id, bot.reply_to, message, text, **kwargs)
+
+def send_prepared_photo(bot: AppTeleBot, chat_id: int, item: tuple[str, str | None, object], caption: str,
+                        reply_to_message_id: int | None = None) -> bool:
+    """
+    Отправляет элемент, подготовленный prepare_batch_item. Если Telegram отклонил file_id как устаревший,
+    удаляет его из индекса и загружает изображение заново.
+
+    Returns:
+        bool: False, если сгенерировать изображение не удалось.
+    """
+    code, render_key, photo = item
+    if isinstance(photo, str):
+        try:
+            bot.send_photo(
+                chat_id=chat_id,
+                photo=photo,
+                caption=caption,
+                reply_to_message_id=reply_to_message_id,
+                parse_mode="HTML"
+            )
+            return True
+        except ApiTelegramException as e:
+            if not is_stale_file_id_error(e):
+                raise
+            logger.info(f"file_id для {code} отклонен Telegram ({e.description}), загружаем изображение заново.")
+            bot.photo_file_ids.discard(render_key)
+            photo = render_executor.render(code)
+
+    if not photo:
+        return False
+    rewind_photo(photo)
+    sent_message = bot.send_photo(
+        chat_id=chat_id,
+        photo=photo,
+        caption=caption,
+        reply_to_message_id=reply_to_message_id,
+        parse_mode="HTML"
     )
+    remember_photo_file_id(bot, render_key, sent_message)
+    return True
+
+def send_barcode_photo(bot: AppTeleBot, chat_id: int, code: str, caption: str, reply_to_message_id: int | None = None) -> bool:
+    """
+    Отправляет изображение штрих-кода. Если изображение уже загружалось в Telegram,
+    отправляет его по file_id без повторной загрузки.
+
+    Returns:
+        bool: False, если сгенерировать изображение не удалось.
+    """
+    item = prepare_batch_item(bot, code)
+    if item[2] is None:
+        return False
+    return send_prepared_photo(bot, chat_id, item, caption, reply_to_message_id)
+
+def rewind_photo(photo) -> None:
+    # Повтор после 429 выполняет то же задание с тем же BytesIO: telebot не перематывает файлы сам
+    if not isinstance(photo, str):
+        photo.seek(0)
+
+def _send_album(bot: AppTeleBot, chat_id: int, items: list[tuple[str, str, object]], reply_to_message_id: int | None) -> None:
+    for _, _, photo in items:
+        rewind_photo(photo)
+    sent_messages = bot.send_media_group(chat_id, build_album_media(items), reply_to_message_id=reply_to_message_id)
+    remember_album_file_ids(bot, items, sent_messages)
+
+def render_batch_items(bot: AppTeleBot, codes: list[str]) -> tuple[list[tuple[str, str, object]], list[str]]:
+    """
+    Параллельно готовит изображения для пакетной отправки. Ошибка отрисовки одного кода не мешает остальным.
+
+    Returns:
+        tuple: Готовые элементы в исходном порядке и коды, которые не удалось сгенерировать.
+    """
+    futures = [_batch_render_pool.submit(prepare_batch_item, bot, code) for code in codes]
+    ready, failed = [], []
+    for code, future in zip(codes, futures):
+        try:
+            item = future.result()
+        except Exception as e:
+            logger.error(f"Ошибка генерации штрих-кода для {code} в пакетном режиме: {e}")
+            failed.append(code)
+            continue
+        if item[2] is None:
+            failed.append(code)
+        else:
+            ready.append(item)
+    return ready, failed
+
+def send_batch_chunk(bot: AppTeleBot, chat_id: int, chunk: list[tuple[str, str, object]], reply_to_message_id: int | None = None) -> list[str]:
+    """
+    Отправляет до 10 готовых элементов одним альбомом (один элемент — обычным фото).
+
+    Returns:
+        list[str]: Коды, которые не удалось отправить из-за ошибки повторной отрисовки.
+    """
+    if len(chunk) == 1:
+        code = chunk[0][0]
+        return [] if send_prepared_photo(bot, chat_id, chunk[0], f"<code>{code}</code>", reply_to_message_id) else [code]
+    try:
+        _send_album(bot, chat_id, chunk, reply_to_message_id)
+        return []
+    except ApiTelegramException as e:
+        if not is_stale_file_id_error(e) or not any(isinstance(photo, str) for _, _, photo in chunk):
+            raise
+        # Один из file_id устарел: забываем file_id этого альбома и загружаем изображения заново
+        logger.info(f"Альбом с file_id отклонен Telegram ({e.description}), загружаем изображения заново.")
+    failed, reuploaded = [], []
+    for code, render_key, photo in chunk:
+        if isinstance(photo, str):
+            bot.photo_file_ids.discard(render_key)
+            photo = render_executor.render(code)
+        if photo is None:
+            failed.append(code)
+        else:
+            reuploaded.append((code, render_key, photo))
+    if len(reuploaded) > 1:
+        _send_album(bot, chat_id, reuploaded, reply_to_message_id)
+    elif reuploaded:
+        failed.extend(send_batch_chunk(bot, chat_id, reuploaded, reply_to_message_id))
+    return failed
+
+class BatchSendProgress:
+    """
+    Общее состояние задач одной пакетной отправки в исходящей очереди.
+    Задачи чата выполняются по порядку, поэтому итоговая задача видит результаты всех альбомов.
+    """
+    def __init__(self, problems: list[str]):
+        self.problems = problems
+        self.error = False
+
+def _send_batch_chunk_job(bot: AppTeleBot, chat_id: int, chunk: list, reply_to_message_id: int | None, progress: BatchSendProgress) -> None:
+    if progress.error:
+        return # После ошибки оставшиеся альбомы не отправляем, как и раньше
+    try:
+        progress.problems.extend(send_batch_chunk(bot, chat_id, chunk, reply_to_message_id))
+    except ApiTelegramException as e:
+        if e.error_code == 429:
+            raise # Повтор выполнит исходящая очередь
+        logger.error(f"Ошибка пакетной генерации штрих-кодов: {e}")
+        progress.error = True
+    except Exception as e:
+        logger.error(f"Ошибка пакетной генерации штрих-кодов: {e}")
+        progress.error = True
+
+def _finish_batch_job(bot: AppTeleBot, chat_id: int, reply_to_message_id: int | None, progress: BatchSendProgress) -> None:
+    if progress.error:
+        bot.send_message(chat_id, BATCH_SEND_ERROR_TEXT, reply_to_message_id=reply_to_message_id)
+        return
+    problems_text = batch_problems_text(progress.problems)
+    if problems_text:
+        bot.send_message(chat_id, problems_text, reply_to_message_id=reply_to_message_id, parse_mode="HTML")
+
+def _send_gen_photo_job(bot: AppTeleBot, chat_id: int, item: tuple[str, str, object], reply_to_message_id: int | None) -> None:
+    code = item[0]
+    try:
+        sent = send_prepared_photo(bot, chat_id, item, f"Штрих-код для: <code>{code}</code>", reply_to_message_id)
+        if not sent:
+            bot.send_message(chat_id, gen_failed_text(code), reply_to_message_id=reply_to_message_id, parse_mode="HTML")
+    except ApiTelegramException as e:
+        if e.error_code == 429:
+            raise # Повтор выполнит исходящая очередь
+        logger.error(f"Ошибка отправки штрих-кода для {code}: {e}")
+        bot.send_message(chat_id, gen_error_text(code), reply_to_message_id=reply_to_message_id, parse_mode="HTML")
+
+# --- Существующие хендлеры (start, codes, process_codes, mycodes, gen, cancel) ---
+def help_handler(message: types.Message, bot: TeleBot):
+    """
+    Handles the /help command.
+    """
+    user_id = message.from_user.id if message.from_user else None
+    queue_message(bot, message.chat.id, build_help_text(user_id), parse_mode="HTML")
+
+def start_handler(message: types.Message, bot: TeleBot):
+    queue_message(bot, message.chat.id, START_TEXT)
 
 def codes_handler(message: types.Message, bot: AppTeleBot):
     if not message.from_user:
         logger.warning("Codes command received without from_user in message: %s", message.message_id)
         return
     bot.set_state(message.from_user.id, CodesStates.waiting_for_codes, message.chat.id)
-    bot.send_message(
+    queue_message(
+        bot,
         message.chat.id,
-        "Введите список EAN-кодов (12 или 13 цифр).\n"
-        "Разделители: пробел, запятая, новая строка.\n"
-        "Этот список будет временным. Отмените ввод командой /cancel.",
+        CODES_PROMPT_TEXT,
         reply_to_message_id=message.message_id,
     )
-    # Очистка предыдущих кодов пользователя при новом вызове /codes
-    if message.from_user.id in bot.user_barcodes:
-        del bot.user_barcodes[message.from_user.id]
+    # Список не очищаем сразу: введенный текстом список заменит его, а при загрузке файла можно выбрать добавление
 
 
 def process_codes_input(message: types.Message, bot: AppTeleBot):
@@ -78,27 +841,28 @@ def process_codes_input(message: types.Message, bot: AppTeleBot):
         # Просто выходим, чтобы команда обработалась стандартно
         return # Важно, чтобы другая команда могла быть обработана, не отправляем сообщение здесь
 
-    codes = parse_codes_input(message.text or "") # Учитываем, что message.text может быть None
-    logger.debug(f"Parsed codes for user {message.from_user.id}: {codes}")
+    report = parse_codes(message.text or "") # Учитываем, что message.text может быть None
+    codes = report.codes
+    logger.debug("Parsed codes for user %s: %d accepted, %d fixed, %d bad checksum, %d rejected, %d duplicates",
+                 message.from_user.id, len(codes), len(report.fixed), len(report.bad_checksum),
+                 len(report.rejected), report.duplicates)
 
     if not codes:
-        bot.send_message(
+        queue_message(
+            bot,
             message.chat.id,
-            "Не удалось распознать коды. Убедитесь, что ввели их правильно (12 или 13 цифр, разделены пробелом/запятой/новой строкой).",
+            codes_not_recognized_text(report),
             reply_to_message_id=message.message_id,
         )
         # Не сбрасываем состояние, даем пользователю попробовать еще раз или отменить
         return
-    
-    # Сохраняем коды в словаре user_codes; для личных чатов user_id == chat_id
-    bot.user_barcodes[message.from_user.id] = codes
 
     bot.delete_state(message.from_user.id, message.chat.id)
-    save_json(bot.user_barcodes)
-    bot.send_message(
+    store_user_codes(bot, message.from_user.id, codes)
+    queue_message(
+        bot,
         message.chat.id,
-        f"Коды успешно загружены ({len(codes)} шт.).\n"
-        "Теперь используйте /gen для генерации штрих-кодов.",
+        codes_loaded_text(report),
         reply_to_message_id=message.message_id,
     )
 
@@ -108,249 +872,348 @@ def mycodes_handler(message: types.Message, bot: AppTeleBot):
         return
 
     codes = bot.user_barcodes.get(message.from_user.id, [])
-    print(f"Barcodes: {bot.user_barcodes}")  # Для отладки
-    print(f"User {message.from_user.id} has codes: {codes}")  # Для отладки
-    if codes:
-        codes_text = "\n".join(codes)
-        bot.send_message(
+    logger.debug("User %s has %d codes", message.from_user.id, len(codes))
+    text, markup = build_mycodes_page(codes, message.from_user.id)
+    queue_message(
+        bot,
+        message.chat.id,
+        text,
+        reply_to_message_id=message.message_id,
+        reply_markup=markup,
+        parse_mode="HTML"
+    )
+
+def _edit_message_job(bot: AppTeleBot, chat_id: int, message_id: int, text: str, markup) -> None:
+    try:
+        bot.edit_message_text(text, chat_id, message_id, reply_markup=markup, parse_mode="HTML")
+    except ApiTelegramException as e:
+        if not is_message_not_modified_error(e):
+            raise
+
+def queue_edit(bot: AppTeleBot, chat_id: int, message_id: int, text: str, markup=None) -> Future:
+    # Частые правки одного сообщения (листание, прогресс) заменяют еще не отправленную предыдущую
+    return bot.outbound.submit(chat_id, _edit_message_job, bot, chat_id, message_id, text, markup,
+                               merge_key=("edit", message_id))
+
+def mycodes_page_callback(call: types.CallbackQuery, bot: AppTeleBot):
+    """
+    Листание /mycodes: редактирует сообщение со списком вместо отправки нового.
+    """
+    parsed = parse_mycodes_callback(call.data)
+    if parsed is None or call.message is None:
+        bot.outbound.submit(call.from_user.id, bot.answer_callback_query, call.id, cost=0)
+        return
+
+    owner_id, cursor = parsed
+    chat_id = call.message.chat.id
+    if owner_id != call.from_user.id:
+        # Чужой список в группе не листаем: иначе сообщение заменилось бы списком нажавшего
+        bot.outbound.submit(chat_id, bot.answer_callback_query, call.id, MYCODES_FOREIGN_TEXT, show_alert=True, cost=0)
+        return
+    # Страница строится заново по текущему списку: если он изменился, курсор укажет на ближайшую страницу
+    codes = bot.user_barcodes.get(owner_id, [])
+    text, markup = build_mycodes_page(codes, owner_id, cursor)
+    bot.outbound.submit(chat_id, bot.answer_callback_query, call.id, cost=0)
+    queue_edit(bot, chat_id, call.message.message_id, text, markup)
+
+def document_codes_handler(message: types.Message, bot: AppTeleBot):
+    """
+    Файл со списком кодов в ответ на /codes.
+    """
+    if not message.from_user or not message.document: return
+    error_text = check_import_document(message.document)
+    if error_text:
+        # Состояние не сбрасываем: можно отправить другой файл или коды текстом
+        queue_reply(bot, message, error_text)
+        return
+
+    user_id, chat_id = message.from_user.id, message.chat.id
+    existing_count = len(bot.user_barcodes.get(user_id, []))
+    if not existing_count:
+        bot.delete_state(user_id, chat_id)
+        _import_pool.submit(_import_codes_job, bot, chat_id, user_id, message.document.file_id, message.document.file_size,
+                            False, None, message.message_id)
+        return
+
+    bot.set_state(user_id, CodesStates.confirming_import, chat_id)
+    bot.add_data(user_id, chat_id, import_file_id=message.document.file_id, import_file_size=message.document.file_size)
+    queue_message(bot, chat_id, f"Получен файл <code>{html.escape(message.document.file_name or '')}</code>. "
+                                "Добавить коды к текущему списку или заменить его?",
+                  reply_to_message_id=message.message_id, reply_markup=build_import_mode_markup(existing_count))
+
+def import_mode_callback(call: types.CallbackQuery, bot: AppTeleBot):
+    user_id = call.from_user.id
+    chat_id = call.message.chat.id if call.message else user_id
+    bot.outbound.submit(chat_id, bot.answer_callback_query, call.id, cost=0)
+    if call.message is None or bot.get_state(user_id, chat_id) != CodesStates.confirming_import.name:
+        return # Кнопка от старого сообщения: импорт уже запущен или отменен
+    with bot.retrieve_data(user_id, chat_id) as data:
+        file_id, file_size = (data or {}).get("import_file_id"), (data or {}).get("import_file_size")
+    bot.delete_state(user_id, chat_id)
+    if not file_id:
+        return
+    append = call.data == f"{IMPORT_CALLBACK_PREFIX}append"
+    _import_pool.submit(_import_codes_job, bot, chat_id, user_id, file_id, file_size, append, call.message.message_id, None)
+
+def _import_codes_job(bot: AppTeleBot, chat_id: int, user_id: int, file_id: str, file_size: int | None, append: bool,
+                      status_message_id: int | None, reply_to_message_id: int | None) -> None:
+    """
+    Скачивает и разбирает файл в пуле импорта, показывая прогресс правками одного сообщения.
+    """
+    try:
+        if status_message_id is None:
+            status_message = queue_message(bot, chat_id, "Импорт файла...", reply_to_message_id=reply_to_message_id).result()
+            status_message_id = status_message.message_id
+        else:
+            queue_edit(bot, chat_id, status_message_id, "Импорт файла...")
+
+        existing = bot.user_barcodes.get(user_id, []) if append else ()
+        importer = CodeImporter(config.IMPORT_MAX_CODES, existing)
+        file_info = bot.get_file(file_id)
+        error_text = run_code_import(
+            bot.token, file_info.file_path, importer,
+            lambda progress: queue_edit(bot, chat_id, status_message_id, import_progress_text(progress, file_size)),
+        )
+        if error_text:
+            queue_edit(bot, chat_id, status_message_id, error_text)
+            return
+        store_user_codes(bot, user_id, importer.codes)
+        logger.info(f"Пользователь {user_id} импортировал {importer.added_count} кодов из файла "
+                    f"({importer.bytes_read} байт, режим {'append' if append else 'replace'}).")
+        queue_edit(bot, chat_id, status_message_id, import_report_text(importer, append))
+    except Exception as e:
+        logger.error(f"Ошибка импорта файла для пользователя {user_id}: {e}", exc_info=True)
+        if status_message_id is not None:
+            queue_edit(bot, chat_id, status_message_id, "Произошла ошибка при импорте файла. Список не изменен.")
+
+def sheet_handler(message: types.Message, bot: AppTeleBot):
+    """
+    /sheet: весь список пользователя на листах для печати.
+    """
+    if not message.from_user: return
+    codes = bot.user_barcodes.get(message.from_user.id, [])
+    if not codes:
+        queue_reply(bot, message, NO_CODES_TEXT)
+        return
+    request = parse_sheet_args(message.text.split()[1:])
+    if request.error_text:
+        queue_reply(bot, message, request.error_text, parse_mode="HTML")
+        return
+    _sheet_pool.submit(_sheet_job, bot, message.chat.id, codes[:config.SHEET_MAX_CODES], len(codes), request,
+                       message.message_id)
+
+def _send_document_job(bot: AppTeleBot, chat_id: int, document, file_name: str, caption: str | None,
+                             reply_to_message_id: int | None):
+    document.seek(0) # Повтор после 429 отправляет файл с начала
+    return bot.send_document(chat_id, document, caption=caption, reply_to_message_id=reply_to_message_id,
+                             visible_file_name=file_name)
+
+def _sheet_job(bot: AppTeleBot, chat_id: int, codes: list[str], total_count: int, request: SheetRequest,
+               reply_to_message_id: int) -> None:
+    """
+    Собирает лист в пуле /sheet: страницы отрисовываются по одной и сразу пишутся в PDF во временном
+    файле или уходят отдельными PNG-документами.
+    """
+    status_message_id = None
+    try:
+        status_message_id = queue_message(bot, chat_id, "Подготовка листа...", reply_to_message_id=reply_to_message_id).result().message_id
+        layout, engine, error_text = prepare_sheet(request, len(codes))
+        if error_text:
+            queue_edit(bot, chat_id, status_message_id, error_text)
+            return
+        page_count = layout.page_count(len(codes))
+        caption = sheet_caption(len(codes), total_count, page_count)
+
+        if request.sheet_format == "pdf":
+            with tempfile.TemporaryFile() as pdf_file:
+                write_sheet_pdf(pdf_file, codes, layout, engine, lambda page_number: queue_edit(
+                    bot, chat_id, status_message_id, sheet_progress_text(page_number, page_count)))
+                # Ждем отправки: временный файл закрывается при выходе из with
+                bot.outbound.submit(chat_id, _send_document_job, bot, chat_id, pdf_file, "barcodes.pdf", caption,
+                                    reply_to_message_id).result()
+        else:
+            sent = None
+            for page_number, page_data in enumerate(iter_sheet_pages(codes, layout, "png", engine), 1):
+                if sent is not None:
+                    sent.result() # Не больше одной готовой страницы в очереди отправки
+                sent = bot.outbound.submit(chat_id, _send_document_job, bot, chat_id, BytesIO(page_data),
+                                           f"barcodes_{page_number}.png", caption if page_number == 1 else None,
+                                           reply_to_message_id)
+                queue_edit(bot, chat_id, status_message_id, sheet_progress_text(page_number, page_count))
+            if sent is not None:
+                sent.result()
+        logger.info(f"Лист штрих-кодов отправлен в чат {chat_id}: {len(codes)} кодов, {page_count} стр., "
+                    f"формат {request.sheet_format}.")
+        queue_edit(bot, chat_id, status_message_id, f"Готово: {len(codes)} кодов на {page_count} стр.")
+    except Exception as e:
+        logger.error(f"Ошибка подготовки листа штрих-кодов для чата {chat_id}: {e}", exc_info=True)
+        if status_message_id is not None:
+            queue_edit(bot, chat_id, status_message_id, SHEET_ERROR_TEXT)
+
+def profile_handler(message: types.Message, bot: AppTeleBot):
+    """
+    /profile: cProfile в потоках обработчиков или tracemalloc на заданное окно, отчет — документами.
+    """
+    if not message.from_user or not is_admin(message.from_user.id):
+        queue_reply(bot, message, ADMIN_ONLY_TEXT)
+        return
+    if not config.PROFILE_ENABLED:
+        queue_reply(bot, message, PROFILE_DISABLED_TEXT)
+        return
+    request = parse_profile_args(message.text.split()[1:])
+    if request.error_text:
+        queue_reply(bot, message, request.error_text, parse_mode="HTML")
+        return
+    try:
+        profiler.start(request.mode)
+    except ProfilerBusyError:
+        queue_reply(bot, message, PROFILE_BUSY_TEXT)
+        return
+    logger.info(f"Профилирование ({request.mode}, {request.seconds} с) запущено администратором {message.from_user.id}.")
+    queue_reply(bot, message, profile_started_text(request))
+    _profile_pool.submit(_profile_job, bot, message.chat.id, request.seconds, message.message_id)
+
+def _profile_job(bot: AppTeleBot, chat_id: int, seconds: int, reply_to_message_id: int) -> None:
+    try:
+        profiler.wait(seconds)
+        report = profiler.stop(PROFILE_TOP_N)
+        if report is None:
+            return
+        text_name, raw_name = profile_file_names(report)
+        bot.outbound.submit(chat_id, _send_document_job, bot, chat_id, BytesIO(report.text.encode("utf-8")),
+                            text_name, profile_caption(report), reply_to_message_id)
+        bot.outbound.submit(chat_id, _send_document_job, bot, chat_id, BytesIO(report.raw), raw_name, None,
+                            reply_to_message_id)
+    except Exception as e:
+        logger.error(f"Ошибка профилирования для чата {chat_id}: {e}", exc_info=True)
+        profiler.stop()
+        queue_message(bot, chat_id, PROFILE_ERROR_TEXT, reply_to_message_id=reply_to_message_id)
+
+def gen_handler(message: types.Message, bot: AppTeleBot):
+    if not message.from_user: return
+
+    request = resolve_gen_request(message, bot.user_barcodes)
+    if request.batch_args is not None:
+        gen_batch_handler(message, bot, request.batch_args)
+        return
+    if request.error_text:
+        queue_message(
+            bot,
             message.chat.id,
-            f"Ваш временный список EAN-кодов ({len(codes)} шт.):\n<code>{codes_text}</code>",
+            request.error_text,
             reply_to_message_id=message.message_id,
             parse_mode="HTML"
         )
-    else:
-        bot.send_message(
+        return # Выход, если аргумент неверный
+
+    code_to_gen = request.code
+    # Отрисовка выполняется здесь, а отправка — в исходящей очереди: обработчик не ждет Telegram
+    try:
+        item = prepare_batch_item(bot, code_to_gen)
+    except RenderQueueFullError as e:
+        logger.warning(f"Отрисовка {code_to_gen} отклонена: {e}")
+        queue_message(bot, message.chat.id, RENDER_BUSY_TEXT, reply_to_message_id=message.message_id)
+        return
+    except Exception as e:
+        logger.error(f"Ошибка генерации штрих-кода для {code_to_gen}: {e}")
+        queue_message(bot, message.chat.id, gen_error_text(code_to_gen), reply_to_message_id=message.message_id, parse_mode="HTML")
+        return
+
+    if item[2] is None: # отрисовка вернула None (ошибка внутри)
+        queue_message(bot, message.chat.id, gen_failed_text(code_to_gen), reply_to_message_id=message.message_id, parse_mode="HTML")
+        return
+    bot.outbound.submit(message.chat.id, _send_gen_photo_job, bot, message.chat.id, item, message.message_id)
+
+
+def gen_batch_handler(message: types.Message, bot: AppTeleBot, args: list[str]):
+    """
+    Пакетная генерация: /gen all, /gen N или /gen <код> <код> ...
+    """
+    codes, rejected, error_text = resolve_batch_codes(message, args, bot.user_barcodes)
+    if error_text:
+        queue_message(
+            bot,
             message.chat.id,
-            "У вас нет временного списка EAN-кодов. Используйте /codes для загрузки.",
+            error_text,
             reply_to_message_id=message.message_id,
+            parse_mode="HTML"
         )
+        return
 
-def gen_handler(message: types.Message, bot: AppTeleBot):
-    if not message.from_user: return
-    
-    args = (message.text or "").split(maxsplit=1)
-    code_to_gen = None
-
-    if len(args) > 1:
-        potential_code = args[1].strip()
-        if potential_code.isdigit() and (len(potential_code) == 12 or len(potential_code) == 13):
-            code_to_gen = potential_code
-        else:
-            bot.send_message(
-                message.chat.id,
-                "Пожалуйста, укажите корректный EAN-код (12 или 13 цифр) после команды /gen, например: <code>/gen 123456789012</code>",
-                reply_to_message_id=message.message_id,
-                parse_mode="HTML"
-            )
-            return # Выход, если аргумент неверный
-    else:
-        # Генерация из списка пользователя (только если это личный чат)
-        if message.from_user.id == message.chat.id:
-            codes = bot.user_barcodes.get(message.from_user.id, [])
-            if codes:
-                code_to_gen = random.choice(codes)
-            else:
-                bot.send_message(
-                    message.chat.id,
-                    "Укажите EAN-код (например, <code>/gen 123456789012</code>) "
-                    "или загрузите список кодов через /codes.",
-                    reply_to_message_id=message.message_id,
-                    parse_mode="HTML"
-                )
-                return
-        else: # Если не в личке и код не указан
-             bot.send_message(
-                    message.chat.id,
-                    "В групповых чатах необходимо явно указать код для генерации: <code>/gen <код></code>",
-                    reply_to_message_id=message.message_id,
-                    parse_mode="HTML"
-                )
-             return
-
-
-    if code_to_gen:
-        try:
-            barcode_image_bytes = generate_ean13_barcode_image_bytes(code_to_gen)
-            if barcode_image_bytes:
-                bot.send_photo(
-                    chat_id=message.chat.id,
-                    photo=barcode_image_bytes,
-                    caption=f"Штрих-код для: <code>{code_to_gen}</code>",
-                    reply_to_message_id=message.message_id,
-                    parse_mode="HTML"
-                )
-            else: # generate_ean13_barcode_image_bytes вернул None (ошибка внутри)
-                bot.send_message(
-                    message.chat.id,
-                    f"Не удалось сгенерировать штрих-код для <code>{code_to_gen}</code>. Проверьте корректность кода (12 или 13 цифр).",
-                    reply_to_message_id=message.message_id,
-                    parse_mode="HTML"
-                )
-        except Exception as e:
-            logger.error(f"Ошибка генерации штрих-кода для {code_to_gen}: {e}")
-            bot.send_message(
-                message.chat.id,
-                f"Произошла ошибка при генерации штрих-кода для <code>{code_to_gen}</code>.",
-                reply_to_message_id=message.message_id,
-                parse_mode="HTML"
-            )
+    ready, failed = render_batch_items(bot, codes)
+    # Альбомы и итоговое сообщение уходят через исходящую очередь по порядку
+    progress = BatchSendProgress(rejected + failed)
+    for start in range(0, len(ready), MEDIA_GROUP_LIMIT):
+        chunk = ready[start:start + MEDIA_GROUP_LIMIT]
+        bot.outbound.submit(message.chat.id, _send_batch_chunk_job, bot, message.chat.id, chunk, message.message_id, progress)
+    bot.outbound.submit(message.chat.id, _finish_batch_job, bot, message.chat.id, message.message_id, progress)
 
 
 def cancel_handler_state(message: types.Message, bot: TeleBot):
     if not message.from_user:
         logger.warning("Cancel attempt without from_user in message: %s", message.message_id)
-        return 
+        return
 
+    # /cancel снимает и фоновую отрисовку списка: пользователь больше не ждет /gen по нему
+    prerenderer.cancel(message.from_user.id)
     current_state = bot.get_state(message.from_user.id, message.chat.id)
     if current_state is None:
-        bot.send_message(message.chat.id, "Нет активной операции для отмены.")
+        queue_message(bot, message.chat.id, NO_STATE_TEXT)
         return
 
     bot.delete_state(message.from_user.id, message.chat.id)
-    bot.send_message(message.chat.id, "Операция отменена.")
+    queue_message(bot, message.chat.id, STATE_CANCELLED_TEXT)
 
 # --- Новые административные команды ---
 
 def unauthorized_list_handler(message: types.Message, bot: AppTeleBot):
     if not message.from_user or not is_admin(message.from_user.id):
         # Middleware должен был уже отсечь, но на всякий случай
-        bot.reply_to(message, "Эта команда доступна только администраторам.")
+        queue_reply(bot, message, ADMIN_ONLY_TEXT)
         return
 
     # Получаем экземпляр middleware через атрибут бота, установленный при инициализации
     if not hasattr(bot, 'auth_middleware_instance_ref'):
-        bot.reply_to(message, "Ошибка: Middleware не найден.")
+        queue_reply(bot, message, "Ошибка: Middleware не найден.")
         logger.error("auth_middleware_instance_ref not found on bot object for unauthorized_list_handler.")
         return
-    
+
     auth_middleware = bot.auth_middleware_instance_ref
     if auth_middleware is None:
         logger.error("auth_middleware_instance_ref is None on bot object for unauthorized_list_handler.")
         return
 
-    unknown_users_data = auth_middleware.unknown_users_access_attempts
+    unknown_users_data = auth_middleware.access_tracker.snapshot()
 
     if not unknown_users_data:
-        bot.reply_to(message, "Записей о неавторизованных попытках доступа нет.")
+        queue_reply(bot, message, NO_UNAUTHORIZED_TEXT)
         return
 
-    response_parts = ["<b>Неавторизованные попытки доступа:</b>\n"]
-    for user_id_str, info in unknown_users_data.items():
-        part = (
-            f"\n<b>ID:</b> <code>{user_id_str}</code>\n"
-            f"  Username: <code>@{info.get('username', 'N/A')}</code>\n"
-            f"  Full Name: {info.get('full_name', 'N/A')}\n"
-            f"  Attempts: {info.get('attempts', 1)}\n"
-            f"  Chat ID: {info.get('chat_id', 'N/A')}"
-        )
-        response_parts.append(part)
-    
-    full_response = "".join(response_parts)
-
-    # Отправка длинных сообщений по частям
-    if len(full_response) > 4096:
-        current_chunk = ""
-        for line in full_response.splitlines(keepends=True):
-            if len(current_chunk) + len(line) > 4050: # Оставляем небольшой запас
-                bot.send_message(message.chat.id, current_chunk, parse_mode="HTML")
-                current_chunk = line
-            else:
-                current_chunk += line
-        if current_chunk: # Отправить остаток
-            bot.send_message(message.chat.id, current_chunk, parse_mode="HTML")
-    else:
-        bot.send_message(message.chat.id, full_response, parse_mode="HTML")
-
-    # Опционально: Очистить список после показа
-    # auth_middleware.unknown_users_access_attempts.clear()
-    # bot.send_message(message.chat.id, "<i>Список попыток доступа очищен.</i>", parse_mode="HTML")
+    for chunk in build_unauthorized_chunks(unknown_users_data):
+        queue_message(bot, message.chat.id, chunk, parse_mode="HTML")
 
 
 def add_admin_handler(message: types.Message, bot: TeleBot):
     if not message.from_user or not is_admin(message.from_user.id):
-        bot.reply_to(message, "Эта команда доступна только администраторам.")
-        return
-
-    parts = (message.text or "").split()
-    if len(parts) < 2:
-        bot.reply_to(message, "Использование: <code>/addadmin [user_id]</code>", parse_mode="HTML")
-        return
-
-    try:
-        new_admin_id = int(parts[1])
-        if new_admin_id <= 0: # Простая проверка на валидность ID
-            raise ValueError("User ID must be a positive integer.")
-    except ValueError:
-        bot.reply_to(message, "Неверный ID пользователя. ID должен быть целым положительным числом.")
+        queue_reply(bot, message, ADMIN_ONLY_TEXT)
         return
-
-    if new_admin_id in config.ADMIN_IDS:
-        bot.reply_to(message, f"Пользователь с ID <code>{new_admin_id}</code> уже является администратором.")
-        return
-
-    config.ADMIN_IDS.append(new_admin_id) # Обновляем список в памяти
-    if config.save_config(): # Сохраняем в файл (save_config вернет True при успехе)
-        bot.reply_to(message, f"Пользователь с ID <code>{new_admin_id}</code> успешно добавлен в администраторы.\n"
-                              "Изменения применены и сохранены в конфигурации.")
-        logger.info(f"Admin {new_admin_id} added by {message.from_user.id}. ADMIN_IDS in memory: {config.ADMIN_IDS}")
-    else:
-        # Пытаемся откатить изменение в памяти, если сохранение не удалось
-        if new_admin_id in config.ADMIN_IDS:
-            config.ADMIN_IDS.remove(new_admin_id)
-        bot.reply_to(message, "Произошла ошибка при сохранении изменений в файл конфигурации. Администратор не добавлен.")
+    queue_reply(bot, message, apply_add_admin(message), parse_mode="HTML")
 
 
 def del_admin_handler(message: types.Message, bot: TeleBot):
     if not message.from_user or not is_admin(message.from_user.id):
-        bot.reply_to(message, "Эта команда доступна только администраторам.")
-        return
-
-    parts = (message.text or "").split()
-    if len(parts) < 2:
-        bot.reply_to(message, "Использование: <code>/deladmin [user_id]</code>", parse_mode="HTML")
+        queue_reply(bot, message, ADMIN_ONLY_TEXT)
         return
-
-    try:
-        admin_id_to_remove = int(parts[1])
-    except ValueError:
-        bot.reply_to(message, "Неверный ID пользователя. ID должен быть числом.")
-        return
-    
-    if admin_id_to_remove == message.from_user.id:
-        bot.reply_to(message, "Вы не можете удалить самого себя из администраторов этой командой.")
-        return
-    
-    # Проверяем, есть ли такой ID в текущем списке админов в памяти
-    if admin_id_to_remove not in config.ADMIN_IDS:
-        bot.reply_to(message, f"Пользователь с ID <code>{admin_id_to_remove}</code> не найден в списке администраторов.")
-        return
-
-    config.ADMIN_IDS.remove(admin_id_to_remove) # Обновляем список в памяти
-    if config.save_config(): # Сохраняем в файл
-        bot.reply_to(message, f"Пользователь с ID <code>{admin_id_to_remove}</code> успешно удален из администраторов.\n"
-                              "Изменения применены и сохранены в конфигурации.")
-        logger.info(f"Admin {admin_id_to_remove} removed by {message.from_user.id}. ADMIN_IDS in memory: {config.ADMIN_IDS}")
-    else:
-        # Пытаемся откатить изменение в памяти, если сохранение не удалось
-        if admin_id_to_remove not in config.ADMIN_IDS: # Если его там уже нет (маловероятно, но все же)
-             config.ADMIN_IDS.append(admin_id_to_remove) # Возвращаем обратно
-        bot.reply_to(message, "Произошла ошибка при сохранении изменений в файл конфигурации. Администратор не удален.")
+    queue_reply(bot, message, apply_del_admin(message), parse_mode="HTML")
 
 def reload_config_handler(message: types.Message, bot: TeleBot):
     if not message.from_user or not is_admin(message.from_user.id):
-        bot.reply_to(message, "Эта команда доступна только администраторам.")
+        queue_reply(bot, message, ADMIN_ONLY_TEXT)
         return
-    
-    try:
-        config.load_config() # Вызываем функцию перезагрузки из модуля config
-        # Обновляем уровень логгера для основного логгера приложения (если он настраивался глобально)
-        # и для логгера текущего модуля
-        logging.getLogger().setLevel(config.LOG_LEVEL)
-        logger.setLevel(config.LOG_LEVEL)
+    queue_reply(bot, message, apply_reload_config(message))
 
-        bot.reply_to(message, "Конфигурация успешно перезагружена из файла. "
-                              "Уровень логирования обновлен.")
-        logger.info(f"Config reloaded by admin {message.from_user.id}. New ADMIN_IDS: {config.ADMIN_IDS}, LOG_LEVEL: {config.LOG_LEVEL}")
-    except Exception as e:
-        logger.error(f"Ошибка при перезагрузке конфигурации: {e}", exc_info=True)
-        bot.reply_to(message, f"Произошла ошибка при перезагрузке конфигурации: {e}")
\ No newline at end of file
+def stats_handler(message: types.Message, bot: AppTeleBot):
+    if not message.from_user or not is_admin(message.from_user.id):
+        queue_reply(bot, message, ADMIN_ONLY_TEXT)
+        return
+    queue_reply(bot, message, build_stats_text(bot.outbound.stats()), parse_mode="HTML")
@@ -1,52 +1,203 @@
 from telebot import BaseMiddleware, CancelUpdate
+from telebot.asyncio_handler_backends import BaseMiddleware as AsyncBaseMiddleware, CancelUpdate as AsyncCancelUpdate
 from telebot.types import Message
 from . import config
+from .utils.access_tracker import UnauthorizedAccessTracker
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
-class AdministatorMiddleware(BaseMiddleware):
+class AccessControlMixin:
     """
-    Middleware to handle administrator commands.
+    Общая логика проверки доступа для синхронного и асинхронного middleware.
     """
-    def __init__(self):
+    def _init_access_control(self, persist_path: str | None = None):
         self.update_sensitive = True
         self.update_types = ['message', 'edited_message']
-        self.unknown_users_access_attempts = {}
+        if persist_path is None:
+            persist_path = config.UNAUTHORIZED_PERSIST_PATH
+        # Ограниченный список нарушителей с редким логированием (см. UNAUTHORIZED_* в config.ini)
+        self.access_tracker = UnauthorizedAccessTracker(
+            config.UNAUTHORIZED_MAX_TRACKED, config.UNAUTHORIZED_LOG_INTERVAL, persist_path
+        )
+        self.access_tracker.start_persistence(config.UNAUTHORIZED_PERSIST_INTERVAL)
 
-    def pre_process_message(self, message: Message, data):
+    def _record_denied(self, message: Message, kind: str) -> None:
+        user = message.from_user
+        user_id = user.id if user and hasattr(user, 'id') else 'Unknown'
+        full_name = user.full_name if user and hasattr(user, 'full_name') else 'Unknown'
+        username = user.username if user and hasattr(user, 'username') else 'Unknown'
+        should_log, info = self.access_tracker.record(user_id, username, full_name, message.chat.id)
+        if should_log:
+            logger.warning(
+                "Unauthorized access attempt (%s) by user %s in chat %s: fullname=%s, username=%s, "
+                "attempts=%d, not logged since last warning=%d",
+                kind, user_id, message.chat.id, full_name, username, info['attempts'], info['suppressed'],
+            )
+
+    def is_denied_message(self, message: Message) -> bool:
         user_id = message.from_user.id if message.from_user and hasattr(message.from_user, 'id') else 'Unknown'
-        if user_id == int(message.chat.id):
-            if user_id not in config.ADMIN_IDS:
-                full_name = message.from_user.full_name if message.from_user and hasattr(message.from_user, 'full_name') else 'Unknown'
-                username = message.from_user.username if message.from_user and hasattr(message.from_user, 'username') else 'Unknown'
-                user_id_str = str(user_id)
-                logger.warning(f'''Unauthorized access attempt by user {user_id} in chat {message.chat.id}.\n
-                               fullname: {full_name}\n
-                               username: {username}\n''')
-                if user_id_str in self.unknown_users_access_attempts:
-                    self.unknown_users_access_attempts[user_id_str]['attempts'] += 1
-                else:
-                    self.unknown_users_access_attempts[user_id_str] = {
-                        'username': username,
-                        'full_name': full_name,
-                        'attempts': 1,
-                        'chat_id': message.chat.id # Сохраняем chat_id для информации
-                    }
-                return CancelUpdate()
+        # Один O(1)-поиск в неизменяемом снимке конфигурации, без блокировок
+        if user_id == message.chat.id and not config.is_admin_id(user_id):
+            self._record_denied(message, 'message')
+            return True
+        return False
+
+    def is_denied_edited_message(self, message: Message) -> bool:
+        if not message.from_user:
+            return False
+        user_id = message.from_user.id
+        if user_id == message.chat.id and not config.is_admin_id(user_id):
+            self._record_denied(message, 'edited message')
+            return True
+        return False
+
+class AdministatorMiddleware(AccessControlMixin, BaseMiddleware):
+    """
+    Middleware to handle administrator commands.
+    """
+    def __init__(self, persist_path: str | None = None):
+        self._init_access_control(persist_path)
+
+    def pre_process_message(self, message: Message, data):
+        if self.is_denied_message(message):
+            return CancelUpdate()
 
     def post_process_message(self, message, data, exception):
         pass # only message update here for post_process
 
     def pre_process_edited_message(self, message: Message, data):
-        if not message.from_user:
-            return
-        user_id = message.from_user.id
-        if user_id == message.chat.id:
-            if user_id not in config.ADMIN_IDS:
-                logger.warning(f"Unauthorized access attempt (edited message) by user {user_id}")
-                return CancelUpdate()
+        if self.is_denied_edited_message(message):
+            return CancelUpdate()
 
     def post_process_edited_message(self, message, data, exception):
         pass # only edited_message update here for post_process
 
+class AsyncAdministatorMiddleware(AccessControlMixin, AsyncBaseMiddleware):
+    """
+    Async version of AdministatorMiddleware for AsyncTeleBot.
+    """
+    def __init__(self):
+        self._init_access_control()
+
+    async def pre_process_message(self, message: Message, data):
+        if self.is_denied_message(message):
+            return AsyncCancelUpdate()
+
+    async def post_process_message(self, message, data, exception):
+        pass
+
+    async def pre_process_edited_message(self, message: Message, data):
+        if self.is_denied_edited_message(message):
+            return AsyncCancelUpdate()
+
+    async def post_process_edited_message(self, message, data, exception):
+        pass
+
+# Метка обработчика для обновлений, которые не являются известной командой
+OTHER_COMMAND_LABEL = "other"
+CALLBACK_LABEL = "callback_query"
+RECEIVED_AT_ATTR = "_received_at" # Время получения обновления (time.perf_counter), см. AppTeleBot.process_new_updates
+
+
+class MetricsMixin:
+    """
+    Общая логика метрик для синхронного и асинхронного middleware: время ожидания
+    обновления в пуле потоков и время обработки по командам.
+
+    Регистрируется после AdministatorMiddleware, поэтому отклоненные обновления не учитываются.
+    """
+    def _init_metrics(self, registry):
+        self.update_sensitive = True
+        self.update_types = ['message', 'callback_query']
+        self.registry = registry
+        # Заполняется после регистрации обработчиков: произвольные /команды не должны плодить метки
+        self.known_commands: frozenset[str] = frozenset()
+
+    def set_known_commands(self, handlers: list[dict]) -> None:
+        commands = set()
+        for handler in handlers:
+            commands.update(handler['filters'].get('commands') or ())
+        self.known_commands = frozenset(commands)
+
+    def command_label(self, message: Message) -> str:
+        if message.content_type != 'text':
+            return message.content_type
+        if not message.text or not message.text.startswith('/'):
+            return 'text'
+        command = message.text.split(maxsplit=1)[0][1:].split('@', 1)[0]
+        return command if command in self.known_commands else OTHER_COMMAND_LABEL
+
+    def _start(self, update, data) -> None:
+        if not self.registry.enabled:
+            return
+        started = time.perf_counter()
+        received_at = getattr(update, RECEIVED_AT_ATTR, None)
+        if received_at is not None:
+            self.registry.observe("bot_update_queue_wait_seconds", started - received_at)
+        data['_metrics_started'] = started
+
+    def _finish(self, label: str, data, exception) -> None:
+        started = data.get('_metrics_started')
+        if started is None:
+            return
+        self.registry.observe("bot_handler_seconds", time.perf_counter() - started, command=label)
+        if exception is not None:
+            self.registry.inc("bot_handler_errors_total", command=label)
+
+class MetricsMiddleware(MetricsMixin, BaseMiddleware):
+    """
+    Middleware для сбора метрик обработчиков.
+    """
+    def __init__(self, registry):
+        self._init_metrics(registry)
+
+    def pre_process_message(self, message: Message, data):
+        self._start(message, data)
+
+    def post_process_message(self, message, data, exception):
+        self._finish(self.command_label(message), data, exception)
+
+    def pre_process_callback_query(self, call, data):
+        self._start(call, data)
+
+    def post_process_callback_query(self, call, data, exception):
+        self._finish(CALLBACK_LABEL, data, exception)
+
+class AsyncMetricsMiddleware(MetricsMixin, AsyncBaseMiddleware):
+    """
+    Async version of MetricsMiddleware for AsyncTeleBot.
+    """
+    def __init__(self, registry):
+        self._init_metrics(registry)
+
+    async def pre_process_message(self, message: Message, data):
+        self._start(message, data)
+
+    async def post_process_message(self, message, data, exception):
+        self._finish(self.command_label(message), data, exception)
+
+    async def pre_process_callback_query(self, call, data):
+        self._start(call, data)
+
+    async def post_process_callback_query(self, call, data, exception):
+        self._finish(CALLBACK_LABEL, data, exception)
+
+class ProfilingMiddleware(BaseMiddleware):
+    """
+    Включает cProfile в потоке обработчика на время обработки обновления, пока идет сеанс /profile.
+
+    В асинхронном боте не нужен: все обработчики выполняются в потоке цикла событий,
+    и профиль включается в нем на все окно.
+    """
+    def __init__(self, profiler):
+        self.update_sensitive = False
+        self.update_types = ['message', 'callback_query']
+        self.profiler = profiler
+
+    def pre_process(self, message, data):
+        self.profiler.enter()
+
+    def post_process(self, message, data, exception):
+        self.profiler.exit()
@@ -0,0 +1,355 @@
+# Файл: sharding.py
+"""
+Режим нескольких процессов (SHARD_WORKERS > 0): процесс-диспетчер получает обновления
+(app.updates.UpdatePoller или webhook) и раскладывает их по процессам-воркерам
+по from_user.id.
+
+Обновления одного пользователя всегда попадают в один воркер, поэтому его состояние /codes
+и кэш кодов живут в памяти одного процесса, а внутри воркера обновления пользователя
+обрабатываются строго по очереди (UserLanes). Воркеры выполняют обычные обработчики
+из app/handlers, у каждого свой GIL.
+
+Что делят процессы:
+- коды пользователей хранятся в SQLite; при STORAGE_BACKEND = json воркеры тоже используют
+  SQLite, а data.json один раз переносится в базу диспетчером;
+- снимок состояний, индекс file_id и список нарушителей у каждого воркера свои (*.shardN.*);
+- общий лимит исходящих запросов и лимит сообщений в группу (OUTBOUND_GROUP_PER_MINUTE)
+  делятся между воркерами поровну;
+- записи логов воркеров диспетчер пишет в общий app.log;
+- метрики воркер отдает на METRICS_PORT + 1 + номер воркера.
+
+Обновления группы маршрутизируются по отправителю, а не по чату: иначе список и состояние
+пользователя жили бы в двух процессах сразу (личный чат и группа). Цена — лимит группы
+делится на число воркеров, даже если все ее участники попали в один воркер: такая группа
+получает ответы медленнее, зато суммарно воркеры не превышают лимит Telegram и не ловят 429.
+
+Упавший воркер перезапускается. Обновления, которые он уже получил, но не обработал, теряются:
+повторная доставка могла бы снова уронить воркер. При остановке диспетчер ждет, пока воркеры
+обработают полученное и дошлют ответы (не дольше SHARD_DRAIN_TIMEOUT).
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Callable
+
+from telebot import types
+
+from . import config
+from .bot_logging import forward_worker_logs, setup_worker_logging
+from .entities import WorkerShard, stamp_received
+from .factory import create_app
+from .utils.metrics import metrics
+from .utils.saving_and_loading import STORAGE_BACKEND_JSON, STORAGE_BACKEND_SQLITE, create_barcode_storage
+from .webhook import WebhookServer
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 100 # Сколько обновлений передавать воркеру одной записью в канал
+RESTART_BACKOFF_MAX = 30 # Наибольшая пауза перед перезапуском воркера, который падает снова и снова, секунды
+STABLE_UPTIME = 60 # Воркер, проработавший столько секунд, перезапускается без паузы
+_STOP = None # Сигнал остановки в очереди воркера, в канале к воркеру и в очереди потока UserLanes
+
+
+def update_routing_id(update: dict) -> int:
+    """
+    Число, по которому обновление закрепляется за воркером: id отправителя, иначе id чата.
+    Обновления без отправителя и чата (например, poll) получает воркер 0.
+    """
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for field in ("from", "user"):
+            user = value.get(field)
+            if isinstance(user, dict) and isinstance(user.get("id"), int):
+                return user["id"]
+        chat = value.get("chat")
+        if isinstance(chat, dict) and isinstance(chat.get("id"), int):
+            return chat["id"]
+    return 0
+
+
+class UserLanes:
+    """
+    Потоки обработки, в которых обновления одного пользователя выполняются по очереди:
+    пользователь закреплен за потоком так же, как за воркером.
+    """
+
+    def __init__(self, count: int, handle: Callable, name: str = "lane"):
+        self._handle = handle
+        self._queues = [queue.SimpleQueue() for _ in range(max(1, count))]
+        self._threads = [threading.Thread(target=self._run, args=(lane_queue,), name=f"{name}-{index}", daemon=True)
+                         for index, lane_queue in enumerate(self._queues)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key: int, item) -> None:
+        self._queues[key % len(self._queues)].put(item)
+
+    def stop(self) -> None:
+        """
+        Дожидается обработки всего, что уже поставлено в очереди.
+        """
+        for lane_queue in self._queues:
+            lane_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, lane_queue: queue.SimpleQueue) -> None:
+        while True:
+            item = lane_queue.get()
+            if item is _STOP:
+                return
+            try:
+                self._handle(item)
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления: {e}", exc_info=True)
+
+
+def run_worker(shard: WorkerShard, connection, log_queue) -> None:
+    """
+    Точка входа процесса-воркера: читает пачки обновлений из connection, пока не получит _STOP.
+    """
+    # Своя группа процессов: Ctrl+C из терминала получает только диспетчер (он и останавливает воркеры,
+    # дослав обновления), а упавший воркер диспетчер завершает вместе с процессами его пула отрисовки
+    os.setpgrp()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_worker_logging(log_queue, config.LOG_LEVEL, f"shard{shard.index}", config.LOG_DEBUG_SAMPLE_RATE)
+    application = create_app(shard)
+    bot = application.bot
+    lanes = UserLanes(config.NUM_THREADS, lambda update: bot.process_new_updates([update]), name=f"shard{shard.index}")
+    application.start_prewarm()
+    logger.info(f"Воркер {shard.index + 1}/{shard.count} запущен (pid {os.getpid()}).")
+    try:
+        while True:
+            try:
+                batch = connection.recv()
+            except EOFError:
+                logger.warning("Канал от диспетчера закрыт, воркер останавливается.")
+                break
+            if batch is _STOP:
+                break
+            for update_json in batch:
+                try:
+                    update = types.Update.de_json(update_json)
+                except (ValueError, TypeError, KeyError) as e:
+                    logger.warning(f"Не удалось разобрать обновление: {e}")
+                    continue
+                # Время получения, а не начала обработки: метрика ожидания учитывает очередь пользователя
+                stamp_received([update])
+                # У всех пользователей воркера один остаток от деления на shard.count: делим, иначе
+                # при общем делителе числа воркеров и потоков часть потоков простаивала бы
+                lanes.submit(update_routing_id(update_json) // shard.count, update)
+    finally:
+        lanes.stop()
+        application.shutdown()
+        logger.info(f"Воркер {shard.index + 1}/{shard.count} остановлен.")
+
+
+def prepare_shared_storage() -> None:
+    """
+    Готовит общую для воркеров базу SQLite до их запуска.
+    """
+    if config.STORAGE_BACKEND == STORAGE_BACKEND_JSON:
+        logger.warning(f"SHARD_WORKERS: data.json не выдерживает записи из нескольких процессов, воркеры "
+                       f"используют SQLite ({config.STORAGE_SQLITE_PATH}).")
+    # Перенос data.json выполняется здесь один раз, а не наперегонки в каждом воркере
+    storage = create_barcode_storage(STORAGE_BACKEND_SQLITE, sqlite_path=config.STORAGE_SQLITE_PATH,
+                                     cache_size=config.STORAGE_CACHE_SIZE)
+    storage.load()
+    storage.close()
+
+
+def _kill_process_group(pid: int) -> None:
+    """
+    Завершает оставшиеся процессы группы воркера (пул отрисовки переживает SIGKILL воркера).
+    """
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass # Группы нет: воркер упал до os.setpgrp() или его процессы уже завершились
+
+
+class _Worker:
+    """
+    Процесс-воркер и очередь его обновлений на стороне диспетчера.
+    """
+
+    def __init__(self, shard: WorkerShard, queue_size: int):
+        self.shard = shard
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.process: multiprocessing.Process | None = None
+        self.connection = None
+        self.started = 0.0
+        self.restarts = 0
+        self.backoff = 0.0
+        self.supervisor: threading.Thread | None = None
+
+
+class ShardedDispatcher:
+    """
+    Раскладывает обновления по воркерам и следит за их процессами.
+
+    У каждого воркера свой поток-надзиратель: он передает обновления из очереди воркера в канал
+    (multiprocessing.Pipe), замечает падение процесса и перезапускает его.
+    """
+
+    def __init__(self, worker_count: int, queue_size: int = 1000, drain_timeout: float = 30):
+        # spawn, а не fork: в диспетчере уже работают потоки (логирование, автоперезагрузка конфигурации)
+        self._context = multiprocessing.get_context("spawn")
+        self._log_queue = self._context.Queue()
+        self._log_listener = None
+        self._workers = [_Worker(WorkerShard(index, worker_count), queue_size) for index in range(worker_count)]
+        self.drain_timeout = drain_timeout
+        self._deadline: float | None = None # Момент, после которого остановка перестает ждать воркеры
+
+    def start(self) -> None:
+        prepare_shared_storage()
+        self._log_listener = forward_worker_logs(self._log_queue)
+        for worker in self._workers:
+            self._spawn(worker)
+            worker.supervisor = threading.Thread(target=self._supervise, args=(worker,),
+                                                 name=f"shard{worker.shard.index}-supervisor", daemon=True)
+            worker.supervisor.start()
+        metrics.add_collector(self._collect_metrics)
+        logger.info(f"Диспетчер запустил воркеров: {len(self._workers)}.")
+
+    def dispatch(self, updates: list[dict]) -> None:
+        """
+        Ставит обновления в очереди воркеров. Ждет, если очередь воркера заполнена.
+        """
+        count = len(self._workers)
+        for update in updates:
+            worker = self._workers[update_routing_id(update) % count]
+            worker.queue.put(update)
+            metrics.inc("bot_shard_updates_total", shard=str(worker.shard.index))
+
+    def stop(self) -> None:
+        """
+        Дает воркерам обработать уже полученные обновления и останавливает их.
+        """
+        self._deadline = time.monotonic() + self.drain_timeout
+        for worker in self._workers:
+            try:
+                # После всех обновлений в очереди: надзиратель сначала передаст их воркеру
+                worker.queue.put(_STOP, timeout=max(0.0, self._deadline - time.monotonic()))
+            except queue.Full:
+                logger.warning(f"Очередь воркера {worker.shard.index} не разгрузилась до остановки.")
+        for worker in self._workers:
+            worker.supervisor.join(max(0.0, self._deadline - time.monotonic()))
+        for worker in self._workers:
+            self._terminate(worker)
+            # Надзиратель, ждавший канала зависшего воркера, выходит после его завершения
+            worker.supervisor.join()
+            lost = worker.queue.qsize()
+            if lost:
+                logger.warning(f"Воркер {worker.shard.index}: не передано обновлений: {lost}.")
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
+        logger.info("Диспетчер остановлен.")
+
+    # --- Процессы воркеров ---
+
+    def _spawn(self, worker: _Worker) -> None:
+        receiver, sender = self._context.Pipe(duplex=False)
+        # Не daemon: у демона не может быть дочерних процессов, а воркеру нужен пул отрисовки
+        process = self._context.Process(target=run_worker, args=(worker.shard, receiver, self._log_queue),
+                                        name=f"shard{worker.shard.index}")
+        process.start()
+        # Читающий конец остается только у воркера: если он упадет, запись в канал сразу вернет ошибку
+        receiver.close()
+        worker.process, worker.connection, worker.started = process, sender, time.monotonic()
+
+    def _restart(self, worker: _Worker) -> bool:
+        """
+        Перезапускает упавший воркер. Возвращает False, если диспетчер уже останавливается.
+        """
+        worker.process.join()
+        worker.connection.close()
+        _kill_process_group(worker.process.pid)
+        uptime = time.monotonic() - worker.started
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            return False
+        # Воркер, падающий сразу после запуска, перезапускается с растущей паузой
+        worker.backoff = 0.0 if uptime >= STABLE_UPTIME else min(RESTART_BACKOFF_MAX, max(1.0, worker.backoff * 2))
+        logger.error(f"Воркер {worker.shard.index} завершился с кодом {worker.process.exitcode} через {uptime:.0f} с, "
+                     f"перезапуск через {worker.backoff:.0f} с.")
+        time.sleep(worker.backoff)
+        worker.restarts += 1
+        self._spawn(worker)
+        return True
+
+    def _terminate(self, worker: _Worker) -> None:
+        process = worker.process
+        if process is None or not process.is_alive():
+            return
+        logger.warning(f"Воркер {worker.shard.index} не завершился за {self.drain_timeout} с, принудительная остановка.")
+        process.terminate()
+        process.join()
+        _kill_process_group(process.pid)
+
+    def _supervise(self, worker: _Worker) -> None:
+        batch, stopping = [], False
+        while True:
+            if not worker.process.is_alive() and not self._restart(worker):
+                return
+            if not batch and not stopping:
+                try:
+                    item = worker.queue.get(timeout=1)
+                except queue.Empty:
+                    continue # Раз в секунду проверяем, жив ли процесс
+                while True:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= MAX_BATCH:
+                        break
+                    try:
+                        item = worker.queue.get_nowait()
+                    except queue.Empty:
+                        break
+            try:
+                if batch:
+                    worker.connection.send(batch)
+                    batch = []
+                if stopping:
+                    worker.connection.send(_STOP)
+                    break
+            except OSError:
+                continue # Воркер упал: пачку получит перезапущенный процесс
+        remaining = None if self._deadline is None else max(0.0, self._deadline - time.monotonic())
+        worker.process.join(remaining)
+
+    def _collect_metrics(self):
+        rows = []
+        for worker in self._workers:
+            labels = {"shard": str(worker.shard.index)}
+            alive = worker.process is not None and worker.process.is_alive()
+            rows.append(("bot_shard_queue_size", "gauge", labels, worker.queue.qsize()))
+            rows.append(("bot_shard_alive", "gauge", labels, int(alive)))
+            rows.append(("bot_shard_restarts_total", "counter", labels, worker.restarts))
+        return rows
+
+
+class ShardedWebhookServer(WebhookServer):
+    """
+    Webhook-сервер диспетчера: обновления передаются воркерам без разбора в types.Update.
+    """
+
+    def __init__(self, dispatcher: ShardedDispatcher, host: str, port: int, **kwargs):
+        super().__init__(None, host, port, **kwargs)
+        self.dispatcher = dispatcher
+
+    def parse_update(self, update_json):
+        # Разбирает обновление воркер; здесь только проверка, что это обновление
+        if not isinstance(update_json, dict) or not isinstance(update_json.get("update_id"), int):
+            raise ValueError("нет update_id")
+        return update_json
+
+    def process_update(self, update) -> None:
+        self.dispatcher.dispatch([update])
@@ -1,4 +1,5 @@
 from telebot.handler_backends import State, StatesGroup
 
 class CodesStates(StatesGroup):
-    waiting_for_codes = State()
\ No newline at end of file
+    waiting_for_codes = State()
+    confirming_import = State() # Файл получен, ждем выбора: добавить коды к списку или заменить его
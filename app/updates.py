@@ -0,0 +1,236 @@
+# Файл: updates.py
+"""
+Получение обновлений через getUpdates вместо TeleBot.polling.
+
+- Номер последнего переданного в обработку обновления сохраняется в файл (OffsetStore),
+  поэтому после перезапуска бот продолжает с него, а не с того, что Telegram считает
+  подтвержденным.
+- После запуска накопившиеся обновления забираются пачками по CATCHUP_BATCH_LIMIT, пока
+  Telegram не вернет неполную пачку; время разбора очереди пишется в лог.
+- Устаревшие сообщения (StalenessFilter) можно отбросить или схлопнуть повторы: команды,
+  которые пользователь отправил во время простоя и уже перестал ждать, не загружают пул отрисовки.
+- allowed_updates — только типы обновлений, для которых зарегистрированы обработчики.
+
+Диспетчер SHARD_WORKERS > 0 использует тот же UpdatePoller: обновления передаются как словари.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+from telebot import TeleBot, apihelper, util
+
+from .utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CATCHUP_BATCH_LIMIT = 100 # Наибольшая пачка getUpdates, которую отдает Telegram
+POLL_ERROR_DELAY = 3 # Пауза после ошибки getUpdates, секунды
+
+STALE_POLICY_KEEP = "keep"
+STALE_POLICY_DROP = "drop"
+STALE_POLICY_COLLAPSE = "collapse"
+STALE_POLICIES = (STALE_POLICY_KEEP, STALE_POLICY_DROP, STALE_POLICY_COLLAPSE)
+
+# Списки обработчиков TeleBot, имя которых не совпадает с "<тип обновления>_handlers"
+_HANDLER_LISTS = {
+    "inline_query": "inline_handlers",
+    "chosen_inline_result": "chosen_inline_handlers",
+}
+
+
+def allowed_updates_for(bot: TeleBot) -> list[str]:
+    """
+    Типы обновлений, для которых у бота есть обработчики, в порядке telebot.util.update_types.
+    """
+    allowed = []
+    for update_type in util.update_types:
+        handlers = getattr(bot, _HANDLER_LISTS.get(update_type, f"{update_type}_handlers"), None)
+        if handlers:
+            allowed.append(update_type)
+    return allowed
+
+
+def handled_update_types() -> list[str]:
+    """
+    allowed_updates для процесса без своего бота с обработчиками (диспетчер SHARD_WORKERS > 0):
+    регистрирует обработчики из app/handlers на временном TeleBot.
+    """
+    from .handlers import register_all_handlers
+
+    probe = TeleBot("0:handled-update-types", threaded=False)
+    register_all_handlers(probe)
+    return allowed_updates_for(probe)
+
+
+def _update_age_source(update: dict) -> dict | None:
+    # Сообщение, по дате которого судим об устаревании; callback_query не устаревает:
+    # его дата — дата исходного сообщения с кнопками, а не нажатия
+    for key in ("message", "edited_message"):
+        if key in update:
+            return update[key]
+    return None
+
+
+class StalenessFilter:
+    """
+    Отбрасывает или схлопывает сообщения старше max_age секунд.
+
+    drop — устаревшие сообщения не обрабатываются; collapse — из устаревших сообщений
+    с одинаковым текстом от одного пользователя в одном чате остается последнее в пачке;
+    keep (или max_age <= 0) — обновления не трогаются.
+    """
+
+    def __init__(self, max_age: float, policy: str = STALE_POLICY_COLLAPSE):
+        if policy not in STALE_POLICIES:
+            logger.warning(f"Неизвестная политика устаревших обновлений '{policy}', используется "
+                           f"'{STALE_POLICY_KEEP}'. Допустимы: {', '.join(STALE_POLICIES)}")
+            policy = STALE_POLICY_KEEP
+        self.max_age = max_age
+        self.policy = policy
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age > 0 and self.policy != STALE_POLICY_KEEP
+
+    def apply(self, updates: list[dict], now: float | None = None) -> tuple[list[dict], int]:
+        """
+        Возвращает (обновления для обработки, сколько отброшено).
+        """
+        if not self.enabled or not updates:
+            return updates, 0
+        deadline = (time.time() if now is None else now) - self.max_age
+        kept = []
+        seen = set() # Ключи уже встреченных (при проходе с конца) устаревших сообщений
+        for update in reversed(updates):
+            message = _update_age_source(update)
+            if message is None or message.get("edit_date", message.get("date", deadline)) >= deadline:
+                kept.append(update)
+                continue
+            if self.policy == STALE_POLICY_COLLAPSE:
+                key = (message.get("chat", {}).get("id"), message.get("from", {}).get("id"),
+                       message.get("text", message.get("caption")))
+                if key not in seen:
+                    seen.add(key)
+                    kept.append(update)
+        kept.reverse()
+        dropped = len(updates) - len(kept)
+        if dropped:
+            metrics.inc("bot_updates_stale_total", dropped, policy=self.policy)
+        return kept, dropped
+
+
+class OffsetStore:
+    """
+    Номер последнего переданного в обработку обновления в JSON-файле.
+
+    Запись атомарная (временный файл и os.replace): после сбоя в файле остается прежнее
+    или новое значение, но не обрывок. Пустой path отключает сохранение.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._saved: int | None = None
+
+    def load(self) -> int | None:
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self._saved = int(json.load(file)["last_update_id"])
+        except (OSError, TypeError, ValueError, KeyError) as e:
+            logger.error(f"Не удалось прочитать номер последнего обновления из {self.path}: {e}")
+            return None
+        return self._saved
+
+    def save(self, update_id: int) -> None:
+        if not self.path or update_id == self._saved:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump({"last_update_id": update_id}, file)
+            os.replace(tmp_path, self.path)
+            self._saved = update_id
+        except OSError as e:
+            logger.error(f"Не удалось сохранить номер последнего обновления в {self.path}: {e}")
+
+
+class UpdatePoller:
+    """
+    Цикл getUpdates: сначала разбор накопившейся очереди, затем long polling до stop() или Ctrl+C.
+
+    handle получает пачку обновлений в виде словарей Bot API. После handle номер последнего
+    обновления пачки сохраняется в offset_store: при перезапуске уже переданные в обработку
+    обновления не запрашиваются снова.
+    """
+
+    def __init__(self, token: str, handle: Callable[[list[dict]], None], allowed_updates: list[str] | None = None,
+                 offset_store: OffsetStore | None = None, staleness: StalenessFilter | None = None,
+                 long_poll_timeout: int = 25):
+        self.token = token
+        self.handle = handle
+        self.allowed_updates = allowed_updates
+        self.offset_store = offset_store or OffsetStore("")
+        self.staleness = staleness or StalenessFilter(0, STALE_POLICY_KEEP)
+        self.long_poll_timeout = long_poll_timeout
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        # Текущий запрос long polling завершится не позже чем через long_poll_timeout секунд
+        self._stop_event.set()
+
+    def _fetch(self, offset: int | None) -> list[dict]:
+        # timeout — таймаут HTTP; apihelper сам увеличивает таймаут чтения до long_polling_timeout + 5
+        return apihelper.get_updates(self.token, offset=offset, limit=CATCHUP_BATCH_LIMIT,
+                                     timeout=self.long_poll_timeout, allowed_updates=self.allowed_updates,
+                                     long_polling_timeout=self.long_poll_timeout)
+
+    def _process(self, updates: list[dict]) -> int:
+        """
+        Передает пачку в handle и сохраняет номер последнего обновления. Возвращает число отброшенных.
+        """
+        last_update_id = updates[-1]["update_id"]
+        fresh, dropped = self.staleness.apply(updates)
+        if fresh:
+            self.handle(fresh)
+        self.offset_store.save(last_update_id)
+        return dropped
+
+    def run(self) -> None:
+        last_update_id = self.offset_store.load()
+        offset = last_update_id + 1 if last_update_id is not None else None
+        logger.info(f"Получение обновлений: offset={offset}, allowed_updates={self.allowed_updates}, "
+                    f"long polling {self.long_poll_timeout} с.")
+        catching_up = True
+        started = time.perf_counter()
+        received = dropped = 0
+        while not self._stop_event.is_set():
+            try:
+                updates = self._fetch(offset)
+            except KeyboardInterrupt:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка getUpdates: {e}")
+                if self._stop_event.wait(POLL_ERROR_DELAY):
+                    break
+                continue
+            try:
+                if updates:
+                    offset = updates[-1]["update_id"] + 1
+                    batch_dropped = self._process(updates)
+                    if catching_up:
+                        received += len(updates)
+                        dropped += batch_dropped
+            except KeyboardInterrupt:
+                break
+            if catching_up and len(updates) < CATCHUP_BATCH_LIMIT:
+                # Неполная пачка: накопившаяся очередь разобрана, дальше обычный long polling
+                catching_up = False
+                elapsed = time.perf_counter() - started
+                metrics.observe("bot_updates_catchup_seconds", elapsed)
+                logger.info(f"Очередь обновлений после запуска разобрана за {elapsed:.2f} с: получено {received}, "
+                            f"отброшено устаревших {dropped} (политика {self.staleness.policy}).")
+        logger.info("Получение обновлений остановлено.")
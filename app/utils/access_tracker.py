@@ -0,0 +1,175 @@
+# utils/access_tracker.py
+"""
+Учет неавторизованных попыток доступа с ограниченным объемом памяти и логов.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Сколько самых давно не активных записей рассматривать при вытеснении
+EVICTION_CANDIDATES = 16
+
+
+class UnauthorizedAccessTracker:
+    """
+    Ограниченный по размеру список нарушителей: не больше max_entries записей.
+
+    Записи упорядочены по времени последней попытки. При переполнении вытесняется
+    запись с наименьшим числом попыток среди самых давно не активных, поэтому волна
+    одноразовых аккаунтов не вытесняет настойчивых нарушителей.
+
+    record() сообщает, нужно ли писать предупреждение в лог: для одного нарушителя
+    не чаще одного раза в log_interval секунд, остальные попытки только считаются.
+    """
+
+    def __init__(self, max_entries: int = 1000, log_interval: float = 300, persist_path: str | None = None):
+        """
+        Args:
+            max_entries (int): Максимум отслеживаемых пользователей.
+            log_interval (float): Минимальный интервал между записями в лог об одном пользователе, секунды.
+            persist_path (str | None): JSON-файл для сохранения списка между перезапусками; None или "" — без сохранения.
+        """
+        self.max_entries = max(1, max_entries)
+        self.log_interval = max(0.0, log_interval)
+        self.persist_path = persist_path or None
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._persist_thread: threading.Thread | None = None
+        self._stop_event = threading.Event()
+        self.evicted_count = 0
+        self.suppressed_log_count = 0
+        if self.persist_path:
+            self._load()
+
+    def record(self, user_id, username, full_name, chat_id) -> tuple[bool, dict]:
+        """
+        Учитывает попытку доступа.
+
+        Returns:
+            tuple[bool, dict]: Нужно ли писать в лог и копия записи пользователя
+            (с полем 'suppressed' — сколько попыток не попало в лог с прошлого раза).
+        """
+        user_id_str = str(user_id)
+        now = time.time()
+        with self._lock:
+            info = self._entries.get(user_id_str)
+            if info is None:
+                if len(self._entries) >= self.max_entries:
+                    self._evict_locked()
+                info = {
+                    'username': username,
+                    'full_name': full_name,
+                    'attempts': 0,
+                    'chat_id': chat_id, # Сохраняем chat_id для информации
+                    'first_seen': now,
+                    'last_logged': None,
+                    'suppressed': 0,
+                }
+                self._entries[user_id_str] = info
+            else:
+                self._entries.move_to_end(user_id_str)
+            info['attempts'] += 1
+            info['last_seen'] = now
+            self._dirty = True
+
+            should_log = info['last_logged'] is None or now - info['last_logged'] >= self.log_interval
+            result = dict(info)
+            if should_log:
+                info['last_logged'] = now
+                info['suppressed'] = 0
+            else:
+                info['suppressed'] += 1
+                self.suppressed_log_count += 1
+        return should_log, result
+
+    def _evict_locked(self) -> None:
+        candidates = []
+        for user_id_str, info in self._entries.items():
+            candidates.append((info['attempts'], user_id_str))
+            if len(candidates) >= EVICTION_CANDIDATES:
+                break
+        _, victim = min(candidates)
+        del self._entries[victim]
+        self.evicted_count += 1
+
+    def snapshot(self) -> dict:
+        """
+        Копия записей, отсортированная по числу попыток (самые активные нарушители первыми).
+        """
+        with self._lock:
+            items = [(user_id_str, dict(info)) for user_id_str, info in self._entries.items()]
+        items.sort(key=lambda item: item[1]['attempts'], reverse=True)
+        return dict(items)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tracked": len(self._entries),
+                "evicted": self.evicted_count,
+                "suppressed_logs": self.suppressed_log_count,
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    # --- Сохранение на диск ---
+
+    def start_persistence(self, interval: float = 60) -> None:
+        """
+        Запускает фоновый поток, сохраняющий список раз в interval секунд (если были изменения).
+        """
+        if not self.persist_path or self._persist_thread is not None or interval <= 0:
+            return
+        self._stop_event.clear()
+        self._persist_thread = threading.Thread(target=self._persist_loop, args=(interval,),
+                                                name="unauthorized-persist", daemon=True)
+        self._persist_thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._persist_thread is not None:
+            self._persist_thread.join()
+            self._persist_thread = None
+        self.save()
+
+    def _persist_loop(self, interval: float) -> None:
+        while not self._stop_event.wait(interval):
+            self.save()
+
+    def save(self) -> None:
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = list(self._entries.items())
+            self._dirty = False
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Не удалось сохранить список неавторизованных попыток в {self.persist_path}: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def _load(self) -> None:
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            # Файл хранит записи в порядке активности, последние max_entries — самые свежие
+            for user_id_str, info in data[-self.max_entries:]:
+                self._entries[str(user_id_str)] = info
+            logger.info(f"Загружено записей о неавторизованных попытках: {len(self._entries)}.")
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Не удалось загрузить список неавторизованных попыток из {self.persist_path}: {e}")
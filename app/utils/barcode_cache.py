@@ -0,0 +1,344 @@
+# utils/barcode_cache.py
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MEMORY_BYTES = 32 * 1024 * 1024
+
+
+class ReadOnlyBytesIO(io.BytesIO):
+    """
+    BytesIO-представление закэшированного изображения, запрещающее запись.
+    Каждый вызов кэша отдает новый объект, поэтому позиция потока у каждого обработчика своя.
+    """
+
+    def writable(self) -> bool:
+        return False
+
+    def write(self, *args, **kwargs):
+        raise io.UnsupportedOperation("ReadOnlyBytesIO не поддерживает запись")
+
+    def writelines(self, *args, **kwargs):
+        raise io.UnsupportedOperation("ReadOnlyBytesIO не поддерживает запись")
+
+    def truncate(self, *args, **kwargs):
+        raise io.UnsupportedOperation("ReadOnlyBytesIO не поддерживает запись")
+
+
+def make_cache_key(normalized_code: str, writer_options: dict | None = None, engine: str = "") -> str:
+    """
+    Строит ключ кэша из нормализованного 13-значного кода, опций writer'а и движка отрисовки.
+    Опции сериализуются с сортировкой ключей, чтобы порядок в dict не влиял на ключ.
+    """
+    options_str = json.dumps(writer_options or {}, sort_keys=True, default=str)
+    key = f"{normalized_code}|{options_str}"
+    return f"{key}|{engine}" if engine else key
+
+
+class BarcodeCache:
+    """
+    Двухуровневый кэш отрисованных штрих-кодов.
+
+    1. В памяти: LRU с ограничением по суммарному размеру в байтах.
+    2. На диске (опционально): хранилище по хэшу содержимого (blobs/<sha256>.png)
+       и ссылки ключ -> хэш (refs/<sha1 ключа>), переживает перезапуск бота.
+       Суммарный размер blobs ограничен max_disk_bytes: сверх лимита удаляются давно
+       не использованные файлы (порядок по времени изменения, чтение его обновляет)
+       вместе со всеми ссылками на них.
+
+    Размер диска и ссылки учитываются по записям своего процесса и содержимому каталога на момент
+    configure(): при общем каталоге у нескольких процессов (SHARD_WORKERS) лимит приблизительный,
+    а ссылку на файл, удаленный другим процессом, удаляет первое обращение к ней.
+    """
+
+    def __init__(self, max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES, disk_dir: str | None = None,
+                 max_disk_bytes: int = 0):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_blobs: "OrderedDict[str, int]" = OrderedDict() # sha256 -> размер, давно не использованные первыми
+        self._disk_bytes = 0
+        self._blob_refs: dict[str, set[str]] = {} # sha256 -> имена ссылок refs/ на этот файл
+        self._ref_blobs: dict[str, str] = {} # Имя ссылки -> sha256
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = 0
+        self.disk_dir = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.configure(max_memory_bytes, disk_dir, max_disk_bytes)
+
+    def configure(self, max_memory_bytes: int, disk_dir: str | None = None, max_disk_bytes: int = 0) -> None:
+        """
+        Меняет лимиты памяти и диска (0 — диск без ограничения) и каталог дискового уровня.
+        Лишние записи сразу вытесняются.
+        """
+        with self._lock:
+            self.max_memory_bytes = max(0, int(max_memory_bytes))
+            self.max_disk_bytes = max(0, int(max_disk_bytes))
+            self.disk_dir = disk_dir or None
+            self._evict_locked()
+        if self.disk_dir:
+            try:
+                os.makedirs(os.path.join(self.disk_dir, "blobs"), exist_ok=True)
+                os.makedirs(os.path.join(self.disk_dir, "refs"), exist_ok=True)
+            except OSError as e:
+                logger.error(f"Не удалось создать каталог кэша штрих-кодов '{self.disk_dir}': {e}")
+                self.disk_dir = None
+        self._scan_disk()
+        self._evict_disk()
+
+    def get(self, key: str) -> ReadOnlyBytesIO | None:
+        """
+        Возвращает новое read-only представление закэшированного PNG или None при промахе.
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return ReadOnlyBytesIO(data)
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store_memory_locked(key, data)
+        return ReadOnlyBytesIO(data)
+
+    def put(self, key: str, data: bytes) -> ReadOnlyBytesIO:
+        """
+        Кладет PNG в оба уровня кэша и возвращает read-only представление для отправки.
+        """
+        data = bytes(data)
+        with self._lock:
+            self._store_memory_locked(key, data)
+        self._write_disk(key, data)
+        return ReadOnlyBytesIO(data)
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Счетчики попаданий/промахов/вытеснений и текущий размер памяти — для подбора лимитов.
+        """
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "disk_dir": self.disk_dir,
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+                "disk_evictions": self.disk_evictions,
+            }
+
+    # --- Внутренние методы ---
+
+    def _store_memory_locked(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_memory_bytes:
+            # Объект больше всего бюджета — держим его только на диске
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._entries[key] = data
+        self._memory_bytes += len(data)
+        self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        while self._entries and self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    @staticmethod
+    def _ref_name(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _ref_path(self, ref_name: str) -> str:
+        return os.path.join(self.disk_dir, "refs", ref_name)
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.disk_dir, "blobs", f"{digest}.png")
+
+    def _read_disk(self, key: str) -> bytes | None:
+        if not self.disk_dir:
+            return None
+        ref_name = self._ref_name(key)
+        ref_path = self._ref_path(ref_name)
+        try:
+            with open(ref_path, "r", encoding="utf-8") as f:
+                digest = f.read().strip()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Ошибка чтения дискового кэша для ключа '{key}': {e}")
+            return None
+        blob_path = self._blob_path(digest)
+        try:
+            with open(blob_path, "rb") as f:
+                data = f.read()
+            os.utime(blob_path) # Время изменения — время последнего использования для вытеснения
+        except FileNotFoundError:
+            # Файл удален другим процессом: ссылка больше не нужна
+            with self._lock:
+                self._drop_ref_locked(ref_name)
+            _remove_quietly(ref_path)
+            return None
+        except OSError as e:
+            logger.warning(f"Ошибка чтения дискового кэша для ключа '{key}': {e}")
+            return None
+        if hashlib.sha256(data).hexdigest() != digest:
+            logger.warning(f"Поврежденная запись дискового кэша для ключа '{key}' удалена.")
+            with self._lock:
+                ref_names = self._forget_blob_locked(digest) | {ref_name}
+                self._drop_ref_locked(ref_name)
+            self._remove_blob_files(digest, ref_names)
+            return None
+        with self._lock:
+            if digest in self._disk_blobs:
+                self._disk_blobs.move_to_end(digest)
+        return data
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        if not self.disk_dir:
+            return
+        digest = hashlib.sha256(data).hexdigest()
+        ref_name = self._ref_name(key)
+        try:
+            blob_path = self._blob_path(digest)
+            if not os.path.exists(blob_path):
+                _atomic_write(blob_path, data)
+            _atomic_write(self._ref_path(ref_name), digest.encode("ascii"))
+        except OSError as e:
+            logger.warning(f"Не удалось записать дисковый кэш для ключа '{key}': {e}")
+            return
+        with self._lock:
+            if digest in self._disk_blobs:
+                self._disk_blobs.move_to_end(digest)
+            else:
+                self._disk_blobs[digest] = len(data)
+                self._disk_bytes += len(data)
+            self._add_ref_locked(ref_name, digest)
+        self._evict_disk()
+
+    def _add_ref_locked(self, ref_name: str, digest: str) -> None:
+        if self._ref_blobs.get(ref_name) == digest:
+            return
+        self._drop_ref_locked(ref_name)
+        self._ref_blobs[ref_name] = digest
+        self._blob_refs.setdefault(digest, set()).add(ref_name)
+
+    def _drop_ref_locked(self, ref_name: str) -> None:
+        digest = self._ref_blobs.pop(ref_name, None)
+        refs = self._blob_refs.get(digest)
+        if refs is not None:
+            refs.discard(ref_name)
+            if not refs:
+                del self._blob_refs[digest]
+
+    def _forget_blob_locked(self, digest: str) -> set[str]:
+        """
+        Убирает файл из индекса и возвращает имена ссылок на него.
+        """
+        size = self._disk_blobs.pop(digest, None)
+        if size is not None:
+            self._disk_bytes -= size
+        ref_names = self._blob_refs.pop(digest, set())
+        for ref_name in ref_names:
+            self._ref_blobs.pop(ref_name, None)
+        return ref_names
+
+    def _remove_blob_files(self, digest: str, ref_names: set[str]) -> None:
+        # Сначала ссылки: ссылка без файла безвредна, но больше не нужна
+        for ref_name in ref_names:
+            _remove_quietly(self._ref_path(ref_name))
+        _remove_quietly(self._blob_path(digest)) # Файлы могли уже удалить другие процессы
+
+    def _scan_disk(self) -> None:
+        """
+        Строит индекс файлов blobs по времени изменения (самые старые первыми) и ссылок на них.
+        Ссылки на отсутствующие файлы удаляются.
+        """
+        blobs = []
+        ref_blobs = {}
+        orphans = []
+        if self.disk_dir:
+            try:
+                with os.scandir(os.path.join(self.disk_dir, "blobs")) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(".png") and entry.is_file():
+                            stat = entry.stat()
+                            blobs.append((stat.st_mtime, entry.name[:-len(".png")], stat.st_size))
+                digests = {digest for _, digest, _ in blobs}
+                with os.scandir(os.path.join(self.disk_dir, "refs")) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(".tmp") or not entry.is_file():
+                            continue
+                        try:
+                            with open(entry.path, "r", encoding="utf-8") as f:
+                                digest = f.read().strip()
+                        except FileNotFoundError:
+                            continue # Удалена другим процессом во время обхода
+                        if digest in digests:
+                            ref_blobs[entry.name] = digest
+                        else:
+                            orphans.append(entry.path)
+            except OSError as e:
+                logger.warning(f"Не удалось прочитать каталог кэша штрих-кодов '{self.disk_dir}': {e}")
+        for path in orphans:
+            _remove_quietly(path)
+        blobs.sort()
+        with self._lock:
+            self._disk_blobs = OrderedDict((digest, size) for _, digest, size in blobs)
+            self._disk_bytes = sum(size for _, _, size in blobs)
+            self._ref_blobs = {}
+            self._blob_refs = {}
+            for ref_name, digest in ref_blobs.items():
+                self._add_ref_locked(ref_name, digest)
+
+    def _evict_disk(self) -> None:
+        if not self.disk_dir or not self.max_disk_bytes:
+            return
+        evicted = []
+        with self._lock:
+            while self._disk_blobs and self._disk_bytes > self.max_disk_bytes:
+                digest = next(iter(self._disk_blobs))
+                evicted.append((digest, self._forget_blob_locked(digest)))
+                self.disk_evictions += 1
+        for digest, ref_names in evicted:
+            self._remove_blob_files(digest, ref_names)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не удалось удалить файл дискового кэша '{path}': {e}")
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
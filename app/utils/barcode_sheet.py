@@ -0,0 +1,197 @@
+# utils/barcode_sheet.py
+"""
+Листы штрих-кодов для печати: коды раскладываются по сетке на страницы заданного формата.
+
+Страницы отрисовываются по одной (каждая — отдельная задача для пула процессов) и сразу
+пишутся в результат, поэтому память не растет с длиной списка. PDF собирается собственным
+потоковым писателем: Pillow при save_all держит в памяти все страницы сразу.
+
+Страницы черно-белые (1 бит на пиксель): для печати штрих-кодов оттенки не нужны,
+а страница A4 при 300 DPI сжимается в несколько десятков килобайт вместо сотен.
+
+Pillow импортируется внутри функций: модуль нужен обработчикам (форматы и размеры страниц)
+уже при старте, а отрисовка — только при первом /sheet.
+"""
+import zlib
+from io import BytesIO
+from typing import TYPE_CHECKING, BinaryIO, NamedTuple
+
+from .barcode_utils import ENGINE_FAST, normalize_ean13, render_ean13_png
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Размеры страниц в миллиметрах
+PAGE_SIZES_MM = {
+    "A4": (210.0, 297.0),
+    "A5": (148.0, 210.0),
+    "LETTER": (215.9, 279.4),
+}
+SHEET_FORMATS = ("pdf", "png")
+MARGIN_MM = 8.0
+CELL_PADDING_MM = 3.0
+SAMPLE_CODE = "4006381333931" # Любой корректный код: размер плитки одинаков для всех кодов
+POINTS_PER_INCH = 72
+
+
+class SheetLayout(NamedTuple):
+    """
+    Геометрия страницы в пикселях.
+    """
+    page_width: int
+    page_height: int
+    columns: int
+    rows: int
+    margin: int
+    cell_width: int
+    cell_height: int
+    tile_width: int # Размер плитки на странице (после масштабирования, если она не помещается в ячейку)
+    tile_height: int
+    dpi: int
+
+    @property
+    def per_page(self) -> int:
+        return self.columns * self.rows
+
+    def page_count(self, code_count: int) -> int:
+        return -(-code_count // self.per_page)
+
+
+def _mm_to_px(mm: float, dpi: int) -> int:
+    return int(round(mm / 25.4 * dpi))
+
+
+def render_tile(code: str, engine: str) -> "Image.Image":
+    """
+    Штрих-код в режиме 'L'. Быстрый движок возвращает изображение без кодирования в PNG.
+    """
+    if engine == ENGINE_FAST:
+        from . import ean13_fast
+        return ean13_fast.render_ean13_image(code)
+    from PIL import Image
+    return Image.open(BytesIO(render_ean13_png(code, engine=engine))).convert("L")
+
+
+def build_sheet_layout(page_size: str, columns: int, dpi: int, engine: str) -> SheetLayout:
+    """
+    Делит страницу на columns колонок; количество строк — сколько плиток помещается по высоте.
+
+    Raises:
+        ValueError: Неизвестный формат страницы или неверное число колонок.
+    """
+    if page_size.upper() not in PAGE_SIZES_MM:
+        raise ValueError(f"Неизвестный формат страницы: {page_size}")
+    if columns < 1:
+        raise ValueError("Количество колонок должно быть положительным")
+    width_mm, height_mm = PAGE_SIZES_MM[page_size.upper()]
+    page_width, page_height = _mm_to_px(width_mm, dpi), _mm_to_px(height_mm, dpi)
+    margin = _mm_to_px(MARGIN_MM, dpi)
+    padding = _mm_to_px(CELL_PADDING_MM, dpi)
+
+    cell_width = (page_width - 2 * margin) // columns
+    tile_width, tile_height = render_tile(SAMPLE_CODE, engine).size
+    if tile_width > cell_width - padding:
+        # Плитка шире ячейки — уменьшаем с сохранением пропорций
+        scale = (cell_width - padding) / tile_width
+        tile_width, tile_height = max(1, int(tile_width * scale)), max(1, int(tile_height * scale))
+    cell_height = tile_height + padding
+    rows = max(1, (page_height - 2 * margin) // cell_height)
+    return SheetLayout(page_width, page_height, columns, rows, margin, cell_width, cell_height,
+                       tile_width, tile_height, dpi)
+
+
+def compose_page(codes: list[str], layout: SheetLayout, engine: str) -> "Image.Image":
+    """
+    Раскладывает до layout.per_page кодов на одну страницу. Каждый код отрисовывается один раз.
+    """
+    from PIL import Image
+    page = Image.new("L", (layout.page_width, layout.page_height), 255)
+    for index, code in enumerate(codes[:layout.per_page]):
+        normalized_code = normalize_ean13(code)
+        if normalized_code is None:
+            continue
+        tile = render_tile(normalized_code, engine)
+        if tile.size != (layout.tile_width, layout.tile_height):
+            tile = tile.resize((layout.tile_width, layout.tile_height), Image.Resampling.LANCZOS)
+        row, column = divmod(index, layout.columns)
+        x = layout.margin + column * layout.cell_width + (layout.cell_width - layout.tile_width) // 2
+        y = layout.margin + row * layout.cell_height + (layout.cell_height - layout.tile_height) // 2
+        page.paste(tile, (x, y))
+    return page
+
+
+def render_sheet_page(codes: list[str], layout: SheetLayout, sheet_format: str, engine: str) -> bytes:
+    """
+    Отрисовывает страницу и возвращает PNG ("png") или сжатые zlib пиксели для PdfStreamWriter ("pdf").
+
+    Функция верхнего уровня, чтобы ее можно было выполнять в пуле процессов.
+    """
+    from PIL import Image
+    page = compose_page(codes, layout, engine).convert("1", dither=Image.Dither.NONE)
+    if sheet_format == "pdf":
+        return zlib.compress(page.tobytes(), 6)
+    output = BytesIO()
+    page.save(output, format="PNG", optimize=False, dpi=(layout.dpi, layout.dpi))
+    return output.getvalue()
+
+
+class PdfStreamWriter:
+    """
+    Минимальный писатель PDF: каждая страница — одно изображение DeviceGray (FlateDecode)
+    на всю страницу. Страницы пишутся в файл сразу, в памяти остаются только смещения объектов.
+    """
+
+    def __init__(self, file: BinaryIO):
+        self._file = file
+        self._offsets: dict[int, int] = {}
+        self._page_ids: list[int] = []
+        self._next_id = 3 # 1 — каталог, 2 — дерево страниц; пишутся в close()
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data: bytes) -> None:
+        self._file.write(data)
+
+    def _write_object(self, object_id: int, body: bytes, stream: bytes | None = None) -> None:
+        self._offsets[object_id] = self._file.tell()
+        self._write(f"{object_id} 0 obj\n".encode("ascii") + body)
+        if stream is not None:
+            self._write(b"\nstream\n" + stream + b"\nendstream")
+        self._write(b"\nendobj\n")
+
+    def _allocate_id(self) -> int:
+        object_id = self._next_id
+        self._next_id += 1
+        return object_id
+
+    def add_page(self, width_px: int, height_px: int, compressed_pixels: bytes, dpi: int, bits_per_component: int = 1) -> None:
+        """
+        Args:
+            compressed_pixels (bytes): Строки пикселей сверху вниз, сжатые zlib; 1 бит — как Image.tobytes() в режиме '1'.
+        """
+        image_id, content_id, page_id = self._allocate_id(), self._allocate_id(), self._allocate_id()
+        width_pt = width_px / dpi * POINTS_PER_INCH
+        height_pt = height_px / dpi * POINTS_PER_INCH
+
+        self._write_object(image_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {width_px} /Height {height_px} "
+            f"/ColorSpace /DeviceGray /BitsPerComponent {bits_per_component} /Filter /FlateDecode /Length {len(compressed_pixels)} >>"
+        ).encode("ascii"), compressed_pixels)
+        content = f"q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm /Im0 Do Q".encode("ascii")
+        self._write_object(content_id, f"<< /Length {len(content)} >>".encode("ascii"), content)
+        self._write_object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width_pt:.2f} {height_pt:.2f}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode("ascii"))
+        self._page_ids.append(page_id)
+
+    def close(self) -> None:
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode("ascii"))
+        self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_offset = self._file.tell()
+        object_count = self._next_id
+        lines = [f"xref\n0 {object_count}\n", "0000000000 65535 f \n"]
+        lines.extend(f"{self._offsets[object_id]:010d} 00000 n \n" for object_id in range(1, object_count))
+        lines.append(f"trailer\n<< /Size {object_count} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        self._write("".join(lines).encode("ascii"))
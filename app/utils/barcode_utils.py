@@ -1,14 +1,97 @@
 # utils/barcode_utils.py
 import random
 import os
-from barcode import EAN13
-from barcode.writer import ImageWriter
-from PIL import Image # Опционально для локального отображения
+import re
+import time
+from typing import NamedTuple
 from io import BytesIO
 import logging
+from .barcode_cache import BarcodeCache, make_cache_key
+from .metrics import metrics
+
+# python-barcode, Pillow и NumPy импортируются при первой отрисовке или первом большом списке
+# (либо при прогреве после старта бота), а не при импорте модуля
 
 logger = logging.getLogger(__name__)
 
+_numpy = None
+_numpy_checked = False
+
+def load_numpy():
+    """
+    Модуль numpy или None, если он не установлен (необязательная зависимость: ускоряет проверку больших списков кодов).
+    """
+    global _numpy, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = None
+        _numpy_checked = True
+    return _numpy
+
+def _fast_engine():
+    from . import ean13_fast # Тянет Pillow и шрифт python-barcode
+    return ean13_fast
+
+# Движки отрисовки: python-barcode ImageWriter и собственный быстрый растеризатор EAN-13
+ENGINE_IMAGEWRITER = "imagewriter"
+ENGINE_FAST = "fast"
+BARCODE_ENGINES = (ENGINE_IMAGEWRITER, ENGINE_FAST)
+
+_barcode_engine = ENGINE_IMAGEWRITER
+
+# Общий кэш отрисованных штрих-кодов; параметры задаются из конфигурации через configure_barcode_cache
+barcode_cache = BarcodeCache()
+
+def configure_barcode_cache(max_memory_bytes: int, disk_dir: str | None = None, max_disk_bytes: int = 0) -> None:
+    """
+    Применяет настройки кэша штрих-кодов (лимиты памяти и диска в байтах и каталог дискового уровня).
+    """
+    barcode_cache.configure(max_memory_bytes, disk_dir, max_disk_bytes)
+
+def configure_barcode_engine(engine: str) -> None:
+    """
+    Выбирает движок отрисовки по умолчанию ("imagewriter" или "fast").
+    """
+    global _barcode_engine
+    engine = (engine or ENGINE_IMAGEWRITER).lower()
+    if engine not in BARCODE_ENGINES:
+        logger.warning(f"Неизвестный движок отрисовки штрих-кодов '{engine}'. Используется {ENGINE_IMAGEWRITER}.")
+        engine = ENGINE_IMAGEWRITER
+    _barcode_engine = engine
+
+def resolve_barcode_engine(writer_options: dict | None = None, engine: str | None = None) -> str:
+    """
+    Возвращает движок, который реально будет использован: быстрый движок поддерживает
+    только геометрические опции, для остальных используется ImageWriter.
+    """
+    engine = engine or _barcode_engine
+    if engine == ENGINE_FAST and writer_options and not _fast_engine().supports_options(writer_options):
+        return ENGINE_IMAGEWRITER
+    return engine
+
+def ean13_checksum(digits12: str) -> int:
+    """
+    Вычисляет контрольную цифру EAN-13 для первых 12 цифр.
+    """
+    total = 0
+    for i, ch in enumerate(digits12[:12]):
+        total += int(ch) * (3 if i % 2 else 1)
+    return (10 - total % 10) % 10
+
+def normalize_ean13(code_string: str) -> str | None:
+    """
+    Приводит код (12 или 13 цифр) к 13-значному виду так же, как это делает python-barcode:
+    берутся первые 12 цифр и к ним дописывается вычисленная контрольная цифра.
+    Возвращает None для строк неверного формата.
+    """
+    if not (isinstance(code_string, str) and code_string.isdigit() and (len(code_string) == 12 or len(code_string) == 13)):
+        return None
+    digits12 = code_string[:12]
+    return f"{digits12}{ean13_checksum(digits12)}"
+
 def read_eans_from_file(filepath='codes.txt'):
     """
     Считывает EAN-коды из текстового файла.
@@ -31,50 +114,162 @@ def read_eans_from_file(filepath='codes.txt'):
         logger.error(f"Ошибка при чтении файла '{filepath}': {e}", exc_info=True)
         return []
 
-def generate_ean13_barcode_image_bytes(code_string: str) -> BytesIO | None:
+def _render_key(normalized_code: str, writer_options: dict | None, engine: str) -> str:
+    # Ключ для ImageWriter совпадает с прежним форматом, чтобы не терять уже накопленный кэш и file_id
+    return make_cache_key(normalized_code, writer_options, "" if engine == ENGINE_IMAGEWRITER else engine)
+
+def barcode_render_key(code_string: str, writer_options: dict | None = None) -> str | None:
+    """
+    Возвращает ключ отрисовки (нормализованный код + опции writer'а + движок) или None для неверного кода.
+    Один и тот же ключ используется кэшем изображений и индексом file_id Telegram.
+    """
+    normalized_code = normalize_ean13(code_string)
+    if normalized_code is None:
+        return None
+    return _render_key(normalized_code, writer_options, resolve_barcode_engine(writer_options))
+
+def render_ean13_png(normalized_code: str, writer_options: dict | None = None, engine: str | None = None) -> bytes:
+    """
+    Отрисовывает штрих-код EAN-13 выбранным движком и возвращает PNG-байты (без кэша).
+    """
+    if resolve_barcode_engine(writer_options, engine) == ENGINE_FAST:
+        return _fast_engine().render_ean13_png_fast(normalized_code, writer_options)
+    from barcode import EAN13
+    from barcode.writer import ImageWriter
+    image_bytes_io = BytesIO()
+    # EAN13 требует строку. Библиотека сама рассчитает контрольную сумму для 12 цифр.
+    my_ean = EAN13(str(normalized_code), writer=ImageWriter())
+    my_ean.write(image_bytes_io, options=writer_options) # Записывает PNG данные в BytesIO поток
+    return image_bytes_io.getvalue()
+
+def generate_ean13_barcode_image_bytes(code_string: str, writer_options: dict | None = None) -> BytesIO | None:
     """
     Генерирует изображение штрих-кода EAN-13 для одной строки кода и возвращает его как BytesIO.
+    Готовые изображения берутся из кэша barcode_cache (ключ — нормализованный код и опции writer'а).
 
     Args:
         code_string (str): Код EAN-13 (12 или 13 цифр).
+        writer_options (dict | None): Опции ImageWriter (module_height, font_size и т.п.).
 
     Returns:
-        BytesIO: Объект BytesIO с данными изображения PNG или None в случае ошибки.
+        BytesIO: Новый read-only объект BytesIO с данными изображения PNG или None в случае ошибки.
     """
-    if not (isinstance(code_string, str) and code_string.isdigit() and (len(code_string) == 12 or len(code_string) == 13)):
+    normalized_code = normalize_ean13(code_string)
+    if normalized_code is None:
         logger.warning(f"Неверный формат кода EAN для генерации: {code_string}")
         return None
 
+    engine = resolve_barcode_engine(writer_options)
+    cache_key = _render_key(normalized_code, writer_options, engine)
+    cached = barcode_cache.get(cache_key)
+    if cached is not None:
+        metrics.inc("bot_render_cache_total", result="hit")
+        return cached
+
+    metrics.inc("bot_render_cache_total", result="miss")
     try:
-        image_bytes_io = BytesIO()
-        # EAN13 требует строку. Библиотека сама рассчитает контрольную сумму для 12 цифр.
-        my_ean = EAN13(str(code_string), writer=ImageWriter())
-        my_ean.write(image_bytes_io) # Записывает PNG данные в BytesIO поток
-        image_bytes_io.seek(0)       # Сбрасывает позицию потока в начало
-        return image_bytes_io
+        started = time.perf_counter()
+        png_bytes = render_ean13_png(normalized_code, writer_options, engine)
+        metrics.observe("bot_render_seconds", time.perf_counter() - started, engine=engine, where="inline")
+        return barcode_cache.put(cache_key, png_bytes)
     except Exception as e:
         logger.error(f"Ошибка генерации штрих-кода для '{code_string}': {e}", exc_info=True)
         return None
 
+# Коды разделяются пробельными символами, запятыми и точками с запятой
+_CODE_SEPARATORS = bytes.maketrans(b",;", b"  ")
+# Сумма кодов символа '0' в контрольной сумме: 6 цифр с весом 1 и 6 цифр с весом 3
+_ASCII_ZERO_WEIGHT = ord("0") * (6 + 3 * 6)
+# С какого количества токенов проверять их через NumPy
+NUMPY_MIN_TOKENS = 2000
+
+class ParsedCodes(NamedTuple):
+    """
+    Результат разбора списка кодов.
+    """
+    codes: list[str] # Уникальные коды в 13-значном виде, в порядке ввода
+    fixed: list[tuple[str, str]] # 12-значные коды, дополненные контрольной цифрой: (введенный, итоговый)
+    bad_checksum: list[str] # 13-значные коды с неверной контрольной цифрой
+    rejected: list[str] # Токены неверного формата (не 12 или 13 цифр)
+    duplicates: int # Сколько повторов отброшено
+
+def validate_ean13(code_string: str) -> str | None:
+    """
+    Возвращает код в 13-значном виде: 12 цифр дополняются контрольной цифрой, у 13 цифр
+    контрольная цифра проверяется. None для неверного формата или контрольной цифры.
+    """
+    if not (isinstance(code_string, str) and code_string.isascii()):
+        return None
+    token = code_string.encode("ascii")
+    check_digit = _check_digits([token])[0]
+    if check_digit < 0:
+        return None
+    if len(token) == 12:
+        return f"{code_string}{check_digit}"
+    return code_string if token[12] - 48 == check_digit else None
+
+def _check_digits(tokens: list[bytes]) -> list[int]:
+    # Для каждого токена контрольная цифра по первым 12 цифрам или -1, если это не 12-13 цифр
+    return [(_ASCII_ZERO_WEIGHT - sum(token[0:12:2]) - 3 * sum(token[1:12:2])) % 10
+            if 12 <= len(token) <= 13 and token.isdigit() else -1
+            for token in tokens]
+
+def _check_digits_numpy(tokens: list[bytes]) -> list[int]:
+    # То же, что _check_digits, но одной векторной операцией над матрицей цифр
+    np = load_numpy()
+    lengths = np.fromiter(map(len, tokens), dtype=np.int32, count=len(tokens))
+    # Строки фиксированной ширины: длинные токены обрезаются (их отсекает lengths), короткие дополняются нулями
+    digits = np.array(tokens, dtype="S13").view(np.uint8).reshape(len(tokens), 13).astype(np.int32) - 48
+    is_digit = (digits >= 0) & (digits <= 9)
+    valid = ((lengths == 12) | (lengths == 13)) & is_digit[:, :12].all(axis=1) & (is_digit[:, 12] | (lengths == 12))
+    totals = digits[:, 0:12:2].sum(axis=1) + 3 * digits[:, 1:12:2].sum(axis=1)
+    return np.where(valid, -totals % 10, -1).tolist()
+
+def parse_codes(text_input: str, use_numpy: bool | None = None) -> ParsedCodes:
+    """
+    Разбирает список кодов, введенный пользователем.
+
+    Текст разбивается на токены за один проход translate + split, без промежуточных
+    replace. 12-значные коды дополняются контрольной цифрой, у 13-значных она
+    проверяется, повторы отбрасываются с сохранением порядка.
+
+    Args:
+        text_input (str): Коды, разделенные пробелами, запятыми, точками с запятой или новыми строками.
+        use_numpy (bool | None): Считать контрольные суммы через NumPy; None — автоматически
+            для больших списков, если NumPy установлен.
+    """
+    if not text_input.isascii():
+        # Неразрывные и прочие Unicode-пробелы (частые при копировании из таблиц) — тоже разделители
+        text_input = " ".join(text_input.split())
+    # В байтах isdigit() принимает только ASCII-цифры, а срезы сразу дают коды символов
+    tokens = text_input.encode("utf-8").translate(_CODE_SEPARATORS).split()
+    if use_numpy is None:
+        use_numpy = len(tokens) >= NUMPY_MIN_TOKENS and load_numpy() is not None
+    check_digits = _check_digits_numpy(tokens) if use_numpy and tokens else _check_digits(tokens)
+
+    valid, fixed, bad_checksum, rejected = [], [], [], []
+    for token, check_digit in zip(tokens, check_digits):
+        if check_digit < 0:
+            rejected.append(token.decode("utf-8", "replace"))
+        elif len(token) == 12:
+            typed = token.decode("ascii")
+            code = f"{typed}{check_digit}"
+            fixed.append((typed, code))
+            valid.append(code)
+        elif token[12] - 48 == check_digit:
+            valid.append(token.decode("ascii"))
+        else:
+            bad_checksum.append(token.decode("ascii"))
+
+    codes = list(dict.fromkeys(valid))
+    return ParsedCodes(codes, fixed, bad_checksum, rejected, len(valid) - len(codes))
+
 def parse_codes_input(text_input: str) -> list[str]:
     """
     Парсит строку с кодами, введенную пользователем.
-    Коды могут быть разделены запятыми, пробелами или новыми строками.
-    Возвращает список валидных кодов (12 или 13 цифр).
-    """
-    # Заменяем запятые и переносы строк на пробелы для упрощения разделения
-    normalized_text = text_input.replace(',', ' ').replace('\n', ' ')
-    
-    potential_codes = [code.strip() for code in normalized_text.split(' ') if code.strip()]
-    
-    valid_codes = []
-    for code in potential_codes:
-        if code.isdigit() and (len(code) == 12 or len(code) == 13):
-            valid_codes.append(code)
-        else:
-            logger.debug(f"Отфильтрован невалидный код: '{code}'")
-            
-    return valid_codes
+    Возвращает уникальные корректные коды EAN-13 (12-значные дополняются контрольной цифрой).
+    """
+    return parse_codes(text_input).codes
 
 # # Пример использования (если запускать как скрипт)
 # if __name__ == "__main__":
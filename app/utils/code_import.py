@@ -0,0 +1,137 @@
+# utils/code_import.py
+"""
+Потоковый импорт списка кодов из файла (.txt, .csv), загруженного в Telegram.
+
+Файл скачивается частями и разбирается по мере поступления: в памяти находятся только
+текущий блок текста и уже принятые коды, а не весь файл.
+"""
+import codecs
+import logging
+import time
+from typing import Callable, Iterable, Iterator
+
+import requests
+from telebot import apihelper
+
+from .barcode_utils import parse_codes
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+DOWNLOAD_TIMEOUT = 30 # Таймаут соединения и чтения очередного блока, секунды
+MAX_TOKEN_TAIL = 1024 # Хвост блока без разделителей длиннее этого точно не код, разбираем как есть
+REPORT_SAMPLE = 10 # Сколько отклоненных токенов сохранять для отчета
+TELEGRAM_FILE_URL = "https://api.telegram.org/file/bot{0}/{1}"
+IMPORT_EXTENSIONS = (".txt", ".csv")
+
+
+class ImportLimitError(Exception):
+    """
+    Файл больше допустимого размера.
+    """
+
+
+def is_importable_document(file_name: str | None, mime_type: str | None) -> bool:
+    if file_name and file_name.lower().endswith(IMPORT_EXTENSIONS):
+        return True
+    return bool(mime_type) and mime_type.startswith("text/")
+
+
+def telegram_file_url(token: str, file_path: str, file_url_template: str | None = None) -> str:
+    # Так же, как telebot.apihelper.download_file, но без чтения ответа целиком
+    return (file_url_template or apihelper.FILE_URL or TELEGRAM_FILE_URL).format(token, file_path)
+
+
+def iter_download(url: str, chunk_size: int = DOWNLOAD_CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    Скачивает файл по частям.
+    """
+    with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT, proxies=apihelper.proxy) as response:
+        response.raise_for_status()
+        yield from response.iter_content(chunk_size=chunk_size)
+
+
+class CodeImporter:
+    """
+    Накапливает коды из последовательных блоков текста.
+
+    Повторы отбрасываются по всему файлу и по уже имеющемуся списку (при добавлении),
+    общий размер списка ограничен max_codes. Отклоненные токены только считаются,
+    для отчета сохраняются первые REPORT_SAMPLE.
+    """
+
+    def __init__(self, max_codes: int = 0, existing: Iterable[str] = ()):
+        """
+        Args:
+            max_codes (int): Максимум кодов в итоговом списке вместе с existing; 0 — без ограничения.
+            existing (Iterable[str]): Текущий список пользователя, если новые коды добавляются к нему.
+        """
+        self.max_codes = max(0, max_codes)
+        self._codes = dict.fromkeys(existing)
+        self.existing_count = len(self._codes)
+        self.bytes_read = 0
+        self.fixed_count = 0
+        self.duplicates = 0
+        self.truncated = 0 # Корректные коды, не вошедшие в список из-за max_codes
+        self.bad_checksum_count = 0
+        self.rejected_count = 0
+        self.bad_checksum_sample: list[str] = []
+        self.rejected_sample: list[str] = []
+
+    @property
+    def codes(self) -> list[str]:
+        return list(self._codes)
+
+    @property
+    def added_count(self) -> int:
+        return len(self._codes) - self.existing_count
+
+    def feed_text(self, text: str) -> None:
+        report = parse_codes(text)
+        self.fixed_count += len(report.fixed)
+        self.duplicates += report.duplicates
+        self.bad_checksum_count += len(report.bad_checksum)
+        self.rejected_count += len(report.rejected)
+        self.bad_checksum_sample.extend(report.bad_checksum[:REPORT_SAMPLE - len(self.bad_checksum_sample)])
+        self.rejected_sample.extend(report.rejected[:REPORT_SAMPLE - len(self.rejected_sample)])
+
+        codes = self._codes
+        for code in report.codes:
+            if code in codes:
+                self.duplicates += 1
+            elif self.max_codes and len(codes) >= self.max_codes:
+                self.truncated += 1
+            else:
+                codes[code] = None
+
+    def feed_stream(self, chunks: Iterable[bytes], max_bytes: int = 0,
+                    on_progress: Callable[["CodeImporter"], None] | None = None,
+                    progress_interval: float = 2.0) -> None:
+        """
+        Разбирает поток байтов (UTF-8, BOM допускается) блоками, не разрывая коды между блоками.
+
+        Raises:
+            ImportLimitError: Поток длиннее max_bytes.
+        """
+        decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        tail = ""
+        last_progress = time.monotonic()
+        for chunk in chunks:
+            self.bytes_read += len(chunk)
+            if max_bytes and self.bytes_read > max_bytes:
+                raise ImportLimitError(f"Файл больше {max_bytes} байт.")
+            text = tail + decoder.decode(chunk)
+            # Блок разбираем до последнего разделителя, остаток переносим в следующий
+            cut = max(text.rfind("\n"), text.rfind(" "), text.rfind(","), text.rfind(";"))
+            if cut < 0 and len(text) <= MAX_TOKEN_TAIL:
+                tail = text
+                continue
+            self.feed_text(text[:cut + 1] if cut >= 0 else text)
+            tail = text[cut + 1:] if cut >= 0 else ""
+
+            if on_progress is not None and time.monotonic() - last_progress >= progress_interval:
+                last_progress = time.monotonic()
+                on_progress(self)
+        tail += decoder.decode(b"", final=True)
+        if tail:
+            self.feed_text(tail)
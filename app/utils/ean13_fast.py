@@ -0,0 +1,192 @@
+# utils/ean13_fast.py
+"""
+Быстрый растеризатор EAN-13, повторяющий геометрию python-barcode ImageWriter.
+
+Раскладка EAN-13 фиксирована (95 модулей, постоянные охранные полосы, таблица четности
+по первой цифре), поэтому вместо отрисовки каждой полосы через ImageDraw строится одна
+строка модулей в виде байтового массива, которая растягивается по вертикали, а цифры
+собираются из заранее отрисованных плиток глифов.
+"""
+import logging
+import os
+import threading
+from io import BytesIO
+
+from barcode.charsets import ean as _ean
+from barcode.writer import mm2px, pt2mm
+import barcode.writer
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию, которые использует EAN13 из python-barcode вместе с ImageWriter
+DEFAULT_LAYOUT_OPTIONS = {
+    "module_width": 0.33,
+    "module_height": 15.0,
+    "quiet_zone": 6.5,
+    "font_size": 10,
+    "text_distance": 5.0,
+}
+SUPPORTED_OPTIONS = frozenset(DEFAULT_LAYOUT_OPTIONS)
+
+FONT_PATH = os.path.join(barcode.writer.PATH, "fonts", "DejaVuSansMono.ttf")
+DPI = 300
+MARGIN_TOP = 1
+MARGIN_BOTTOM = 1
+TEXT_LENGTH = 13
+MODULES = 95
+
+
+def supports_options(writer_options: dict | None) -> bool:
+    """
+    Проверяет, что быстрый движок умеет воспроизвести заданные опции writer'а.
+    """
+    return not writer_options or set(writer_options) <= SUPPORTED_OPTIONS
+
+
+def build_modules(normalized_code: str) -> str:
+    """
+    Строит строку из 95 модулей ('1' — полоса, '0' — пробел) для 13-значного кода.
+    """
+    pattern = _ean.LEFT_PATTERN[int(normalized_code[0])]
+    parts = [_ean.EDGE]
+    for i, digit in enumerate(normalized_code[1:7]):
+        parts.append(_ean.CODES[pattern[i]][int(digit)])
+    parts.append(_ean.MIDDLE)
+    for digit in normalized_code[7:]:
+        parts.append(_ean.CODES["C"][int(digit)])
+    parts.append(_ean.EDGE)
+    return "".join(parts)
+
+
+class _Layout:
+    """
+    Геометрия изображения и плитки глифов для одного набора опций.
+    Вычисляется один раз и переиспользуется для всех кодов.
+    """
+
+    def __init__(self, options: dict):
+        self.module_width = options["module_width"]
+        self.module_height = options["module_height"]
+        self.quiet_zone = options["quiet_zone"]
+        self.font_size = options["font_size"]
+        self.text_distance = options["text_distance"]
+
+        # Та же формула размеров, что и в BaseWriter.calculate_size для одной строки текста
+        width_mm = 2 * self.quiet_zone + MODULES * self.module_width
+        height_mm = MARGIN_BOTTOM + MARGIN_TOP + self.module_height
+        if self.font_size:
+            height_mm += pt2mm(self.font_size) / 2 + self.text_distance
+        self.size = (int(mm2px(width_mm, DPI)), int(mm2px(height_mm, DPI)))
+
+        # Вертикальные границы полос (ImageDraw.rectangle отбрасывает дробную часть координат)
+        self.bar_top = int(mm2px(MARGIN_TOP, DPI))
+        self.bar_bottom = int(mm2px(MARGIN_TOP + self.module_height, DPI))
+
+        self.glyph_tiles = self._render_glyph_tiles() if self.font_size else None
+
+    def bar_spans(self, modules: str) -> list[tuple[int, int, bool]]:
+        """
+        Повторяет проход ImageWriter по сериям модулей с тем же накоплением xpos,
+        чтобы пиксельные границы полос совпадали точно.
+        """
+        spans = []
+        xpos = self.quiet_zone
+        run_start = 0
+        for i in range(1, len(modules) + 1):
+            if i < len(modules) and modules[i] == modules[run_start]:
+                continue
+            width = self.module_width * (i - run_start)
+            x0 = int(mm2px(xpos, DPI))
+            x1 = int(mm2px(xpos + width, DPI) - 1)
+            spans.append((x0, x1, modules[run_start] == "1"))
+            xpos += width
+            run_start = i
+        return spans
+
+    def _render_glyph_tiles(self) -> list[list[tuple[tuple[int, int], Image.Image]]]:
+        """
+        Для каждой из 13 позиций и каждой цифры рисует глиф ровно в том месте, где его
+        нарисовал бы ImageWriter, и сохраняет обрезанную плитку вместе с координатами.
+        """
+        font = ImageFont.truetype(FONT_PATH, int(mm2px(pt2mm(self.font_size), DPI)))
+        bxs = self.quiet_zone
+        bxe = self.quiet_zone + MODULES * self.module_width
+        xpos = bxs + (bxe - bxs) / 2.0
+        ypos = MARGIN_TOP + self.module_height + self.text_distance
+        anchor_xy = (mm2px(xpos, DPI), mm2px(ypos, DPI))
+
+        tiles = []
+        for position in range(TEXT_LENGTH):
+            position_tiles = []
+            for digit in "0123456789":
+                # Пробелы не рисуются, но сохраняют моноширинную раскладку и выравнивание "md"
+                text = " " * position + digit + " " * (TEXT_LENGTH - position - 1)
+                canvas = Image.new("L", self.size, 255)
+                ImageDraw.Draw(canvas).text(anchor_xy, text, font=font, fill=0, anchor="md")
+                bbox = ImageChops.invert(canvas).getbbox()
+                if bbox is None:
+                    position_tiles.append(None)
+                    continue
+                position_tiles.append(((bbox[0], bbox[1]), canvas.crop(bbox)))
+            tiles.append(position_tiles)
+        return tiles
+
+    def render(self, normalized_code: str) -> Image.Image:
+        width, height = self.size
+        row = bytearray(b"\xff" * width)
+        for x0, x1, is_bar in self.bar_spans(build_modules(normalized_code)):
+            row[x0:x1 + 1] = (b"\x00" if is_bar else b"\xff") * (x1 + 1 - x0)
+
+        image = Image.new("L", self.size, 255)
+        bar_height = self.bar_bottom - self.bar_top + 1
+        bars = Image.frombytes("L", (width, 1), bytes(row)).resize((width, bar_height), Image.Resampling.NEAREST)
+        image.paste(bars, (0, self.bar_top))
+
+        if self.glyph_tiles:
+            for position, digit in enumerate(normalized_code):
+                tile = self.glyph_tiles[position][int(digit)]
+                if tile is None:
+                    continue
+                (left, top), glyph = tile
+                box = (left, top, left + glyph.width, top + glyph.height)
+                # Соседние глифы могут делить столбец сглаженных пикселей — берем минимум, как при заливке по маске
+                image.paste(ImageChops.darker(image.crop(box), glyph), box)
+        return image
+
+
+_layouts: dict[tuple, _Layout] = {}
+_layouts_lock = threading.Lock()
+
+
+def _get_layout(writer_options: dict | None) -> _Layout:
+    options = dict(DEFAULT_LAYOUT_OPTIONS)
+    options.update(writer_options or {})
+    layout_key = tuple(sorted(options.items()))
+    layout = _layouts.get(layout_key)
+    if layout is None:
+        with _layouts_lock:
+            layout = _layouts.get(layout_key)
+            if layout is None:
+                layout = _Layout(options)
+                _layouts[layout_key] = layout
+    return layout
+
+
+def render_ean13_image(normalized_code: str, writer_options: dict | None = None) -> Image.Image:
+    """
+    Возвращает изображение штрих-кода в режиме 'L' для 13-значного кода.
+    """
+    return _get_layout(writer_options).render(normalized_code)
+
+
+def render_ean13_png_fast(normalized_code: str, writer_options: dict | None = None) -> bytes:
+    """
+    Отрисовывает штрих-код быстрым движком и кодирует его в PNG в градациях серого.
+
+    Полосы чисто черно-белые, а цифры сглажены так же, как у ImageWriter, поэтому
+    используется 8-битный режим 'L', а не 1-битный: пиксели совпадают с RGB-выводом ImageWriter.
+    """
+    output = BytesIO()
+    render_ean13_image(normalized_code, writer_options).save(output, format="PNG")
+    return output.getvalue()
@@ -0,0 +1,346 @@
+# utils/metrics.py
+"""
+Метрики бота: гистограммы задержек и счетчики с выдачей в текстовом формате Prometheus.
+
+Гистограммы с фиксированными границами корзин: наблюдение — двоичный поиск корзины и
+увеличение счетчика под блокировкой этой гистограммы, без хранения отдельных значений,
+поэтому метрики можно держать включенными постоянно. Перцентили для /stats оцениваются
+по корзинам (линейная интерполяция внутри корзины).
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import apihelper
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин в секундах: от 1 мс до минуты
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_PATH = "/metrics"
+# getUpdates — длинный опрос, его время отражает ожидание обновлений, а не задержку API
+UNTIMED_API_METHODS = frozenset({"getUpdates"})
+
+
+class Histogram:
+    """
+    Гистограмма с кумулятивной выдачей (как histogram в Prometheus).
+    """
+    __slots__ = ("buckets", "counts", "total", "count", "_lock")
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Последняя корзина — +Inf
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self) -> tuple[list[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Оценка q-квантиля по корзинам. Для значений выше последней границы возвращает эту границу.
+        """
+        counts, _, count = self.snapshot()
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key: tuple, extra: tuple = ()) -> str:
+    pairs = label_key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Набор именованных гистограмм и счетчиков с метками.
+
+    Выключенный реестр (enabled = False) игнорирует наблюдения: проверка одного атрибута.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._histograms: dict[str, dict[tuple, Histogram]] = {}
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._help: dict[str, str] = {}
+        self._collectors = []
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        key = _label_key(labels)
+        series = self._histograms.get(name)
+        histogram = series.get(key) if series is not None else None
+        if histogram is None:
+            with self._lock:
+                series = self._histograms.setdefault(name, {})
+                histogram = series.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if self.enabled:
+            self.histogram(name, **labels).observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def add_collector(self, collector) -> None:
+        """
+        Регистрирует функцию, которая при выдаче метрик возвращает список (имя, тип, метки, значение)
+        для величин, которые хранятся в других объектах (например, длина исходящей очереди).
+        """
+        self._collectors.append(collector)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def histograms(self, name: str) -> dict[tuple, Histogram]:
+        with self._lock:
+            return dict(self._histograms.get(name, {}))
+
+    def counters(self, name: str) -> dict[tuple, float]:
+        with self._lock:
+            return dict(self._counters.get(name, {}))
+
+    def render_prometheus(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus 0.0.4.
+        """
+        lines = []
+        with self._lock:
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+
+        for name in sorted(histograms):
+            self._append_header(lines, name, "histogram")
+            for label_key, histogram in sorted(histograms[name].items()):
+                counts, total, count = histogram.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(label_key, (('le', _format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(label_key)} {total!r}")
+                lines.append(f"{name}_count{_format_labels(label_key)} {count}")
+
+        for name in sorted(counters):
+            self._append_header(lines, name, "counter")
+            for label_key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(label_key)} {_format_value(value)}")
+
+        collected: dict[str, list] = {}
+        for collector in self._collectors:
+            try:
+                for name, kind, labels, value in collector():
+                    collected.setdefault(name, [kind]).append((_label_key(labels), value))
+            except Exception as e:
+                logger.error(f"Ошибка сборщика метрик {collector!r}: {e}")
+        for name in sorted(collected):
+            kind, *samples = collected[name]
+            self._append_header(lines, name, kind)
+            for label_key, value in samples:
+                lines.append(f"{name}{_format_labels(label_key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _append_header(self, lines: list[str], name: str, kind: str) -> None:
+        help_text = self._help.get(name)
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+# Общий реестр приложения
+metrics = MetricsRegistry()
+
+metrics.describe("bot_handler_seconds", "Время обработки обновления (middleware и обработчик), по командам.")
+metrics.describe("bot_update_queue_wait_seconds", "Время от получения обновления до начала обработки в пуле потоков.")
+metrics.describe("bot_handler_errors_total", "Исключения в обработчиках, по командам.")
+metrics.describe("bot_render_seconds", "Время отрисовки штрих-кода (промахи кэша).")
+metrics.describe("bot_render_cache_total", "Обращения к кэшу изображений штрих-кодов.")
+metrics.describe("bot_telegram_api_seconds", "Время запросов к Bot API, по методам.")
+metrics.describe("bot_telegram_api_errors_total", "Ошибки запросов к Bot API, по методам и кодам.")
+metrics.describe("bot_outbound_queue_wait_seconds", "Время ожидания запроса в исходящей очереди.")
+metrics.describe("bot_shard_updates_total", "Обновления, переданные диспетчером воркеру (SHARD_WORKERS).")
+metrics.describe("bot_shard_queue_size", "Обновления, ожидающие передачи воркеру.")
+metrics.describe("bot_shard_alive", "1, если процесс воркера работает.")
+metrics.describe("bot_shard_restarts_total", "Перезапуски упавших воркеров.")
+metrics.describe("bot_updates_stale_total", "Устаревшие обновления, отброшенные при получении, по политике UPDATES_STALE_POLICY.")
+metrics.describe("bot_updates_catchup_seconds", "Время разбора накопившейся очереди обновлений после запуска.")
+metrics.describe("bot_prerender_total", "Коды списков, отрисованные в фоне после /codes, по результату.")
+metrics.describe("bot_prerender_pending", "Коды, ожидающие фоновой отрисовки.")
+
+
+# --- Время запросов к Bot API ---
+
+def api_error_code(error: Exception) -> str:
+    """
+    Код ошибки для метки: HTTP-код ответа Bot API или имя класса сетевой ошибки.
+    """
+    error_code = getattr(error, "error_code", None)
+    return str(error_code) if error_code is not None else type(error).__name__
+
+
+def instrument_telegram_api(registry: MetricsRegistry = metrics) -> None:
+    """
+    Оборачивает apihelper._make_request, через который идут все запросы синхронного TeleBot.
+    Повторный вызов ничего не делает.
+    """
+    original = apihelper._make_request
+    if getattr(original, "_metrics_wrapped", False):
+        return
+
+    def _timed_make_request(token, method_name, method='get', params=None, files=None):
+        if not registry.enabled or method_name in UNTIMED_API_METHODS:
+            return original(token, method_name, method, params=params, files=files)
+        started = time.perf_counter()
+        try:
+            return original(token, method_name, method, params=params, files=files)
+        except Exception as e:
+            registry.inc("bot_telegram_api_errors_total", method=method_name, code=api_error_code(e))
+            raise
+        finally:
+            registry.observe("bot_telegram_api_seconds", time.perf_counter() - started, method=method_name)
+
+    _timed_make_request._metrics_wrapped = True
+    apihelper._make_request = _timed_make_request
+
+
+def instrument_async_telegram_api(registry: MetricsRegistry = metrics) -> None:
+    """
+    То же для AsyncTeleBot: оборачивает asyncio_helper._process_request.
+    """
+    from telebot import asyncio_helper
+
+    original = asyncio_helper._process_request
+    if getattr(original, "_metrics_wrapped", False):
+        return
+
+    async def _timed_process_request(token, url, method='get', params=None, files=None, **kwargs):
+        if not registry.enabled or url in UNTIMED_API_METHODS:
+            return await original(token, url, method, params=params, files=files, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await original(token, url, method, params=params, files=files, **kwargs)
+        except Exception as e:
+            registry.inc("bot_telegram_api_errors_total", method=url, code=api_error_code(e))
+            raise
+        finally:
+            registry.observe("bot_telegram_api_seconds", time.perf_counter() - started, method=url)
+
+    _timed_process_request._metrics_wrapped = True
+    asyncio_helper._process_request = _timed_process_request
+
+
+# --- Сводка для /stats ---
+
+STATS_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _ms(seconds: float | None) -> str:
+    return "—" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def histogram_summary_lines(registry: MetricsRegistry, name: str, label: str) -> list[str]:
+    """
+    Строки "значение метки: n=..., p50/p95/p99 в мс" по всем сериям гистограммы, самые частые сверху.
+    """
+    series = registry.histograms(name)
+    rows = []
+    for label_key, histogram in series.items():
+        title = dict(label_key).get(label, "—") if label else "всего"
+        p50, p95, p99 = (histogram.quantile(q) for q in STATS_QUANTILES)
+        rows.append((histogram.count, f"{title}: n={histogram.count}, p50/p95/p99={_ms(p50)}/{_ms(p95)}/{_ms(p99)} мс"))
+    rows.sort(key=lambda row: row[0], reverse=True)
+    return [line for _, line in rows]
+
+
+# --- HTTP-выдача метрик ---
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    server: "MetricsServer"
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics %s - %s", self.address_string(), format % args)
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != METRICS_PATH:
+            body, status, content_type = b"Not Found", 404, "text/plain; charset=utf-8"
+        else:
+            body, status, content_type = self.server.registry.render_prometheus().encode("utf-8"), 200, PROMETHEUS_CONTENT_TYPE
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    HTTP-сервер, отдающий GET /metrics в формате Prometheus. Работает в фоновом потоке.
+    """
+    daemon_threads = True
+
+    def __init__(self, listen: str, port: int, registry: MetricsRegistry = metrics):
+        super().__init__((listen, port), _MetricsRequestHandler)
+        self.registry = registry
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        logger.info(f"Метрики доступны на http://{self.server_address[0]}:{self.server_address[1]}{METRICS_PATH}")
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+        self._thread = None
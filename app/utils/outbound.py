@@ -0,0 +1,322 @@
+# utils/outbound.py
+"""
+Очередь исходящих запросов к Bot API с учетом лимитов Telegram.
+
+Telegram ограничивает бота примерно 30 сообщениями в секунду суммарно, примерно одним
+сообщением в секунду в личный чат и 20 сообщениями в минуту в группу. При превышении
+приходит 429 с retry_after. OutboundScheduler выравнивает поток запросов ведрами токенов
+(общее и по одному на чат), повторяет запросы после 429 и позволяет обработчикам
+не ждать отправки.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Hashable
+
+from telebot.apihelper import ApiTelegramException
+
+from .metrics import metrics
+from .profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+# Сколько ведер чатов держать, прежде чем удалять полностью восстановившиеся
+MAX_IDLE_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, cost: float, now: float) -> float:
+        """
+        Через сколько секунд можно потратить cost токенов (0 — можно сейчас).
+        """
+        self._refill(now)
+        # Запрос дороже емкости ведра пропускаем, когда ведро полное
+        needed = min(cost, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, cost: float) -> None:
+        self.tokens -= cost
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("chat_id", "func", "args", "kwargs", "cost", "merge_key", "future", "attempts", "submitted")
+
+    def __init__(self, chat_id, func, args, kwargs, cost, merge_key):
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cost = cost
+        self.merge_key = merge_key
+        self.future = Future()
+        self.attempts = 0
+        self.submitted = time.perf_counter()
+
+
+def retry_after_seconds(error: ApiTelegramException) -> float | None:
+    """
+    Значение retry_after из ответа 429 или None, если это другая ошибка.
+    """
+    if error.error_code != 429:
+        return None
+    parameters = (error.result_json or {}).get("parameters") or {}
+    return float(parameters.get("retry_after", 1))
+
+
+class OutboundScheduler:
+    """
+    Планировщик исходящих запросов.
+
+    Запросы одного чата выполняются строго по очереди (не больше одного одновременно),
+    поэтому порядок сообщений сохраняется. Разные чаты обслуживаются по кругу пулом
+    из workers потоков. Задача с merge_key заменяет еще не начатую задачу того же чата
+    с тем же ключом (например, промежуточные обновления прогресса).
+    """
+
+    def __init__(self, global_rate: float = 30, private_rate: float = 1, group_per_minute: float = 20,
+                 max_retries: int = 3, workers: int = 4):
+        """
+        Args:
+            global_rate (float): Общий лимит запросов в секунду.
+            private_rate (float): Лимит запросов в секунду в один личный чат.
+            group_per_minute (float): Лимит запросов в минуту в одну группу (chat_id < 0).
+            max_retries (int): Сколько раз повторять запрос после 429.
+            workers (int): Сколько запросов выполнять одновременно (в разные чаты).
+        """
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.private_rate = private_rate
+        self.group_rate = group_per_minute / 60
+        self.group_capacity = max(1.0, group_per_minute)
+        self.max_retries = max(0, max_retries)
+        self.workers = max(1, workers)
+
+        self._cond = threading.Condition()
+        self._queues: dict[int, deque[_Job]] = {}
+        self._round_robin: deque[int] = deque()
+        self._in_flight: set[int] = set()
+        self._paused_until: dict[int, float] = {}
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._pool: ThreadPoolExecutor | None = None
+        self._dispatcher: threading.Thread | None = None
+        self._stopping = False
+
+        self.sent_count = 0
+        self.retried_count = 0
+        self.merged_count = 0
+        self.failed_count = 0
+
+    # --- Запуск и остановка ---
+
+    @property
+    def running(self) -> bool:
+        return self._dispatcher is not None
+
+    def start(self) -> None:
+        if self._dispatcher is not None:
+            return
+        self._stopping = False
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="outbound")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="outbound-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        """
+        Дожидается отправки поставленных запросов (не дольше timeout секунд), остальные отменяет.
+        """
+        if self._dispatcher is None:
+            return
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._queues or self._in_flight) and time.monotonic() < deadline:
+                self._cond.wait(timeout=max(0.0, deadline - time.monotonic()))
+            self._stopping = True
+            cancelled = 0
+            for jobs in self._queues.values():
+                for job in jobs:
+                    if job.attempts:
+                        job.future.set_exception(RuntimeError("Исходящая очередь остановлена до повтора запроса"))
+                    elif not job.future.cancel():
+                        continue
+                    cancelled += 1
+            self._queues.clear()
+            self._round_robin.clear()
+            self._cond.notify_all()
+        self._dispatcher.join()
+        self._dispatcher = None
+        self._pool.shutdown(wait=True)
+        self._pool = None
+        if cancelled:
+            logger.warning(f"Исходящая очередь остановлена, отменено неотправленных запросов: {cancelled}.")
+
+    # --- Постановка задач ---
+
+    def submit(self, chat_id: int, func: Callable, *args, cost: float = 1, merge_key: Hashable | None = None,
+               **kwargs) -> Future:
+        """
+        Ставит вызов func(*args, **kwargs) в очередь чата chat_id и сразу возвращает Future.
+
+        Если планировщик не запущен, вызов выполняется сразу в текущем потоке.
+        """
+        job = _Job(chat_id, func, args, kwargs, cost, merge_key)
+        if self._dispatcher is None:
+            self._run_inline(job)
+            return job.future
+        with self._cond:
+            queue = self._queues.get(chat_id)
+            if queue is None:
+                queue = self._queues[chat_id] = deque()
+                self._round_robin.append(chat_id)
+            if merge_key is not None:
+                for pending in list(queue):
+                    if pending.merge_key == merge_key and pending.future.cancel():
+                        queue.remove(pending)
+                        self.merged_count += 1
+            queue.append(job)
+            self._cond.notify()
+        return job.future
+
+    def _run_inline(self, job: _Job) -> None:
+        job.future.set_running_or_notify_cancel()
+        try:
+            job.future.set_result(job.func(*job.args, **job.kwargs))
+        except BaseException as e:
+            job.future.set_exception(e)
+
+    # --- Диспетчер ---
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > MAX_IDLE_CHAT_BUCKETS:
+                self._prune_chat_buckets()
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_capacity)
+            else:
+                bucket = TokenBucket(self.private_rate, max(1.0, self.private_rate))
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_chat_buckets(self) -> None:
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items()
+                        if chat_id not in self._queues and bucket.is_full(now)]:
+            del self._chat_buckets[chat_id]
+
+    def _next_job_locked(self) -> tuple[_Job | None, float | None]:
+        """
+        Выбирает следующую задачу по кругу среди чатов. Возвращает (задача, None)
+        или (None, сколько ждать до появления готовой задачи).
+        """
+        now = time.monotonic()
+        min_wait = None
+        for _ in range(len(self._round_robin)):
+            chat_id = self._round_robin[0]
+            self._round_robin.rotate(-1)
+            if chat_id in self._in_flight:
+                continue
+            job = self._queues[chat_id][0]
+            wait = max(self._paused_until.get(chat_id, 0.0) - now,
+                       self._chat_bucket(chat_id).delay_for(job.cost, now))
+            if wait <= 0:
+                global_wait = self.global_bucket.delay_for(job.cost, now)
+                if global_wait <= 0:
+                    self._queues[chat_id].popleft()
+                    if not self._queues[chat_id]:
+                        del self._queues[chat_id]
+                        self._round_robin.remove(chat_id)
+                    self._paused_until.pop(chat_id, None)
+                    self._chat_bucket(chat_id).consume(job.cost)
+                    self.global_bucket.consume(job.cost)
+                    return job, None
+                wait = global_wait
+            min_wait = wait if min_wait is None else min(min_wait, wait)
+        return None, min_wait
+
+    def _dispatch_loop(self) -> None:
+        with self._cond:
+            while not self._stopping:
+                job, wait = self._next_job_locked()
+                if job is None:
+                    self._cond.wait(timeout=wait)
+                    continue
+                # Повторяемая после 429 задача уже в состоянии RUNNING
+                if job.attempts == 0 and not job.future.set_running_or_notify_cancel():
+                    continue
+                self._in_flight.add(job.chat_id)
+                self._pool.submit(self._execute, job)
+
+    def _execute(self, job: _Job) -> None:
+        result, error, retry_after = None, None, None
+        if job.attempts == 0:
+            metrics.observe("bot_outbound_queue_wait_seconds", time.perf_counter() - job.submitted)
+        job.attempts += 1
+        profiler.enter()
+        try:
+            result = job.func(*job.args, **job.kwargs)
+        except ApiTelegramException as e:
+            error = e
+            retry_after = retry_after_seconds(e)
+        except BaseException as e:
+            error = e
+        finally:
+            profiler.exit()
+
+        with self._cond:
+            self._in_flight.discard(job.chat_id)
+            if retry_after is not None and job.attempts <= self.max_retries and not self._stopping:
+                # Повторяем первой в очереди чата, чтобы не нарушить порядок сообщений
+                logger.warning(f"429 для чата {job.chat_id}: повтор через {retry_after} с "
+                               f"(попытка {job.attempts}/{self.max_retries}).")
+                self.retried_count += 1
+                self._paused_until[job.chat_id] = time.monotonic() + retry_after
+                queue = self._queues.get(job.chat_id)
+                if queue is None:
+                    queue = self._queues[job.chat_id] = deque()
+                    self._round_robin.append(job.chat_id)
+                queue.appendleft(job)
+                self._cond.notify_all()
+                return
+            if error is None:
+                self.sent_count += 1
+            else:
+                self.failed_count += 1
+            self._cond.notify_all()
+
+        if error is None:
+            job.future.set_result(result)
+        else:
+            logger.error(f"Ошибка исходящего запроса в чат {job.chat_id}: {error}")
+            job.future.set_exception(error)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "pending": sum(len(queue) for queue in self._queues.values()),
+                "in_flight": len(self._in_flight),
+                "sent": self.sent_count,
+                "retried_429": self.retried_count,
+                "merged": self.merged_count,
+                "failed": self.failed_count,
+            }
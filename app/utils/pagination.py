@@ -0,0 +1,83 @@
+# utils/pagination.py
+"""
+Разбиение длинных списков на сообщения и страницы в пределах лимита Telegram (4096 символов).
+
+Границы страниц считаются по длинам элементов, без сборки всего текста: для списка
+из ста тысяч кодов строка собирается только для показываемой страницы.
+"""
+from bisect import bisect_right
+from typing import Iterable, Iterator, NamedTuple
+
+
+class Page(NamedTuple):
+    number: int # Номер страницы, с нуля
+    total: int
+    start: int # Индекс первого элемента страницы
+    end: int # Индекс за последним элементом страницы
+
+
+def page_bounds(lengths: Iterable[int], limit: int, separator_len: int = 1, max_items: int = 0) -> list[tuple[int, int]]:
+    """
+    Границы страниц [start, end) для элементов с длинами lengths.
+
+    На странице не больше limit символов вместе с разделителями и не больше max_items
+    элементов (0 — без ограничения). Элемент длиннее limit занимает отдельную страницу.
+    """
+    bounds = []
+    start = 0
+    size = 0
+    index = -1
+    for index, length in enumerate(lengths):
+        count = index - start
+        added = length + separator_len if count else length
+        if count and (size + added > limit or (max_items and count >= max_items)):
+            bounds.append((start, index))
+            start, size = index, length
+        else:
+            size += added
+    if index >= start:
+        bounds.append((start, index + 1))
+    return bounds
+
+
+def find_page(bounds: list[tuple[int, int]], cursor: int) -> Page:
+    """
+    Страница, на которой находится элемент с индексом cursor.
+
+    Курсор за концом списка (например, список сократился после нажатия кнопки) дает последнюю страницу.
+    """
+    if not bounds:
+        return Page(0, 0, 0, 0)
+    number = bisect_right(bounds, (cursor, float("inf"))) - 1
+    number = min(max(number, 0), len(bounds) - 1)
+    start, end = bounds[number]
+    return Page(number, len(bounds), start, end)
+
+
+def iter_chunks(parts: Iterable[str], limit: int, separator: str = "") -> Iterator[str]:
+    """
+    Потоково собирает части в сообщения не длиннее limit символов.
+
+    Каждое сообщение собирается одним join, без повторной конкатенации строк.
+    Часть длиннее limit режется на куски по limit символов.
+    """
+    buffer: list[str] = []
+    size = 0
+    for part in parts:
+        added = len(part) + len(separator) if buffer else len(part)
+        if len(part) > limit:
+            if buffer:
+                yield separator.join(buffer)
+                buffer, size = [], 0
+            pieces = [part[offset:offset + limit] for offset in range(0, len(part), limit)]
+            yield from pieces[:-1]
+            part = pieces[-1]
+            added = len(part)
+        elif buffer and size + added > limit:
+            yield separator.join(buffer)
+            buffer, size = [], 0
+            added = len(part)
+        buffer.append(part)
+        size += added
+    if buffer:
+        yield separator.join(buffer)
@@ -0,0 +1,185 @@
+# utils/prerender.py
+"""
+Фоновая отрисовка списка пользователя после /codes: /gen без аргументов выбирает случайный
+код из списка и чаще всего находит готовое изображение в кэше, а не ждет пул отрисовки.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .metrics import metrics
+from .render_executor import RenderQueueFullError, render_executor
+
+logger = logging.getLogger(__name__)
+
+IDLE_POLL_INTERVAL = 0.05 # Как часто проверять, закончились ли в пуле задачи обработчиков, секунды
+QUEUE_FULL_DELAY = 0.5 # Пауза, если очередь пула все-таки оказалась заполнена, секунды
+
+
+class Prerenderer:
+    """
+    Очередь фоновой отрисовки кодов по пользователям.
+
+    Пользователи обслуживаются по кругу по одному коду, поэтому длинный список одного
+    пользователя не задерживает списки остальных. Новый список пользователя заменяет его
+    неотрисованные коды. Код отправляется в пул, только когда в пуле нет других задач, а после
+    отрисовки поток выжидает паузу: фоновая отрисовка занимает не больше cpu_budget времени
+    одного процесса.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending: OrderedDict[int, deque[str]] = OrderedDict()
+        self._thread: threading.Thread | None = None
+        self._taken: tuple[int, str] | None = None # Код, который поток взял из очереди; None — если его список сменился
+        self._stopping = False
+        self.max_per_user = 0
+        self.cpu_budget = 1.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, max_per_user: int, cpu_budget: float) -> None:
+        """
+        Запускает поток фоновой отрисовки. Повторный вызов без stop() игнорируется.
+
+        Args:
+            max_per_user (int): Сколько кодов одного списка отрисовывать заранее; 0 — не отрисовывать.
+            cpu_budget (float): Доля времени (0..1], которую поток может занимать отрисовкой.
+        """
+        with self._cond:
+            if self._thread is not None:
+                return
+            if max_per_user <= 0 or cpu_budget <= 0:
+                logger.info("Фоновая отрисовка списков кодов отключена.")
+                return
+            self.max_per_user = max_per_user
+            self.cpu_budget = min(cpu_budget, 1.0)
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="prerender", daemon=True)
+            self._thread.start()
+        metrics.add_collector(self._collect_metrics)
+        logger.info(f"Фоновая отрисовка списков кодов запущена: до {self.max_per_user} кодов на пользователя, "
+                    f"бюджет CPU {self.cpu_budget:.0%}.")
+
+    def stop(self) -> None:
+        """
+        Отменяет неотрисованные коды и останавливает поток (текущая отрисовка дожидается конца).
+        """
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._pending.clear()
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def schedule(self, user_id: int, codes: list[str]) -> int:
+        """
+        Ставит в очередь до max_per_user кодов пользователя вместо его прежних неотрисованных кодов.
+        Возвращает количество поставленных кодов.
+        """
+        if self._thread is None:
+            return 0
+        codes = list(dict.fromkeys(codes))[:self.max_per_user]
+        with self._cond:
+            self._cancel_locked(user_id)
+            if codes:
+                self._pending[user_id] = deque(codes)
+                self._cond.notify()
+        return len(codes)
+
+    def cancel(self, user_id: int) -> None:
+        with self._cond:
+            self._cancel_locked(user_id)
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return sum(len(codes) for codes in self._pending.values())
+
+    def _cancel_locked(self, user_id: int) -> None:
+        if self._taken is not None and self._taken[0] == user_id:
+            self._taken = None
+        dropped = self._pending.pop(user_id, None)
+        if dropped:
+            metrics.inc("bot_prerender_total", len(dropped), result="cancelled")
+
+    def _requeue(self, user_id: int, code: str) -> None:
+        """
+        Возвращает взятый код в начало очереди пользователя, если его список за это время не сменился и не отменен.
+        """
+        with self._cond:
+            if self._taken != (user_id, code) or self._stopping:
+                return
+            self._taken = None
+            codes = self._pending.get(user_id)
+            if codes is not None:
+                codes.appendleft(code)
+            else:
+                self._pending[user_id] = deque([code])
+                self._pending.move_to_end(user_id, last=False)
+
+    def _next_code(self) -> tuple[int, str] | None:
+        with self._cond:
+            while not self._pending and not self._stopping:
+                self._cond.wait()
+            if self._stopping:
+                return None
+            user_id, codes = next(iter(self._pending.items()))
+            code = codes.popleft()
+            if codes:
+                self._pending.move_to_end(user_id)
+            else:
+                del self._pending[user_id]
+            self._taken = (user_id, code)
+            return user_id, code
+
+    def _pause(self, seconds: float) -> bool:
+        """
+        Ждет seconds секунд или остановки. Возвращает False, если поток останавливается.
+        """
+        with self._cond:
+            return not self._cond.wait_for(lambda: self._stopping, seconds)
+
+    def _wait_for_idle_pool(self) -> bool:
+        # Задачи обработчиков (/gen, /sheet) идут первыми: фоновый код ждет, пока пул освободится.
+        # Без пула (RENDER_POOL_SIZE = 0) in_flight считает отрисовки в потоках обработчиков
+        while render_executor.in_flight > 0:
+            if not self._pause(IDLE_POLL_INTERVAL):
+                return False
+        return True
+
+    def _run(self) -> None:
+        while True:
+            item = self._next_code()
+            if item is None or not self._wait_for_idle_pool():
+                return
+            user_id, code = item
+            started = time.perf_counter()
+            try:
+                rendered = render_executor.prerender(code)
+            except RenderQueueFullError:
+                # Пул занят ненадолго: код возвращается в очередь, иначе набор заранее отрисованных кодов сократился бы
+                metrics.inc("bot_prerender_total", result="busy")
+                self._requeue(user_id, code)
+                if not self._pause(QUEUE_FULL_DELAY):
+                    return
+                continue
+            except Exception as e:
+                logger.warning(f"Фоновая отрисовка кода {code} не выполнена: {e}")
+                rendered = None
+            result = {True: "rendered", False: "cached", None: "failed"}[rendered]
+            metrics.inc("bot_prerender_total", result=result)
+            if rendered and self.cpu_budget < 1:
+                elapsed = time.perf_counter() - started
+                if not self._pause(elapsed * (1 / self.cpu_budget - 1)):
+                    return
+
+    def _collect_metrics(self):
+        return [("bot_prerender_pending", "gauge", {}, self.pending_count())]
+
+
+# Общий экземпляр, запускается и останавливается в app/factory.py
+prerenderer = Prerenderer()
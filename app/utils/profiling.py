@@ -0,0 +1,209 @@
+# utils/profiling.py
+"""
+Профилирование по запросу (/profile): cProfile в потоках обработчиков или tracemalloc
+на ограниченное окно времени, пока бот продолжает обслуживать пользователей.
+
+cProfile работает на уровне потока, поэтому профиль включается хуками enter()/exit()
+вокруг обработки обновления (ProfilingMiddleware) и исходящих запросов (OutboundScheduler):
+в каждом потоке свой cProfile.Profile, после окна они объединяются в один pstats.Stats.
+Вне сеанса хуки сводятся к проверке одного атрибута.
+
+Отрисовка в пуле процессов в профиль не попадает: виден только вызов пула и ожидание результата.
+"""
+import cProfile
+import io
+import logging
+import marshal
+import pickle
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+MODE_CPU = "cpu"
+MODE_MEM = "mem"
+PROFILE_MODES = (MODE_CPU, MODE_MEM)
+TRACEMALLOC_FRAMES = 8 # Глубина стека для мест выделения памяти
+SCOPE_DRAIN_TIMEOUT = 10 # Сколько секунд ждать завершения обработчиков, начатых внутри окна
+
+
+class ProfilerBusyError(RuntimeError):
+    """
+    Сеанс профилирования уже идет (или tracemalloc включен кем-то еще).
+    """
+
+
+class ProfileReport(NamedTuple):
+    mode: str
+    seconds: float # Фактическая длительность окна
+    text: str # Текстовый отчет: функции по cumulative time или места выделения памяти
+    raw: bytes # Сырые данные: .pstats (marshal, как pstats.Stats.dump_stats) или снимок tracemalloc (pickle)
+    raw_extension: str
+
+
+class OnDemandProfiler:
+    """
+    Один сеанс профилирования за раз. start() и stop() вызываются из любого потока.
+    """
+
+    def __init__(self):
+        self.mode: str | None = None # Режим текущего сеанса; None — сеанса нет
+        self._lock = threading.Lock()
+        self._scopes_closed = threading.Condition(self._lock)
+        self._local = threading.local()
+        self._session = 0
+        self._started = 0.0
+        self._profiles: list[cProfile.Profile] = []
+        self._open: set[cProfile.Profile] = set()
+        self._baseline: tracemalloc.Snapshot | None = None
+        self._stop_requested = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        return self.mode is not None
+
+    # --- Хуки потоков ---
+
+    def enter(self) -> None:
+        """
+        Начало обработки в текущем потоке. Вложенные вызовы учитываются счетчиком глубины.
+        """
+        local = self._local
+        depth = getattr(local, "depth", 0)
+        if depth:
+            local.depth = depth + 1
+            return
+        if self.mode != MODE_CPU:
+            return
+        with self._lock:
+            if self.mode != MODE_CPU:
+                return
+            profile = getattr(local, "profile", None)
+            if profile is None or local.session != self._session:
+                profile = cProfile.Profile()
+                local.profile, local.session = profile, self._session
+                self._profiles.append(profile)
+            self._open.add(profile)
+        try:
+            profile.enable()
+        except ValueError as e:
+            # В потоке уже работает другой профилировщик
+            logger.debug("Не удалось включить cProfile в потоке %s: %s", threading.current_thread().name, e)
+            with self._lock:
+                self._open.discard(profile)
+                self._scopes_closed.notify_all()
+            return
+        local.depth = 1
+
+    def exit(self) -> None:
+        """
+        Конец обработки в текущем потоке; парный вызов к enter().
+        """
+        local = self._local
+        depth = getattr(local, "depth", 0)
+        if not depth:
+            return
+        local.depth = depth - 1
+        if depth == 1:
+            local.profile.disable()
+            with self._lock:
+                self._open.discard(local.profile)
+                self._scopes_closed.notify_all()
+
+    # --- Сеанс ---
+
+    def start(self, mode: str) -> None:
+        """
+        Raises:
+            ValueError: Неизвестный режим.
+            ProfilerBusyError: Сеанс уже идет или tracemalloc уже включен.
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Неизвестный режим профилирования: {mode}")
+        with self._lock:
+            if self.mode is not None:
+                raise ProfilerBusyError("Профилирование уже запущено")
+            if mode == MODE_MEM:
+                if tracemalloc.is_tracing():
+                    raise ProfilerBusyError("tracemalloc уже включен")
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._baseline = tracemalloc.take_snapshot()
+            self._session += 1
+            self._profiles = []
+            self._stop_requested.clear()
+            self._started = time.monotonic()
+            self.mode = mode
+
+    def wait(self, seconds: float) -> None:
+        """
+        Ждет окончания окна; cancel() прерывает ожидание досрочно.
+        """
+        self._stop_requested.wait(seconds)
+
+    def cancel(self) -> None:
+        self._stop_requested.set()
+
+    def stop(self, top: int = 40) -> ProfileReport | None:
+        """
+        Завершает сеанс и возвращает отчет (None, если сеанса не было).
+        """
+        with self._lock:
+            mode, self.mode = self.mode, None
+            if mode is None:
+                return None
+            elapsed = time.monotonic() - self._started
+            if mode == MODE_CPU:
+                # Профиль потока нельзя читать, пока он включен: ждем обработчики, начатые внутри окна
+                self._scopes_closed.wait_for(lambda: not self._open, timeout=SCOPE_DRAIN_TIMEOUT)
+                profiles = [profile for profile in self._profiles if profile not in self._open]
+                skipped = len(self._profiles) - len(profiles)
+                self._profiles = []
+        if mode == MODE_CPU:
+            if skipped:
+                logger.warning(f"Профилирование: пропущено незавершенных потоков: {skipped}.")
+            report = _cpu_report(profiles, elapsed, top)
+        else:
+            report = self._memory_report(elapsed, top)
+        logger.info(f"Профилирование ({mode}) завершено за {elapsed:.1f} с.")
+        return report
+
+    def _memory_report(self, elapsed: float, top: int) -> ProfileReport:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        baseline, self._baseline = self._baseline, None
+        own_traces = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+        snapshot = snapshot.filter_traces(own_traces)
+        differences = snapshot.compare_to(baseline.filter_traces(own_traces), "lineno")
+
+        lines = [f"tracemalloc, окно {elapsed:.1f} с: сейчас {current / 1024:.0f} КиБ, пик {peak / 1024:.0f} КиБ "
+                 f"(память, выделенная при включенной трассировке).",
+                 "", f"Рост по местам выделения (топ {top}):"]
+        lines.extend(str(difference) for difference in differences[:top])
+        lines.extend(["", f"Занято по местам выделения (топ {top}):"])
+        lines.extend(str(statistic) for statistic in snapshot.statistics("lineno")[:top])
+        # Snapshot.dump пишет pickle снимка; читается через tracemalloc.Snapshot.load()
+        return ProfileReport(MODE_MEM, elapsed, "\n".join(lines) + "\n", pickle.dumps(snapshot), "tracemalloc")
+
+
+def _cpu_report(profiles: list[cProfile.Profile], elapsed: float, top: int) -> ProfileReport:
+    stream = io.StringIO()
+    if not profiles:
+        stream.write(f"cProfile, окно {elapsed:.1f} с: за это время обработчики не выполнялись.\n")
+        return ProfileReport(MODE_CPU, elapsed, stream.getvalue(), marshal.dumps({}), "pstats")
+
+    stats = pstats.Stats(profiles[0], stream=stream)
+    for profile in profiles[1:]:
+        stats.add(profile)
+    # Тот же формат, что у pstats.Stats.dump_stats: файл открывается pstats/snakeviz
+    raw = marshal.dumps(stats.stats)
+    stream.write(f"cProfile, окно {elapsed:.1f} с, потоков: {len(profiles)}\n")
+    stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    return ProfileReport(MODE_CPU, elapsed, stream.getvalue(), raw, "pstats")
+
+
+# Общий экземпляр: хуки вызываются из middleware и исходящей очереди, сеансы запускает /profile
+profiler = OnDemandProfiler()
@@ -0,0 +1,259 @@
+# utils/render_executor.py
+import logging
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FuturesTimeoutError, wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from .barcode_utils import (
+    barcode_cache,
+    barcode_render_key,
+    generate_ean13_barcode_image_bytes,
+    normalize_ean13,
+    render_ean13_png,
+    resolve_barcode_engine,
+)
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueueFullError(RuntimeError):
+    """
+    Очередь задач отрисовки заполнена — новую задачу нужно отклонить.
+    """
+
+
+class RenderExecutor:
+    """
+    Выносит отрисовку штрих-кодов в пул процессов, чтобы CPU-работа не блокировала
+    потоки обработчиков telebot (и не удерживала GIL).
+
+    Кэш изображений проверяется и пополняется в основном процессе, в пул уходят только промахи.
+    Если пул не запущен (размер 0), отрисовка выполняется в вызывающем потоке.
+    """
+
+    def __init__(self):
+        self._pool: ProcessPoolExecutor | None = None
+        self._pool_lock = threading.Lock()
+        self._slots: threading.BoundedSemaphore | None = None
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self.pool_size = 0
+        self.max_queue_depth = 0
+        self.job_timeout = None
+
+    @property
+    def running(self) -> bool:
+        return self._pool is not None
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Задачи в пуле (в работе и в очереди), включая фоновые; без пула — отрисовки в потоках обработчиков.
+        """
+        return self._in_flight
+
+    def start(self, pool_size: int, max_queue_depth: int, job_timeout: float | None) -> None:
+        """
+        Запускает пул процессов. Повторный вызов без shutdown() игнорируется.
+
+        Args:
+            pool_size (int): Количество процессов; 0 или меньше — отрисовка без пула.
+            max_queue_depth (int): Максимум задач, одновременно находящихся в пуле (в работе и в очереди).
+            job_timeout (float | None): Сколько секунд ждать результат одной задачи.
+        """
+        with self._pool_lock:
+            if self._pool is not None:
+                return
+            self.job_timeout = job_timeout if job_timeout and job_timeout > 0 else None
+            if pool_size <= 0:
+                logger.info("Пул процессов отрисовки отключен, штрих-коды рисуются в потоках обработчиков.")
+                return
+            self.pool_size = pool_size
+            self.max_queue_depth = max(1, max_queue_depth)
+            self._slots = threading.BoundedSemaphore(self.max_queue_depth)
+            self._pool = ProcessPoolExecutor(max_workers=pool_size)
+        logger.info(f"Пул процессов отрисовки запущен: процессов={pool_size}, глубина очереди={self.max_queue_depth}, "
+                    f"таймаут={self.job_timeout}.")
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Останавливает пул, отменяя задачи, которые еще не начали выполняться.
+        """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+            logger.info("Пул процессов отрисовки остановлен.")
+
+    def render(self, code_string: str, writer_options: dict | None = None) -> BytesIO | None:
+        """
+        Возвращает PNG штрих-кода так же, как generate_ean13_barcode_image_bytes, но отрисовывает в пуле процессов.
+
+        Raises:
+            RenderQueueFullError: Если в пуле уже max_queue_depth задач.
+
+        Returns:
+            BytesIO: Read-only BytesIO с PNG или None при ошибке/таймауте.
+        """
+        pool = self._pool
+        if pool is None:
+            return self._run_inline(generate_ean13_barcode_image_bytes, code_string, writer_options)
+
+        normalized_code = normalize_ean13(code_string)
+        if normalized_code is None:
+            logger.warning(f"Неверный формат кода EAN для генерации: {code_string}")
+            return None
+
+        cache_key = barcode_render_key(normalized_code, writer_options)
+        cached = barcode_cache.get(cache_key)
+        if cached is not None:
+            metrics.inc("bot_render_cache_total", result="hit")
+            return cached
+        metrics.inc("bot_render_cache_total", result="miss")
+
+        png_bytes = self._render_in_pool(pool, normalized_code, writer_options, code_string, "pool")
+        return barcode_cache.put(cache_key, png_bytes) if png_bytes is not None else None
+
+    def prerender(self, code_string: str) -> bool | None:
+        """
+        Отрисовывает код в кэш заранее, если его там еще нет (фоновая отрисовка списка после /codes).
+
+        Не учитывается в bot_render_cache_total: доля попаданий в кэш остается показателем
+        запросов пользователей.
+
+        Raises:
+            RenderQueueFullError: Если в пуле уже max_queue_depth задач.
+
+        Returns:
+            bool | None: True — код отрисован, False — уже был в кэше, None — ошибка отрисовки.
+        """
+        normalized_code = normalize_ean13(code_string)
+        if normalized_code is None:
+            return None
+        cache_key = barcode_render_key(normalized_code)
+        if barcode_cache.get(cache_key) is not None:
+            return False
+        pool = self._pool
+        if pool is None:
+            started = time.perf_counter()
+            engine = resolve_barcode_engine()
+            png_bytes = render_ean13_png(normalized_code, None, engine)
+            metrics.observe("bot_render_seconds", time.perf_counter() - started, engine=engine, where="prerender")
+        else:
+            png_bytes = self._render_in_pool(pool, normalized_code, None, code_string, "prerender")
+            if png_bytes is None:
+                return None
+        barcode_cache.put(cache_key, png_bytes)
+        return True
+
+    def _render_in_pool(self, pool: ProcessPoolExecutor, normalized_code: str, writer_options: dict | None,
+                        code_string: str, where: str) -> bytes | None:
+        engine = resolve_barcode_engine(writer_options)
+        started = time.perf_counter()
+        future = self._submit(pool, False, render_ean13_png, normalized_code, writer_options, engine)
+        try:
+            png_bytes = future.result(timeout=self.job_timeout)
+        except FuturesTimeoutError:
+            future.cancel()
+            logger.error(f"Таймаут отрисовки штрих-кода для '{code_string}' ({self.job_timeout} с).")
+            return None
+        except BrokenProcessPool as e:
+            logger.error(f"Пул процессов отрисовки поврежден ({e}), перезапускаем его.")
+            self._restart_pool(pool)
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка генерации штрих-кода для '{code_string}' в пуле процессов: {e}")
+            return None
+        # Включает ожидание свободного процесса и передачу результата между процессами
+        metrics.observe("bot_render_seconds", time.perf_counter() - started, engine=engine, where=where)
+        return png_bytes
+
+    def _submit(self, pool: ProcessPoolExecutor, blocking: bool, func, *args) -> Future:
+        """
+        Занимает слот очереди и отправляет задачу в пул. Без свободного слота ждет (blocking)
+        или выбрасывает RenderQueueFullError.
+        """
+        if not self._slots.acquire(blocking=blocking):
+            raise RenderQueueFullError(f"Очередь отрисовки заполнена ({self.max_queue_depth} задач)")
+        with self._in_flight_lock:
+            self._in_flight += 1
+        try:
+            future = pool.submit(func, *args)
+        except Exception:
+            self._job_done(None)
+            raise
+        # Слот освобождается, когда задача реально завершилась, а не когда вызывающий перестал ждать
+        future.add_done_callback(self._job_done)
+        return future
+
+    def _run_inline(self, func, *args):
+        # Без пула задача идет в потоке обработчика; счетчик нужен фоновой отрисовке, чтобы уступать ей CPU
+        with self._in_flight_lock:
+            self._in_flight += 1
+        try:
+            return func(*args)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+
+    def _job_done(self, _future) -> None:
+        with self._in_flight_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def call(self, func, *args, timeout: float | None = None):
+        """
+        Выполняет func(*args) в пуле процессов и возвращает результат (для длинных задач вроде листов кодов).
+
+        В отличие от render(), ждет свободного слота, а не отклоняет задачу: вызывается из фоновых
+        потоков, а не из обработчиков. Без пула функция выполняется в вызывающем потоке.
+
+        Raises:
+            concurrent.futures.TimeoutError: Задача не завершилась за timeout секунд.
+            Exception: Исключение, выброшенное func.
+        """
+        pool = self._pool
+        if pool is None:
+            return self._run_inline(func, *args)
+        future = self._submit(pool, True, func, *args)
+        try:
+            return future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            future.cancel()
+            raise
+        except BrokenProcessPool as e:
+            logger.error(f"Пул процессов отрисовки поврежден ({e}), перезапускаем его.")
+            self._restart_pool(pool)
+            raise
+
+    def warm_up(self, code_string: str) -> None:
+        """
+        Запускает процессы пула и отрисовывает в них пробный код, чтобы первый /gen не ждал
+        запуска процесса и импорта python-barcode/Pillow (при spawn, например в Windows-сборках).
+
+        Задачи прогрева не занимают слоты очереди: их не больше pool_size и они короткие.
+        """
+        pool = self._pool
+        if pool is None:
+            return
+        engine = resolve_barcode_engine()
+        try:
+            futures = [pool.submit(render_ean13_png, code_string, None, engine) for _ in range(self.pool_size)]
+        except Exception as e:
+            logger.warning(f"Не удалось прогреть пул процессов отрисовки: {e}")
+            return
+        wait_futures(futures, timeout=self.job_timeout)
+
+    def _restart_pool(self, broken_pool: ProcessPoolExecutor) -> None:
+        with self._pool_lock:
+            if self._pool is not broken_pool:
+                return # Пул уже перезапущен другим потоком
+            self._pool = ProcessPoolExecutor(max_workers=self.pool_size)
+        broken_pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Общий экземпляр, запускается и останавливается в app/factory.py
+render_executor = RenderExecutor()
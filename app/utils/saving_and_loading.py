@@ -1,6 +1,11 @@
 import json
 import logging
 import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
@@ -51,4 +56,394 @@ def save_json(saving_dict: dict, file_path: str = 'data.json') -> None:
     """
     logger.info(f"Saving barcodes to {file_path}.")
     with open(file_path, 'w') as file:
-        json.dump(saving_dict, file, indent=4)
\ No newline at end of file
+        json.dump(saving_dict, file, indent=4)
+
+STORAGE_BACKEND_JSON = 'json'
+STORAGE_BACKEND_SQLITE = 'sqlite'
+
+class BarcodeStorage(ABC):
+    """
+    Interface of the per-user barcode list storage.
+
+    Behaves like a small mapping ``user_id -> list of codes`` so handlers can keep
+    using ``get``, ``in``, ``[]=`` and ``del``. Every write is persisted immediately.
+    A backend that misses one of the abstract methods cannot be instantiated.
+    """
+
+    @abstractmethod
+    def get(self, user_id: int, default=None):
+        """
+        Returns:
+            list[str] | None: The user's codes, or default if there are none.
+        """
+
+    @abstractmethod
+    def set(self, user_id: int, codes: list[str]) -> None:
+        """
+        Replace the user's codes and persist them.
+        """
+
+    @abstractmethod
+    def delete(self, user_id: int) -> bool:
+        """
+        Returns:
+            bool: True if the user had stored codes.
+        """
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """
+        Returns:
+            int: The number of users with stored codes.
+        """
+
+    def load(self) -> None:
+        """
+        Load the stored data now instead of on first access (used by the start-up pre-warm).
+        """
+
+    def close(self) -> None:
+        pass
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def __getitem__(self, user_id: int) -> list[str]:
+        codes = self.get(user_id)
+        if codes is None:
+            raise KeyError(user_id)
+        return codes
+
+    def __setitem__(self, user_id: int, codes: list[str]) -> None:
+        self.set(user_id, codes)
+
+    def __delitem__(self, user_id: int) -> None:
+        if not self.delete(user_id):
+            raise KeyError(user_id)
+
+class JsonBarcodeStorage(BarcodeStorage):
+    """
+    Default backend: the whole data.json is kept in memory and rewritten on every change.
+
+    The file is read on first access, so creating the storage does not slow down start-up.
+    """
+
+    def __init__(self, file_path: str = 'data.json'):
+        """
+        Args:
+            file_path (str): The path to the JSON file.
+        """
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._data: dict | None = None
+
+    def _data_locked(self) -> dict:
+        if self._data is None:
+            self._data = load_json(self.file_path)
+        return self._data
+
+    def load(self) -> None:
+        with self._lock:
+            self._data_locked()
+
+    def get(self, user_id: int, default=None):
+        with self._lock:
+            return self._data_locked().get(user_id, default)
+
+    def set(self, user_id: int, codes: list[str]) -> None:
+        with self._lock:
+            data = self._data_locked()
+            data[user_id] = list(codes)
+            save_json(data, self.file_path)
+
+    def delete(self, user_id: int) -> bool:
+        with self._lock:
+            data = self._data_locked()
+            if data.pop(user_id, None) is None:
+                return False
+            save_json(data, self.file_path)
+            return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data_locked())
+
+    def __repr__(self) -> str:
+        return f"JsonBarcodeStorage({self.file_path!r}, users={len(self)})"
+
+class SqliteBarcodeStorage(BarcodeStorage):
+    """
+    SQLite backend: one row per user, so a write touches only that user's row.
+
+    The database runs in WAL mode, rows are read lazily on first access and kept in
+    a bounded LRU cache (misses are cached too). On first start the existing data.json,
+    if any, is imported once; the JSON file itself is left untouched. The database is
+    opened (and the migration runs) on first access rather than in the constructor.
+    """
+
+    _MIGRATION_KEY = 'migrated_from_json'
+
+    def __init__(self, db_path: str = 'data.sqlite3', cache_size: int = 1024, legacy_json_path: str = 'data.json'):
+        """
+        Args:
+            db_path (str): The path to the SQLite database file.
+            cache_size (int): How many users to keep in the read cache; 0 disables caching.
+            legacy_json_path (str): data.json to import on the first start. None skips the migration.
+        """
+        self.db_path = db_path
+        self.cache_size = max(0, cache_size)
+        self.legacy_json_path = legacy_json_path
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[int, list[str] | None] = OrderedDict()
+        self._conn: sqlite3.Connection | None = None
+
+    def _connection_locked(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+        # Handlers run in the TeleBot thread pool, access to the connection is serialized by the lock
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS user_barcodes ('
+            'user_id INTEGER PRIMARY KEY, codes TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        if self.legacy_json_path:
+            self._migrate_from_json(conn, self.legacy_json_path)
+        self._conn = conn
+        return conn
+
+    def _migrate_from_json(self, conn: sqlite3.Connection, json_path: str) -> None:
+        if conn.execute('SELECT 1 FROM meta WHERE key = ?', (self._MIGRATION_KEY,)).fetchone():
+            return
+        legacy = load_json(json_path) if os.path.exists(json_path) else {}
+        now = time.time()
+        conn.execute('BEGIN')
+        try:
+            # Rows written before the migration (if any) win over the legacy file
+            conn.executemany(
+                'INSERT OR IGNORE INTO user_barcodes (user_id, codes, updated_at) VALUES (?, ?, ?)',
+                [(user_id, json.dumps(codes), now) for user_id, codes in legacy.items()],
+            )
+            conn.execute('INSERT INTO meta (key, value) VALUES (?, ?)', (self._MIGRATION_KEY, json_path))
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+        if legacy:
+            logger.info(f"Migrated barcodes of {len(legacy)} users from {json_path} to {self.db_path}.")
+
+    def load(self) -> None:
+        with self._lock:
+            self._connection_locked()
+
+    def _remember_locked(self, user_id: int, codes: list[str] | None) -> None:
+        if not self.cache_size:
+            return
+        self._cache[user_id] = codes
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get(self, user_id: int, default=None):
+        with self._lock:
+            if user_id in self._cache:
+                self._cache.move_to_end(user_id)
+                codes = self._cache[user_id]
+            else:
+                conn = self._connection_locked()
+                row = conn.execute('SELECT codes FROM user_barcodes WHERE user_id = ?', (user_id,)).fetchone()
+                codes = json.loads(row[0]) if row else None
+                self._remember_locked(user_id, codes)
+        return default if codes is None else list(codes)
+
+    def set(self, user_id: int, codes: list[str]) -> None:
+        codes = list(codes)
+        with self._lock:
+            self._connection_locked().execute(
+                'INSERT INTO user_barcodes (user_id, codes, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET codes = excluded.codes, updated_at = excluded.updated_at',
+                (user_id, json.dumps(codes), time.time()),
+            )
+            self._remember_locked(user_id, codes)
+
+    def delete(self, user_id: int) -> bool:
+        with self._lock:
+            deleted = self._connection_locked().execute('DELETE FROM user_barcodes WHERE user_id = ?', (user_id,)).rowcount > 0
+            self._remember_locked(user_id, None)
+        return deleted
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection_locked().execute('SELECT COUNT(*) FROM user_barcodes').fetchone()[0]
+
+    def __repr__(self) -> str:
+        return f"SqliteBarcodeStorage({self.db_path!r}, cached_users={len(self._cache)})"
+
+def create_barcode_storage(backend: str = STORAGE_BACKEND_JSON, json_path: str = 'data.json',
+                           sqlite_path: str = 'data.sqlite3', cache_size: int = 1024) -> BarcodeStorage:
+    """
+    Create the barcode storage selected in the config.
+
+    Args:
+        backend (str): 'json' (default) or 'sqlite'. Unknown values fall back to 'json'.
+        json_path (str): The path to data.json (the JSON backend file and the SQLite migration source).
+        sqlite_path (str): The path to the SQLite database file.
+        cache_size (int): Read cache size of the SQLite backend, in users.
+
+    Returns:
+        BarcodeStorage: The storage instance.
+    """
+    if backend == STORAGE_BACKEND_SQLITE:
+        return SqliteBarcodeStorage(sqlite_path, cache_size=cache_size, legacy_json_path=json_path)
+    if backend != STORAGE_BACKEND_JSON:
+        logger.warning(f"Unknown storage backend '{backend}', falling back to '{STORAGE_BACKEND_JSON}'.")
+    return JsonBarcodeStorage(json_path)
+
+class FileIdIndex:
+    """
+    Persistent index of Telegram file_id values for already uploaded barcode images.
+
+    The index is stored as a JSON file next to data.json and maps a render key
+    (normalized code plus render settings) to the file_id returned by send_photo.
+    The file is read on first access. Entries are kept in LRU order and bounded by
+    max_entries; changes are marked dirty and written by a background flusher (and on
+    stop), so outbound workers never rewrite the file themselves.
+    """
+
+    def __init__(self, file_path: str = None, data_file_path: str = 'data.json', max_entries: int = 50000):
+        """
+        Args:
+            file_path (str): The path to the index file. Defaults to 'file_ids.json' next to data_file_path.
+            data_file_path (str): The path to data.json, used to place the index next to it.
+            max_entries (int): How many file_id values to keep; the least recently used are dropped. 0 means no limit.
+        """
+        if file_path is None:
+            file_path = os.path.join(os.path.dirname(data_file_path), 'file_ids.json')
+        self.file_path = file_path
+        self.max_entries = max(0, max_entries)
+        self._lock = threading.Lock()
+        self._index: OrderedDict[str, str] | None = None
+        self._dirty = False
+        self._flusher: threading.Thread | None = None
+        self._stop_event = threading.Event()
+
+    def _load(self) -> OrderedDict:
+        if not os.path.exists(self.file_path):
+            return OrderedDict()
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as file:
+                loaded = json.load(file)
+            if isinstance(loaded, dict):
+                logger.info(f"Loaded {len(loaded)} file_id entries from {self.file_path}.")
+                return OrderedDict(loaded)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load file_id index from {self.file_path}: {e}")
+        return OrderedDict()
+
+    def _index_locked(self) -> OrderedDict:
+        if self._index is None:
+            self._index = self._load()
+            self._evict_locked()
+        return self._index
+
+    def _evict_locked(self) -> None:
+        if not self.max_entries:
+            return
+        while len(self._index) > self.max_entries:
+            self._index.popitem(last=False)
+            self._dirty = True
+
+    def load(self) -> None:
+        """
+        Load the index now instead of on first access (used by the start-up pre-warm).
+        """
+        with self._lock:
+            self._index_locked()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            index = self._index_locked()
+            file_id = index.get(key)
+            if file_id is not None:
+                index.move_to_end(key)
+            return file_id
+
+    def set(self, key: str, file_id: str) -> None:
+        with self._lock:
+            index = self._index_locked()
+            if index.get(key) == file_id:
+                index.move_to_end(key)
+                return
+            index[key] = file_id
+            index.move_to_end(key)
+            self._evict_locked()
+            self._dirty = True
+        if self._flusher is None:
+            # Without the background flusher the index is written right away, as before
+            self.flush()
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            if self._index_locked().pop(key, None) is None:
+                return
+            self._dirty = True
+        if self._flusher is None:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the index to file_path (atomically) if it changed since the last flush.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = dict(self._index)
+            self._dirty = False
+        tmp_path = f"{self.file_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(snapshot, file)
+            os.replace(tmp_path, self.file_path)
+        except OSError as e:
+            logger.error(f"Failed to save file_id index to {self.file_path}: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def start_flusher(self, interval: float = 30) -> None:
+        """
+        Start a background thread that flushes the index every interval seconds.
+
+        Args:
+            interval (float): Seconds between flushes; 0 or less keeps writing on every change.
+        """
+        if self._flusher is not None or interval <= 0:
+            return
+        self._stop_event.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, args=(interval,), name="file-id-flusher", daemon=True)
+        self._flusher.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background flusher and write pending changes.
+        """
+        self._stop_event.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def _flush_loop(self, interval: float) -> None:
+        while not self._stop_event.wait(interval):
+            self.flush()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index_locked())
@@ -0,0 +1,309 @@
+# utils/state_storage.py
+"""
+Хранилище состояний telebot с ограниченным временем жизни и размером.
+
+StateMemoryStorage из telebot хранит состояние, пока его не удалят явно: пользователь,
+вызвавший /codes и ушедший, остается в памяти навсегда. TTLStateStorage удаляет
+записи, к которым не обращались дольше ttl секунд, и вытесняет самые старые при
+превышении max_entries.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Union
+
+from telebot.storage.base_storage import StateStorageBase, StateDataContext
+from telebot.asyncio_storage.base_storage import (
+    StateStorageBase as AsyncStateStorageBase,
+    StateDataContext as AsyncStateDataContext,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TTLStateStorage(StateStorageBase):
+    """
+    Потокобезопасное хранилище состояний в памяти с TTL, ограничением размера (LRU) и снимками на диск.
+
+    Записи упорядочены по времени последнего обращения, а TTL у всех одинаковый, поэтому
+    истекшие записи всегда находятся в начале словаря: фоновая очистка просматривает
+    только их, а не все хранилище.
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 10000, snapshot_path: str | None = None,
+                 separator: Optional[str] = ":", prefix: Optional[str] = "telebot"):
+        """
+        Args:
+            ttl (float): Сколько секунд хранить запись без обращений; 0 — без ограничения.
+            max_entries (int): Максимум записей; при превышении вытесняются давно не использованные. 0 — без ограничения.
+            snapshot_path (str | None): Файл снимка для переживания перезапуска; None или "" — без снимков.
+        """
+        self.separator = separator
+        self.prefix = prefix
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.max_entries = max(0, max_entries)
+        self.snapshot_path = snapshot_path or None
+        # key -> [state, data, last_access]; время по time.time(), чтобы снимок был корректен после перезапуска
+        self._entries: OrderedDict[str, list] = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._sweeper: threading.Thread | None = None
+        self._stop_event = threading.Event()
+        self.expired_count = 0
+        self.evicted_count = 0
+        if self.snapshot_path:
+            self._load_snapshot()
+
+    # --- Внутренние операции (вызываются под блокировкой) ---
+
+    def _key(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None) -> str:
+        return self._get_key(chat_id, user_id, self.prefix, self.separator,
+                             business_connection_id, message_thread_id, bot_id)
+
+    def _is_expired(self, entry: list, now: float) -> bool:
+        return self.ttl is not None and now - entry[2] > self.ttl
+
+    def _lookup_locked(self, key: str) -> list | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.time()
+        if self._is_expired(entry, now):
+            del self._entries[key]
+            self.expired_count += 1
+            self._dirty = True
+            return None
+        entry[2] = now
+        self._entries.move_to_end(key)
+        return entry
+
+    def _evict_locked(self) -> None:
+        while self.max_entries and len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            self.evicted_count += 1
+            logger.debug("Состояние %s вытеснено: превышен лимит %d записей.", key, self.max_entries)
+
+    def _sweep_locked(self) -> int:
+        if self.ttl is None:
+            return 0
+        now = time.time()
+        removed = 0
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if not self._is_expired(entry, now):
+                break
+            del self._entries[key]
+            removed += 1
+        if removed:
+            self.expired_count += removed
+            self._dirty = True
+        return removed
+
+    # --- Интерфейс StateStorageBase ---
+
+    def set_state(self, chat_id: int, user_id: int, state: str, business_connection_id: Optional[str] = None,
+                  message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> bool:
+        if hasattr(state, "name"):
+            state = state.name
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        with self._lock:
+            entry = self._lookup_locked(key)
+            if entry is None:
+                self._entries[key] = [state, {}, time.time()]
+                self._evict_locked()
+            else:
+                entry[0] = state
+            self._dirty = True
+        return True
+
+    def get_state(self, chat_id: int, user_id: int, business_connection_id: Optional[str] = None,
+                  message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> Union[str, None]:
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        with self._lock:
+            entry = self._lookup_locked(key)
+            return entry[0] if entry is not None else None
+
+    def delete_state(self, chat_id: int, user_id: int, business_connection_id: Optional[str] = None,
+                     message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> bool:
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return False
+            self._dirty = True
+            return True
+
+    def set_data(self, chat_id: int, user_id: int, key: str, value: Union[str, int, float, dict],
+                 business_connection_id: Optional[str] = None, message_thread_id: Optional[int] = None,
+                 bot_id: Optional[int] = None) -> bool:
+        _key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        with self._lock:
+            entry = self._lookup_locked(_key)
+            if entry is None:
+                raise RuntimeError(f"TTLStateStorage: key {_key} does not exist.")
+            entry[1][key] = value
+            self._dirty = True
+        return True
+
+    def get_data(self, chat_id: int, user_id: int, business_connection_id: Optional[str] = None,
+                 message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> dict:
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        with self._lock:
+            entry = self._lookup_locked(key)
+            return entry[1] if entry is not None else {}
+
+    def reset_data(self, chat_id: int, user_id: int, business_connection_id: Optional[str] = None,
+                   message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> bool:
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        with self._lock:
+            entry = self._lookup_locked(key)
+            if entry is None:
+                return False
+            entry[1] = {}
+            self._dirty = True
+        return True
+
+    def get_interactive_data(self, chat_id: int, user_id: int, business_connection_id: Optional[str] = None,
+                             message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> Optional[dict]:
+        return StateDataContext(self, chat_id=chat_id, user_id=user_id, business_connection_id=business_connection_id,
+                                message_thread_id=message_thread_id, bot_id=bot_id)
+
+    def save(self, chat_id: int, user_id: int, data: dict, business_connection_id: Optional[str] = None,
+             message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> bool:
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        with self._lock:
+            entry = self._lookup_locked(key)
+            if entry is None:
+                return False
+            entry[1] = data
+            self._dirty = True
+        return True
+
+    # --- Очистка, снимки и метрики ---
+
+    def sweep(self) -> int:
+        """
+        Удаляет истекшие записи и возвращает их количество.
+        """
+        with self._lock:
+            return self._sweep_locked()
+
+    def start_sweeper(self, interval: float = 60) -> None:
+        """
+        Запускает фоновый поток, который раз в interval секунд удаляет истекшие записи и сохраняет снимок.
+        """
+        if self._sweeper is not None or interval <= 0:
+            return
+        self._stop_event.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, args=(interval,), name="state-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop(self) -> None:
+        """
+        Останавливает фоновую очистку и сохраняет снимок.
+        """
+        self._stop_event.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+        self.save_snapshot()
+
+    def _sweep_loop(self, interval: float) -> None:
+        while not self._stop_event.wait(interval):
+            removed = self.sweep()
+            if removed:
+                logger.debug(f"Удалено истекших состояний: {removed}.")
+            self.save_snapshot()
+
+    def save_snapshot(self) -> None:
+        """
+        Записывает живые состояния в snapshot_path (атомарно), если с прошлого снимка были изменения.
+        """
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._sweep_locked()
+            snapshot = [[key, state, data, last_access] for key, (state, data, last_access) in self._entries.items()]
+            self._dirty = False
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(snapshot, file)
+            os.replace(tmp_path, self.snapshot_path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Не удалось сохранить снимок состояний в {self.snapshot_path}: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def _load_snapshot(self) -> None:
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as file:
+                snapshot = json.load(file)
+            now = time.time()
+            for key, state, data, last_access in snapshot:
+                entry = [state, data, last_access]
+                if not self._is_expired(entry, now):
+                    self._entries[key] = entry
+            self._evict_locked()
+            logger.info(f"Восстановлено состояний из {self.snapshot_path}: {len(self._entries)}.")
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Не удалось загрузить снимок состояний из {self.snapshot_path}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "live": len(self._entries),
+                "expired": self.expired_count,
+                "evicted": self.evicted_count,
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __str__(self) -> str:
+        return f"<TTLStateStorage: {self.stats()}>"
+
+
+class AsyncTTLStateStorage(AsyncStateStorageBase):
+    """
+    Адаптер TTLStateStorage для AsyncTeleBot. Все операции выполняются в памяти
+    и не блокируют цикл событий, поэтому просто делегируются синхронному хранилищу.
+    """
+
+    def __init__(self, storage: TTLStateStorage):
+        self.storage = storage
+
+    async def set_state(self, chat_id, user_id, state, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self.storage.set_state(chat_id, user_id, state, business_connection_id, message_thread_id, bot_id)
+
+    async def get_state(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self.storage.get_state(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+
+    async def delete_state(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self.storage.delete_state(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+
+    async def set_data(self, chat_id, user_id, key, value, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self.storage.set_data(chat_id, user_id, key, value, business_connection_id, message_thread_id, bot_id)
+
+    async def get_data(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self.storage.get_data(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+
+    async def reset_data(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self.storage.reset_data(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+
+    def get_interactive_data(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return AsyncStateDataContext(self, chat_id=chat_id, user_id=user_id, business_connection_id=business_connection_id,
+                                     message_thread_id=message_thread_id, bot_id=bot_id)
+
+    async def save(self, chat_id, user_id, data, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self.storage.save(chat_id, user_id, data, business_connection_id, message_thread_id, bot_id)
+
+    def __str__(self) -> str:
+        return f"<AsyncTTLStateStorage: {self.storage.stats()}>"
@@ -0,0 +1,116 @@
+# Файл: webhook.py
+"""
+Прием обновлений через webhook: небольшой HTTP-сервер на стандартной библиотеке,
+который передает JSON-обновления в bot.process_new_updates.
+"""
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import TeleBot, types
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class _WebhookRequestHandler(BaseHTTPRequestHandler):
+    server: "WebhookServer"
+
+    def log_message(self, format, *args):
+        # Стандартный вывод http.server в stderr заменяем на логгер приложения
+        logger.debug("Webhook %s - %s", self.address_string(), format % args)
+
+    def _reply(self, status: int, body: bytes = b"") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(405, b"Method Not Allowed")
+
+    def do_POST(self):
+        webhook = self.server
+        if self.path.split("?", 1)[0] != webhook.path:
+            self._reply(404, b"Not Found")
+            return
+
+        if webhook.secret_token:
+            received_token = self.headers.get(SECRET_TOKEN_HEADER, "")
+            if not hmac.compare_digest(received_token.encode("utf-8"), webhook.secret_token.encode("utf-8")):
+                logger.warning(f"Webhook: запрос с неверным секретным токеном от {self.client_address[0]}")
+                self._reply(401, b"Unauthorized")
+                return
+
+        try:
+            content_length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._reply(411, b"Length Required")
+            return
+        if content_length < 0 or content_length > webhook.max_body_bytes:
+            logger.warning(f"Webhook: тело запроса {content_length} байт превышает лимит {webhook.max_body_bytes}")
+            self._reply(413, b"Payload Too Large")
+            # Тело не читаем, поэтому соединение нельзя переиспользовать
+            self.close_connection = True
+            return
+
+        try:
+            update_json = json.loads(self.rfile.read(content_length).decode("utf-8"))
+            update = webhook.parse_update(update_json)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Webhook: не удалось разобрать обновление: {e}")
+            self._reply(400, b"Bad Request")
+            return
+
+        webhook.process_update(update)
+        self._reply(200, b"OK")
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    HTTP-сервер для приема обновлений Telegram.
+
+    Каждый запрос обрабатывается в отдельном потоке, а сами команды выполняются
+    в пуле потоков бота (bot.threaded), поэтому обновления обрабатываются параллельно.
+    """
+    daemon_threads = True
+
+    def __init__(self, bot: TeleBot, host: str, port: int, path: str = "/webhook",
+                 secret_token: str | None = None, max_body_bytes: int = 1024 * 1024):
+        self.bot = bot
+        self.path = path if path.startswith("/") else f"/{path}"
+        self.secret_token = secret_token or None
+        self.max_body_bytes = max_body_bytes
+        self._thread: threading.Thread | None = None
+        super().__init__((host, port), _WebhookRequestHandler)
+
+    def parse_update(self, update_json):
+        return types.Update.de_json(update_json)
+
+    def process_update(self, update) -> None:
+        # Отвечаем сразу: обработка идет в пуле потоков бота, Telegram не ждет выполнения команд
+        self.bot.process_new_updates([update])
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> None:
+        """
+        Запускает сервер в фоновом потоке (удобно для тестов и встраивания).
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="webhook-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Webhook-сервер слушает {self.server_address[0]}:{self.port}{self.path}")
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        logger.info("Webhook-сервер остановлен.")
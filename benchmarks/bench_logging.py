@@ -0,0 +1,120 @@
+# Файл: benchmarks/bench_logging.py
+"""
+Замеряет, сколько времени поток обработчика тратит на одну запись в лог.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_logging [--count 2000] [--gap-ms 1]
+
+Сравниваются синхронные FileHandler + StreamHandler (как было раньше) и конвейер
+QueueHandler/QueueListener из app.bot_logging. Консольный вывод направляется в /dev/null,
+файл пишется во временный каталог. Отдельно замеряется отфильтрованный DEBUG:
+f-строка против ленивого форматирования через %s.
+"""
+import argparse
+import logging
+import logging.handlers
+import os
+import queue
+import tempfile
+import time
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+SAMPLE_CODES = ["4006381333931", "5901234123457", "4600051000057"] * 10
+
+
+def build_sync_logger(log_dir: str, devnull) -> tuple[logging.Logger, list[logging.Handler]]:
+    handlers = [logging.FileHandler(os.path.join(log_dir, "sync.log"), encoding='utf-8'), logging.StreamHandler(devnull)]
+    return _make_logger("bench.sync", handlers), handlers
+
+
+def build_queue_logger(log_dir: str, devnull) -> tuple[logging.Logger, logging.handlers.QueueListener]:
+    targets = [
+        logging.handlers.RotatingFileHandler(os.path.join(log_dir, "queue.log"), maxBytes=10 * 1024 * 1024,
+                                             backupCount=2, encoding='utf-8'),
+        logging.StreamHandler(devnull),
+    ]
+    for handler in targets:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *targets, respect_handler_level=True)
+    listener.start()
+    return _make_logger("bench.queue", [logging.handlers.QueueHandler(log_queue)]), listener
+
+
+def _make_logger(name: str, handlers: list[logging.Handler]) -> logging.Logger:
+    bench_logger = logging.getLogger(name)
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+    for handler in handlers:
+        if handler.formatter is None:
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        bench_logger.addHandler(handler)
+    return bench_logger
+
+
+def time_info(bench_logger: logging.Logger, count: int, gap: float) -> list[float]:
+    """
+    Задержка каждого вызова logger.info. Между вызовами пауза gap секунд, как между
+    сообщениями от пользователей: фоновый поток успевает писать в промежутках.
+    """
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        bench_logger.info("Admin %s added by %s", i, 42)
+        latencies.append(time.perf_counter() - started)
+        if gap:
+            time.sleep(gap)
+    return latencies
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def time_filtered_debug(bench_logger: logging.Logger, count: int, lazy: bool) -> float:
+    user_id = 42
+    started = time.perf_counter()
+    if lazy:
+        for _ in range(count):
+            bench_logger.debug("Parsed codes for user %s: %s", user_id, SAMPLE_CODES)
+    else:
+        for _ in range(count):
+            bench_logger.debug(f"Parsed codes for user {user_id}: {SAMPLE_CODES}")
+    return (time.perf_counter() - started) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000, help="количество записей в каждом замере")
+    parser.add_argument("--gap-ms", type=float, default=1.0, help="пауза между записями, мс (0 — сплошной поток)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir, open(os.devnull, "w") as devnull:
+        sync_logger, sync_handlers = build_sync_logger(log_dir, devnull)
+        queue_logger, listener = build_queue_logger(log_dir, devnull)
+
+        gap = args.gap_ms / 1000
+        sync_latencies = time_info(sync_logger, args.count, gap)
+        queue_latencies = time_info(queue_logger, args.count, gap)
+        drain_started = time.perf_counter()
+        listener.stop() # дожидаемся, пока фоновый поток допишет очередь
+        drain_time = time.perf_counter() - drain_started
+        for handler in sync_handlers:
+            handler.close()
+
+        fstring_time = time_filtered_debug(queue_logger, args.count, lazy=False)
+        lazy_time = time_filtered_debug(queue_logger, args.count, lazy=True)
+
+    for title, latencies in (("синхронные обработчики", sync_latencies), ("QueueHandler", queue_latencies)):
+        print(f"INFO, {title:<22}: медиана {percentile(latencies, 0.5) * 1e6:7.2f} мкс, "
+              f"p99 {percentile(latencies, 0.99) * 1e6:8.2f} мкс, максимум {max(latencies) * 1e6:8.2f} мкс")
+    saved = percentile(sync_latencies, 0.5) - percentile(queue_latencies, 0.5)
+    print(f"  экономия на сообщение (медиана): {saved * 1e6:.2f} мкс")
+    print(f"  фоновая дозапись очереди после замера: {drain_time * 1000:.1f} мс")
+    print(f"DEBUG отфильтрован, f-строка: {fstring_time * 1e6:8.3f} мкс/вызов")
+    print(f"DEBUG отфильтрован, %s:       {lazy_time * 1e6:8.3f} мкс/вызов")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Файл: benchmarks/bench_parse.py
+"""
+Замеряет разбор большого списка кодов, вставленного пользователем в ответ на /codes.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_parse [--count 100000] [--repeat 5]
+
+Сравниваются прежний разбор (цепочка replace + split, без проверки контрольной цифры
+и без удаления повторов), однопроходный parse_codes на чистом Python и его вариант
+с NumPy (если установлен). Во вставке есть 12-значные коды, коды с неверной
+контрольной цифрой, повторы и мусор.
+"""
+import argparse
+import random
+import time
+
+from app.utils.barcode_utils import load_numpy, normalize_ean13, parse_codes
+
+
+def legacy_parse_codes_input(text_input: str) -> list[str]:
+    # Прежняя реализация parse_codes_input (без логирования отброшенных токенов)
+    normalized_text = text_input.replace(',', ' ').replace('\n', ' ')
+    potential_codes = [code.strip() for code in normalized_text.split(' ') if code.strip()]
+    return [code for code in potential_codes if code.isdigit() and (len(code) == 12 or len(code) == 13)]
+
+
+def build_paste(count: int, seed: int = 13) -> str:
+    rnd = random.Random(seed)
+    tokens = []
+    for _ in range(count):
+        kind = rnd.random()
+        code = normalize_ean13("".join(rnd.choice("0123456789") for _ in range(12)))
+        if kind < 0.70:
+            tokens.append(code)
+        elif kind < 0.80:
+            tokens.append(code[:12])
+        elif kind < 0.85:
+            tokens.append(f"{code[:12]}{(int(code[12]) + 1) % 10}")
+        elif kind < 0.95 and tokens:
+            tokens.append(rnd.choice(tokens))
+        else:
+            tokens.append(rnd.choice(["abc", "12345", "40063813339310", "n/a"]))
+    separators = [" ", ", ", "\n", ";"]
+    return "".join(f"{token}{rnd.choice(separators)}" for token in tokens)
+
+
+def best_time(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=100000, help="количество токенов во вставке")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов каждого замера (берется лучший)")
+    args = parser.parse_args()
+
+    paste = build_paste(args.count)
+    report = parse_codes(paste, use_numpy=False)
+    print(f"Вставка: {args.count} токенов, {len(paste) / 1024:.0f} КБ. Принято {len(report.codes)}, "
+          f"дополнено {len(report.fixed)}, неверная контрольная цифра {len(report.bad_checksum)}, "
+          f"не распознано {len(report.rejected)}, повторов {report.duplicates}.")
+
+    variants = [
+        ("прежний replace + split", lambda: legacy_parse_codes_input(paste)),
+        ("parse_codes, Python", lambda: parse_codes(paste, use_numpy=False)),
+    ]
+    if load_numpy() is not None:
+        if parse_codes(paste, use_numpy=True) != report:
+            raise SystemExit("Результаты NumPy и Python различаются")
+        variants.append(("parse_codes, NumPy", lambda: parse_codes(paste, use_numpy=True)))
+    else:
+        print("NumPy не установлен, векторный вариант пропущен.")
+
+    for title, func in variants:
+        elapsed = best_time(func, args.repeat)
+        print(f"{title:<24}: {elapsed * 1000:8.1f} мс, {elapsed / args.count * 1e9:6.0f} нс/токен")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# Файл: benchmarks/bench_prerender.py
+"""
+Замеряет фоновую отрисовку списков после /codes: долю /gen без аргументов, которые получили
+готовое изображение, и задержку /gen других пользователей, пока идет фоновая отрисовка.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_prerender [--users 3] [--codes 50] [--think 5] [--gens 5]
+                                         [--budgets 0,0.25,1] [--set KEY=VALUE]
+
+Для каждого значения PRERENDER_CPU_BUDGET (0 — фоновая отрисовка выключена) main.py запускается
+в новом каталоге против tools/fake_bot_api:
+1. users пользователей загружают через /codes по codes новых кодов;
+2. пока пользователи читают ответ (think секунд), другие пользователи отправляют /gen <новый код>
+   с частотой --rate в секунду — это задержка интерактивных запросов во время фоновой отрисовки;
+3. затем каждый пользователь отправляет gens раз /gen без аргументов.
+
+Доля готовых изображений — попадания в кэш (bot_render_cache_total) среди /gen из шага 3,
+по /metrics бота; повторно выпавшие коды уходят по file_id без отрисовки и не учитываются.
+"""
+import argparse
+import itertools
+import os
+import random
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import deque
+from typing import NamedTuple
+
+from tools.fake_bot_api import FakeBotApiServer
+from tools.load_test import (
+    DEFAULT_CONFIG_PATH,
+    FIRST_SPAMMER_ID,
+    FIRST_USER_ID,
+    ean13,
+    make_message_update,
+    percentile,
+    start_bot,
+    stop_bot,
+    wait_for_polling,
+    write_bot_config,
+)
+
+DEFAULT_BUDGETS = "0,0.25,1"
+FIRST_INTERACTIVE_ID = FIRST_SPAMMER_ID - 1_000_000 # Пользователи шага 2, тоже администраторы
+INTERACTIVE_USERS = 20
+GEN_INTERVAL = 1.1 # Пауза между /gen одного пользователя: больше лимита исходящих сообщений в личный чат
+REPLY_TIMEOUT = 60
+METRIC_LINE = re.compile(r'^(\w+)\{([^}]*)\} ([\d.e+-]+)$')
+
+
+class PrerenderResult(NamedTuple):
+    budget: float
+    list_gens: int # /gen без аргументов, отправленные на шаге 3
+    list_hits: int # Из них получили изображение из кэша
+    list_latency: list[float]
+    interactive_latency: list[float]
+    prerendered: int # bot_prerender_total{result="rendered"}
+
+
+class GenClock:
+    """
+    Задержка от постановки /gen до sendPhoto в тот же чат (ответы в чат приходят по порядку).
+    """
+
+    def __init__(self, server: FakeBotApiServer):
+        self.server = server
+        self._lock = threading.Lock()
+        self._pending: dict[int, deque[tuple[float, str]]] = {}
+        self.latencies: dict[str, list[float]] = {}
+        self.messages = itertools.count(1)
+
+    def push(self, kind: str, user_id: int, text: str) -> None:
+        if text.startswith("/gen"):
+            with self._lock:
+                self._pending.setdefault(user_id, deque()).append((time.perf_counter(), kind))
+        self.server.push_updates([make_message_update(next(self.messages), user_id, text)])
+
+    def on_call(self, method: str, params: dict) -> None:
+        if method != "sendPhoto" or not params.get("chat_id"):
+            return
+        with self._lock:
+            pending = self._pending.get(int(params["chat_id"]))
+            if not pending:
+                return
+            pushed_at, kind = pending.popleft()
+            self.latencies.setdefault(kind, []).append(time.perf_counter() - pushed_at)
+
+    def wait(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not any(self._pending.values()):
+                    return
+            time.sleep(0.05)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_counters(port: int, name: str) -> dict[str, float]:
+    """
+    Значения счетчика name с /metrics бота по значению метки result.
+    """
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        text = response.read().decode("utf-8")
+    values = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match and match.group(1) == name:
+            labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2)))
+            values[labels.get("result", "")] = values.get(labels.get("result", ""), 0) + float(match.group(3))
+    return values
+
+
+def run_budget(budget: float, args) -> PrerenderResult:
+    rng = random.Random(args.seed)
+    new_code = lambda: ean13("".join(rng.choice("0123456789") for _ in range(12)))
+    server = FakeBotApiServer()
+    clock = GenClock(server)
+    server.on_call = clock.on_call
+    server.start()
+    work_dir = tempfile.mkdtemp(prefix="bot-prerender-")
+    metrics_port = free_port()
+    bot_process = None
+    list_users = [FIRST_USER_ID + index for index in range(args.users)]
+    interactive_users = [FIRST_INTERACTIVE_ID + index for index in range(INTERACTIVE_USERS)]
+    try:
+        config_path = os.path.join(work_dir, "config.ini")
+        overrides = [f"PRERENDER_CPU_BUDGET={budget}", "METRICS_ENABLED=1", f"METRICS_PORT={metrics_port}",
+                     "BARCODE_CACHE_DIR="] + args.overrides
+        write_bot_config(config_path, server, set(list_users + interactive_users), overrides, args.config)
+        bot_process = start_bot(work_dir, config_path)
+        wait_for_polling(server, bot_process)
+        time.sleep(args.settle) # Прогрев (PREWARM_DELAY) не должен попасть в замер
+
+        for user_id in list_users:
+            clock.push("codes", user_id, "/codes")
+            clock.push("codes", user_id, "\n".join(new_code() for _ in range(args.codes)))
+
+        think_until = time.monotonic() + args.think
+        for user_id in itertools.cycle(interactive_users):
+            if time.monotonic() >= think_until:
+                break
+            clock.push("interactive", user_id, f"/gen {new_code()}")
+            time.sleep(1 / args.rate)
+        clock.wait(REPLY_TIMEOUT)
+
+        before = read_counters(metrics_port, "bot_render_cache_total")
+        for _ in range(args.gens):
+            for user_id in list_users:
+                clock.push("list", user_id, "/gen")
+            time.sleep(GEN_INTERVAL)
+        clock.wait(REPLY_TIMEOUT)
+        after = read_counters(metrics_port, "bot_render_cache_total")
+        prerendered = read_counters(metrics_port, "bot_prerender_total").get("rendered", 0)
+    finally:
+        if bot_process is not None:
+            stop_bot(bot_process)
+        server.stop()
+        if args.keep_dir:
+            print(f"Рабочий каталог бота (бюджет {budget}): {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    hits = after.get("hit", 0) - before.get("hit", 0)
+    misses = after.get("miss", 0) - before.get("miss", 0)
+    return PrerenderResult(budget, int(hits + misses), int(hits), sorted(clock.latencies.get("list", [])),
+                           sorted(clock.latencies.get("interactive", [])), int(prerendered))
+
+
+def _ms(sorted_values: list[float], share: float) -> str:
+    value = percentile(sorted_values, share)
+    return f"{value * 1000:.0f} мс" if value is not None else "—"
+
+
+def print_results(results: list[PrerenderResult]) -> None:
+    print(f"{'бюджет':<8} {'в фоне':>7} {'готовых /gen':>13} {'/gen p50':>9} {'/gen p95':>9} "
+          f"{'другие p50':>11} {'другие p95':>11}")
+    for result in results:
+        budget = f"{result.budget:g}" if result.budget > 0 else "выкл"
+        ready = f"{result.list_hits}/{result.list_gens}" if result.list_gens else "—"
+        print(f"{budget:<8} {result.prerendered:>7} {ready:>13} {_ms(result.list_latency, 0.5):>9} "
+              f"{_ms(result.list_latency, 0.95):>9} {_ms(result.interactive_latency, 0.5):>11} "
+              f"{_ms(result.interactive_latency, 0.95):>11}")
+    print("\nготовых /gen — /gen без аргументов, получившие изображение из кэша; другие — /gen <новый код>"
+          "\nдругих пользователей, отправленные во время фоновой отрисовки.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=3, help="пользователей, загружающих списки")
+    parser.add_argument("--codes", type=int, default=50, help="кодов в списке пользователя")
+    parser.add_argument("--think", type=float, default=5, help="секунд между загрузкой списков и /gen")
+    parser.add_argument("--gens", type=int, default=5, help="/gen без аргументов на пользователя")
+    parser.add_argument("--rate", type=float, default=5, help="/gen <код> других пользователей в секунду")
+    parser.add_argument("--settle", type=float, default=3, help="секунд после запуска бота до замера")
+    parser.add_argument("--budgets", default=DEFAULT_BUDGETS, help=f"PRERENDER_CPU_BUDGET через запятую ({DEFAULT_BUDGETS})")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--config", default=DEFAULT_CONFIG_PATH, help="базовый config.ini бота")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределить параметр бота, можно повторять")
+    parser.add_argument("--keep-dir", action="store_true", help="не удалять рабочие каталоги бота")
+    args = parser.parse_args()
+
+    results = [run_budget(float(budget), args) for budget in args.budgets.split(",") if budget.strip()]
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# Файл: benchmarks/bench_recovery.py
+"""
+Замеряет восстановление после простоя (деплоя): бот запускается, когда в getUpdates уже ждет
+очередь старых сообщений, а следом за ней — свежее сообщение нового запроса.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_recovery [--users 10] [--retries 5] [--distinct 3] [--age 900]
+                                        [--policies keep,drop,collapse] [--set KEY=VALUE]
+
+Очередь: каждый из users пользователей во время простоя (age секунд назад) повторял один и тот же
+/gen retries раз и отправил distinct разных /gen. Для каждой политики UPDATES_STALE_POLICY main.py
+запускается в новом каталоге против tools/fake_bot_api и замеряются (от запуска процесса):
+- ответ на свежее сообщение, пришедшее после очереди;
+- отправка последнего ответа на накопившиеся сообщения;
+- время разбора очереди по логу бота (UpdatePoller) и сохраненный номер последнего обновления.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import NamedTuple
+
+from tools.fake_bot_api import FakeBotApiServer
+from tools.load_test import (
+    DEFAULT_CONFIG_PATH,
+    FIRST_USER_ID,
+    REPLY_METHODS,
+    ean13,
+    make_message_update,
+    start_bot,
+    stop_bot,
+    wait_for_polling,
+    write_bot_config,
+)
+
+DEFAULT_POLICIES = "keep,drop,collapse"
+PROBE_USER_ID = FIRST_USER_ID - 1
+DRAIN_TIMEOUT = 120 # Сколько ждать ответов на всю очередь, секунды
+QUIET_SECONDS = 3 # Без новых ответов столько секунд — очередь считается разобранной
+CATCHUP_LOG_PATTERN = re.compile(r"Очередь обновлений после запуска разобрана за ([\d.]+) с: получено (\d+), "
+                                 r"отброшено устаревших (\d+)")
+
+
+class RecoveryResult(NamedTuple):
+    policy: str
+    backlog: int # Обновлений в очереди вместе со свежим
+    replies: int # Ответов пользователям очереди
+    first_poll: float # Первый getUpdates, секунды от запуска процесса
+    probe_reply: float | None # Ответ на свежее сообщение
+    last_reply: float | None # Последний ответ на очередь
+    catchup: float | None # Разбор очереди по логу бота
+    dropped: int | None # Отброшено устаревших по логу бота
+    offset_saved: bool # update_offset.json содержит номер последнего обновления
+
+
+class ReplyClock:
+    """
+    Время ответов заглушки Bot API по чатам, от момента start().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.replies: dict[int, list[float]] = {}
+
+    def start(self) -> None:
+        with self._lock:
+            self.started = time.perf_counter()
+            self.replies.clear()
+
+    def on_call(self, method: str, params: dict) -> None:
+        if method not in REPLY_METHODS or not params.get("chat_id"):
+            return
+        with self._lock:
+            self.replies.setdefault(int(params["chat_id"]), []).append(time.perf_counter() - self.started)
+
+    def snapshot(self) -> dict[int, list[float]]:
+        with self._lock:
+            return {chat_id: list(times) for chat_id, times in self.replies.items()}
+
+
+def build_backlog(users: int, retries: int, distinct: int, age: float) -> list[dict]:
+    """
+    Сообщения простоя по очереди от всех пользователей, самые старые первыми, и свежее сообщение в конце.
+    """
+    now = int(time.time())
+    message_id = 0
+    backlog = []
+    for step in range(retries + distinct):
+        for user_index in range(users):
+            user_id = FIRST_USER_ID + user_index
+            # Первые retries сообщений повторяют один код, остальные — разные коды
+            code_number = user_index * 1000 + (0 if step < retries else step)
+            message_id += 1
+            update = make_message_update(message_id, user_id, f"/gen {ean13(f'{code_number:012d}')}")
+            update["message"]["date"] = now - int(age) + step
+            backlog.append(update)
+    backlog.append(make_message_update(message_id + 1, PROBE_USER_ID, f"/gen {ean13('999999999999')}"))
+    return backlog
+
+
+def wait_for_replies(clock: ReplyClock, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    last_count, last_change = -1, time.monotonic()
+    while time.monotonic() < deadline:
+        count = sum(len(times) for times in clock.snapshot().values())
+        if count != last_count:
+            last_count, last_change = count, time.monotonic()
+        elif PROBE_USER_ID in clock.snapshot() and time.monotonic() - last_change >= QUIET_SECONDS:
+            return
+        time.sleep(0.1)
+
+
+def read_catchup_log(work_dir: str) -> tuple[float | None, int | None]:
+    try:
+        with open(os.path.join(work_dir, "app.log"), encoding="utf-8", errors="replace") as file:
+            match = CATCHUP_LOG_PATTERN.search(file.read())
+    except OSError:
+        return None, None
+    if match is None:
+        return None, None
+    return float(match.group(1)), int(match.group(3))
+
+
+def read_saved_offset(work_dir: str) -> int | None:
+    try:
+        with open(os.path.join(work_dir, "update_offset.json"), encoding="utf-8") as file:
+            return int(json.load(file)["last_update_id"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def run_policy(policy: str, args) -> RecoveryResult:
+    clock = ReplyClock()
+    server = FakeBotApiServer()
+    server.on_call = clock.on_call
+    server.start()
+    work_dir = tempfile.mkdtemp(prefix="bot-recovery-")
+    bot_process = None
+    try:
+        backlog = build_backlog(args.users, args.retries, args.distinct, args.age)
+        update_ids = server.push_updates(backlog)
+        admin_ids = {PROBE_USER_ID} | {FIRST_USER_ID + index for index in range(args.users)}
+        config_path = os.path.join(work_dir, "config.ini")
+        overrides = ["LOG_LEVEL=INFO", f"UPDATES_STALE_POLICY={policy}",
+                     f"UPDATES_STALE_SECONDS={args.stale_seconds}"] + args.overrides
+        write_bot_config(config_path, server, admin_ids, overrides, args.config)
+
+        clock.start()
+        bot_process = start_bot(work_dir, config_path)
+        wait_for_polling(server, bot_process)
+        first_poll = time.perf_counter() - clock.started
+        wait_for_replies(clock, DRAIN_TIMEOUT)
+    finally:
+        if bot_process is not None:
+            stop_bot(bot_process)
+        server.stop()
+
+    replies = clock.snapshot()
+    probe_times = replies.pop(PROBE_USER_ID, [])
+    backlog_times = [reply_time for times in replies.values() for reply_time in times]
+    catchup, dropped = read_catchup_log(work_dir)
+    offset_saved = read_saved_offset(work_dir) == update_ids[-1]
+    if args.keep_dir:
+        print(f"Рабочий каталог бота ({policy}): {work_dir}", file=sys.stderr)
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return RecoveryResult(policy, len(backlog), len(backlog_times), first_poll,
+                          min(probe_times) if probe_times else None, max(backlog_times) if backlog_times else None,
+                          catchup, dropped, offset_saved)
+
+
+def _seconds(value: float | None) -> str:
+    return f"{value:.2f} с" if value is not None else "—"
+
+
+def print_results(results: list[RecoveryResult]) -> None:
+    print(f"{'политика':<10} {'очередь':>8} {'отброшено':>10} {'ответов':>8} {'опрос':>8} {'разбор':>8} "
+          f"{'свежее':>9} {'вся очередь':>12}  offset")
+    for result in results:
+        dropped = str(result.dropped) if result.dropped is not None else "—"
+        print(f"{result.policy:<10} {result.backlog:>8} {dropped:>10} {result.replies:>8} "
+              f"{_seconds(result.first_poll):>8} {_seconds(result.catchup):>8} {_seconds(result.probe_reply):>9} "
+              f"{_seconds(result.last_reply):>12}  {'сохранен' if result.offset_saved else 'НЕТ'}")
+    print("\nопрос — первый getUpdates, разбор — получение очереди по логу бота, свежее — ответ на сообщение"
+          "\nпосле очереди, вся очередь — последний ответ на накопившиеся сообщения; время от запуска процесса.")
+    probe_times = [result.probe_reply for result in results if result.probe_reply is not None]
+    if len(probe_times) > 1:
+        print(f"Медиана ответа на свежее сообщение: {statistics.median(probe_times):.2f} с.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="пользователей с сообщениями в очереди")
+    parser.add_argument("--retries", type=int, default=5, help="повторов одного /gen на пользователя")
+    parser.add_argument("--distinct", type=int, default=3, help="разных /gen на пользователя")
+    parser.add_argument("--age", type=float, default=900, help="возраст сообщений очереди, секунды")
+    parser.add_argument("--stale-seconds", type=int, default=300, help="UPDATES_STALE_SECONDS для замера")
+    parser.add_argument("--policies", default=DEFAULT_POLICIES, help=f"политики через запятую ({DEFAULT_POLICIES})")
+    parser.add_argument("--config", default=DEFAULT_CONFIG_PATH, help="базовый config.ini бота")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="переопределить параметр бота, можно повторять")
+    parser.add_argument("--keep-dir", action="store_true", help="не удалять рабочие каталоги бота")
+    args = parser.parse_args()
+
+    results = []
+    for policy in filter(None, (part.strip() for part in args.policies.split(","))):
+        results.append(run_policy(policy, args))
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Файл: benchmarks/bench_render.py
+"""
+Сравнивает движки отрисовки EAN-13: python-barcode ImageWriter и быстрый растеризатор.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_render [--count 300]
+
+Кэш не используется: замеряется чистая отрисовка + кодирование PNG. Перед замером
+проверяется, что изображения обоих движков совпадают попиксельно.
+"""
+import argparse
+import random
+import time
+from io import BytesIO
+
+from PIL import Image, ImageChops
+
+from app.utils.barcode_utils import ENGINE_FAST, ENGINE_IMAGEWRITER, normalize_ean13, render_ean13_png
+
+
+def random_codes(count: int, seed: int = 13) -> list[str]:
+    rnd = random.Random(seed)
+    return [normalize_ean13("".join(rnd.choice("0123456789") for _ in range(12))) for _ in range(count)]
+
+
+def check_pixel_equivalence(codes: list[str]) -> int:
+    """
+    Возвращает количество кодов, для которых изображения движков отличаются.
+    """
+    mismatches = 0
+    for code in codes:
+        reference = Image.open(BytesIO(render_ean13_png(code, engine=ENGINE_IMAGEWRITER))).convert("L")
+        fast = Image.open(BytesIO(render_ean13_png(code, engine=ENGINE_FAST))).convert("L")
+        if reference.size != fast.size or ImageChops.difference(reference, fast).getbbox() is not None:
+            mismatches += 1
+            print(f"  отличие для {code}")
+    return mismatches
+
+
+def time_engine(engine: str, codes: list[str]) -> float:
+    render_ean13_png(codes[0], engine=engine)  # прогрев: шрифты, плитки глифов
+    started = time.perf_counter()
+    for code in codes:
+        render_ean13_png(code, engine=engine)
+    return (time.perf_counter() - started) / len(codes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=300, help="количество случайных кодов")
+    args = parser.parse_args()
+
+    codes = random_codes(args.count)
+    mismatches = check_pixel_equivalence(codes[:50])
+    print(f"Попиксельная проверка (50 кодов): {'OK' if not mismatches else f'{mismatches} отличий'}")
+
+    imagewriter_time = time_engine(ENGINE_IMAGEWRITER, codes)
+    fast_time = time_engine(ENGINE_FAST, codes)
+    print(f"{ENGINE_IMAGEWRITER:>12}: {imagewriter_time * 1000:.3f} мс/код")
+    print(f"{ENGINE_FAST:>12}: {fast_time * 1000:.3f} мс/код")
+    print(f"Ускорение: {imagewriter_time / fast_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# Файл: benchmarks/bench_startup.py
+"""
+Замеряет холодный старт: импорт пакета app, сборку бота create_app() и фоновый прогрев.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_startup [--repeat 5] [--top 10] [--against HEAD~1]
+
+Каждый сценарий выполняется в новом интерпретаторе во временном каталоге (data.json, логи и
+снимки состояний пишутся туда, уровень логирования WARNING). Время — медиана repeat запусков
+без трассировки; разбивка по пакетам — из отдельного запуска с -X importtime (сумма собственного
+времени импорта модулей, сгруппированная по пакету верхнего уровня).
+
+С --against REV та же ревизия извлекается во временный git worktree и для нее замеряется
+`import app` (до фабрики приложения импорт пакета собирал бота целиком).
+
+PIL.Image и asyncio в разбивке create_app() импортирует сам pyTelegramBotAPI (telebot.util и
+telebot.asyncio_storage); код бота загружает python-barcode, Pillow и NumPy только при отрисовке.
+"""
+import argparse
+import configparser
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from typing import NamedTuple
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_SECTION_NAME = "Settings"
+CONFIG_ENV_VAR = "BOT_CONFIG" # См. app/config.py
+RESULT_PREFIX = "STARTUP_RESULT "
+
+# Сценарии печатают время в секундах и выходят через os._exit: потоки бота не задерживают замер
+IMPORT_APP = """
+import time
+started = time.perf_counter()
+import app
+print("{prefix}" + str(time.perf_counter() - started), flush=True)
+"""
+CREATE_APP = """
+import time
+started = time.perf_counter()
+from app.factory import create_app
+application = create_app()
+print("{prefix}" + str(time.perf_counter() - started), flush=True)
+application.shutdown()
+"""
+PREWARM = """
+import time
+from app.factory import create_app, prewarm
+application = create_app()
+started = time.perf_counter()
+prewarm(application.bot)
+print("{prefix}" + str(time.perf_counter() - started), flush=True)
+application.shutdown()
+"""
+SCENARIOS = (
+    ("import app", IMPORT_APP),
+    ("create_app()", CREATE_APP),
+    ("prewarm() в фоне", PREWARM),
+)
+
+
+class Measurement(NamedTuple):
+    seconds: float # Медиана времени сценария
+    import_us: int # Сумма собственного времени импорта по -X importtime
+    packages: dict[str, int] # Собственное время импорта по пакетам верхнего уровня, мкс
+
+
+def write_config(work_dir: str) -> str:
+    config_parser = configparser.ConfigParser()
+    config_parser.read(os.path.join(REPO_DIR, "config.ini.default"), encoding="utf-8")
+    if not config_parser.has_section(CONFIG_SECTION_NAME):
+        config_parser.add_section(CONFIG_SECTION_NAME)
+    for key, value in (("TOKEN", "1:startup-bench"), ("LOG_LEVEL", "WARNING"), ("METRICS_PORT", "0")):
+        config_parser.set(CONFIG_SECTION_NAME, key, value)
+    config_path = os.path.join(work_dir, "config.ini")
+    with open(config_path, "w", encoding="utf-8") as file:
+        config_parser.write(file)
+    return config_path
+
+
+def run_scenario(code: str, source_dir: str, work_dir: str, config_path: str,
+                 importtime: bool = False) -> tuple[float, str]:
+    """
+    Выполняет сценарий в новом интерпретаторе. Возвращает (секунды, stderr).
+    """
+    env = dict(os.environ, PYTHONPATH=source_dir, PYTHONDONTWRITEBYTECODE="1", **{CONFIG_ENV_VAR: config_path})
+    command = [sys.executable] + (["-X", "importtime"] if importtime else [])
+    command += ["-c", code.format(prefix=RESULT_PREFIX) + "import os\nos._exit(0)\n"]
+    completed = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True, timeout=300)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return float(line[len(RESULT_PREFIX):]), completed.stderr
+    raise RuntimeError(f"Сценарий завершился без результата (код {completed.returncode}):\n{completed.stderr[-2000:]}")
+
+
+def parse_importtime(stderr: str) -> tuple[int, dict[str, int]]:
+    """
+    Сумма собственного времени импорта и его разбивка по пакетам верхнего уровня.
+
+    Формат строк: "import time:      self [us] |   cumulative | imported package".
+    """
+    packages = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue # Заголовок таблицы
+        packages[fields[2].strip().split(".")[0]] += int(fields[0])
+    return sum(packages.values()), dict(packages)
+
+
+def measure(code: str, source_dir: str, config_path: str, repeat: int) -> Measurement:
+    timings = []
+    for _ in range(repeat):
+        # Свежий каталог на каждый запуск: data.json и кэш отрисовки не переживают замер
+        with tempfile.TemporaryDirectory(prefix="bot-startup-") as work_dir:
+            timings.append(run_scenario(code, source_dir, work_dir, config_path)[0])
+    with tempfile.TemporaryDirectory(prefix="bot-startup-") as work_dir:
+        _, stderr = run_scenario(code, source_dir, work_dir, config_path, importtime=True)
+    import_us, packages = parse_importtime(stderr)
+    return Measurement(statistics.median(timings), import_us, packages)
+
+
+def print_measurement(name: str, measurement: Measurement, top: int) -> None:
+    print(f"{name:<22} {measurement.seconds * 1000:>8.1f} мс, импорт {measurement.import_us / 1000:>7.1f} мс "
+          f"(-X importtime)")
+    ranked = sorted(measurement.packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    for package, self_us in ranked:
+        print(f"    {package:<26} {self_us / 1000:>7.1f} мс")
+
+
+def measure_revision(revision: str, config_path: str, repeat: int) -> Measurement:
+    """
+    `import app` для другой ревизии репозитория во временном git worktree.
+    """
+    worktree_parent = tempfile.mkdtemp(prefix="bot-startup-rev-")
+    worktree_dir = os.path.join(worktree_parent, "tree")
+    subprocess.run(["git", "-C", REPO_DIR, "worktree", "add", "--detach", "--quiet", worktree_dir, revision],
+                   check=True)
+    try:
+        return measure(IMPORT_APP, worktree_dir, config_path, repeat)
+    finally:
+        subprocess.run(["git", "-C", REPO_DIR, "worktree", "remove", "--force", worktree_dir], check=False)
+        shutil.rmtree(worktree_parent, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="запусков каждого сценария")
+    parser.add_argument("--top", type=int, default=10, help="сколько пакетов показывать в разбивке импорта")
+    parser.add_argument("--against", metavar="REV", help="сравнить с `import app` в другой ревизии (например, HEAD~1)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bot-startup-config-") as config_dir:
+        config_path = write_config(config_dir)
+        results = {}
+        for name, code in SCENARIOS:
+            results[name] = measure(code, REPO_DIR, config_path, args.repeat)
+            print_measurement(name, results[name], args.top)
+
+        if args.against:
+            baseline = measure_revision(args.against, config_path, args.repeat)
+            print_measurement(f"import app ({args.against})", baseline, args.top)
+            current = results["create_app()"]
+            print(f"\nЗапуск до приема обновлений: {baseline.seconds * 1000:.1f} мс -> {current.seconds * 1000:.1f} мс "
+                  f"({(1 - current.seconds / baseline.seconds) * 100:.0f}% быстрее), импорт "
+                  f"{baseline.import_us / 1000:.1f} мс -> {current.import_us / 1000:.1f} мс.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+# Файл: benchmarks/suite.py
+"""
+Набор микробенчмарков горячих путей бота с бюджетами памяти и сравнением с базовой линией.
+
+Запуск из корня проекта:
+    python -m benchmarks.suite [--quick] [--only render,parse] [--json results.json]
+    python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json [--tolerance 0.25]
+
+Для каждого замера считаются медиана и минимум времени одного вызова и пиковая память
+одного вызова по tracemalloc (отдельным прогоном: трассировка замедляет код и не должна
+попадать во время). Набор работает без сети: бот запускается во временном каталоге,
+Bot API заменен tools/fake_bot_api.
+
+Код выхода 1, если превышен бюджет памяти или медиана хуже базовой линии больше чем на
+tolerance. Базовую линию стоит сохранять на той же машине, что и последующие прогоны
+(например, до и после обновления python-barcode или Pillow).
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from importlib import metadata
+from typing import Callable, NamedTuple
+
+GROUPS = ("render", "parse", "storage", "middleware", "dispatch")
+ADMIN_ID = 900001 # Пользователь, которого набор делает администратором на время замеров
+STRANGER_ID = 900002
+USER_CODES = 20 # Кодов у одного пользователя в замерах save_json/load_json
+DEFAULT_TOLERANCE = 0.25
+RESULTS_VERSION = 1
+
+
+class Case(NamedTuple):
+    name: str
+    func: Callable[[], object]
+    budget_kib: float # Допустимая пиковая память одного вызова
+    number: int = 100 # Вызовов в одной серии
+    setup: Callable[[], None] | None = None # Перед каждым вызовом, в замер не входит
+    prepare: Callable[[], None] | None = None # Один раз перед замером
+
+
+class Result(NamedTuple):
+    median_us: float
+    min_us: float
+    peak_kib: float
+    budget_kib: float
+    calls: int
+
+    @property
+    def over_budget(self) -> bool:
+        return self.peak_kib > self.budget_kib
+
+
+def time_case(case: Case, repeat: int) -> list[float]:
+    """
+    Время одного вызова (секунды) в каждой из repeat серий.
+    """
+    samples = []
+    for _ in range(repeat):
+        if case.setup is None:
+            started = time.perf_counter()
+            for _ in range(case.number):
+                case.func()
+            samples.append((time.perf_counter() - started) / case.number)
+            continue
+        elapsed = 0.0
+        for _ in range(case.number):
+            case.setup()
+            started = time.perf_counter()
+            case.func()
+            elapsed += time.perf_counter() - started
+        samples.append(elapsed / case.number)
+    return samples
+
+
+def peak_memory_kib(case: Case) -> float:
+    """
+    Пиковый прирост памяти (КиБ) за один вызов после прогрева.
+    """
+    tracemalloc.start()
+    try:
+        if case.setup is not None:
+            case.setup()
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        case.func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(0, peak - current) / 1024
+
+
+def run_case(case: Case, repeat: int) -> Result:
+    if case.prepare is not None:
+        case.prepare()
+    if case.setup is not None:
+        case.setup()
+    case.func() # прогрев: ленивые импорты, шрифты, кэши модулей
+    samples = time_case(case, repeat)
+    return Result(statistics.median(samples) * 1e6, min(samples) * 1e6, peak_memory_kib(case), case.budget_kib,
+                  case.number * repeat)
+
+
+# --- Замеры ---
+
+def render_cases(quick: bool) -> list[Case]:
+    from app import config
+    from app.utils.barcode_utils import (
+        ENGINE_FAST, ENGINE_IMAGEWRITER, barcode_cache, configure_barcode_cache, configure_barcode_engine,
+        generate_ean13_barcode_image_bytes,
+    )
+    from .bench_render import random_codes
+
+    codes = random_codes(50)
+    cursor = itertools.count()
+
+    def cold(engine: str, budget_kib: float) -> Case:
+        def prepare():
+            # Без дискового уровня: холодный замер должен рисовать, а не читать файл
+            configure_barcode_cache(config.BARCODE_CACHE_MAX_MB * 1024 * 1024, None)
+            configure_barcode_engine(engine)
+        return Case(f"render.cold.{engine}", lambda: generate_ean13_barcode_image_bytes(codes[next(cursor) % len(codes)]),
+                    budget_kib, number=10 if quick else 30, setup=barcode_cache.clear_memory, prepare=prepare)
+
+    return [
+        cold(ENGINE_IMAGEWRITER, 256),
+        cold(ENGINE_FAST, 256),
+        Case("render.cached", lambda: generate_ean13_barcode_image_bytes(codes[0]), 8, number=2000,
+             prepare=lambda: configure_barcode_engine(config.BARCODE_ENGINE)),
+    ]
+
+
+def parse_cases(quick: bool) -> list[Case]:
+    from app.utils.barcode_utils import parse_codes_input
+    from .bench_parse import build_paste
+
+    cases = []
+    for count, number, budget_kib in ((100, 500, 64), (10_000, 10, 4096), (100_000, 2, 40960)):
+        if quick and count > 10_000:
+            continue
+        paste = build_paste(count)
+        cases.append(Case(f"parse.{count}", lambda paste=paste: parse_codes_input(paste), budget_kib, number=number))
+    return cases
+
+
+def storage_cases(quick: bool, work_dir: str) -> list[Case]:
+    from app.utils.saving_and_loading import load_json, save_json
+    from .bench_render import random_codes
+
+    codes = random_codes(USER_CODES)
+    cases = []
+    for users, number in ((1_000, 5), (10_000, 2), (100_000, 1)):
+        if quick and users > 10_000:
+            continue
+        data = {user_id: list(codes) for user_id in range(1, users + 1)}
+        path = os.path.join(work_dir, f"bench_{users}.json")
+        # json.dump пишет в файл кусками, поэтому бюджет save_json не зависит от размера; json.load строит весь словарь
+        cases.append(Case(f"storage.save_json.{users}", lambda data=data, path=path: save_json(data, path), 256,
+                          number=number))
+        cases.append(Case(f"storage.load_json.{users}", lambda path=path: load_json(path), users * 4 + 256,
+                          number=number, prepare=lambda data=data, path=path: save_json(data, path)))
+    return cases
+
+
+def make_message_update(update_id: int, user_id: int, text: str, chat_id: int | None = None):
+    from telebot import types
+
+    chat_id = user_id if chat_id is None else chat_id
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private" if chat_id == user_id else "group"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return types.Update.de_json({"update_id": update_id, "message": message})
+
+
+def middleware_cases(quick: bool) -> list[Case]:
+    from app.middlewares import AdministatorMiddleware
+
+    middleware = AdministatorMiddleware()
+    admin_message = make_message_update(1, ADMIN_ID, "/start").message
+    stranger_message = make_message_update(2, STRANGER_ID, "/start").message
+    number = 2000 if quick else 20000
+    return [
+        Case("middleware.admin", lambda: middleware.pre_process_message(admin_message, None), 1, number=number),
+        Case("middleware.non_admin", lambda: middleware.pre_process_message(stranger_message, None), 4, number=number),
+    ]
+
+
+def dispatch_cases(quick: bool, api_url: str) -> list[Case]:
+    """
+    Полный путь update -> middleware -> фильтры -> обработчик -> запрос к Bot API (заглушке).
+
+    Отдельный бот без пула потоков и без исходящей очереди: process_new_updates возвращается,
+    когда ответ уже отправлен, поэтому замер включает весь путь.
+    """
+    from telebot import apihelper
+    from telebot.storage import StateMemoryStorage
+    import telebot.custom_filters
+
+    from app import config
+    from app.entities import AppTeleBot
+    from app.handlers import register_all_handlers
+    from app.middlewares import AdministatorMiddleware
+    from .bench_render import random_codes
+
+    apihelper.API_URL = api_url
+    bot = AppTeleBot(config.TOKEN or "1:bench", parse_mode="HTML", threaded=False, use_class_middlewares=True,
+                     state_storage=StateMemoryStorage())
+    bot.setup_middleware(AdministatorMiddleware())
+    bot.add_custom_filter(telebot.custom_filters.StateFilter(bot))
+    register_all_handlers(bot)
+    bot.user_barcodes[ADMIN_ID] = random_codes(500)
+
+    update_ids = itertools.count(1)
+    number = 20 if quick else 200
+
+    def dispatch(user_id: int, text: str) -> Callable[[], None]:
+        return lambda: bot.process_new_updates([make_message_update(next(update_ids), user_id, text)])
+
+    return [
+        Case("dispatch.start", dispatch(ADMIN_ID, "/start"), 256, number=number),
+        Case("dispatch.mycodes", dispatch(ADMIN_ID, "/mycodes"), 512, number=number),
+        Case("dispatch.denied", dispatch(STRANGER_ID, "/start"), 64, number=number),
+    ]
+
+
+# --- Запуск и сравнение ---
+
+def environment_info() -> dict:
+    packages = {}
+    for name in ("pyTelegramBotAPI", "python-barcode", "pillow", "numpy"):
+        try:
+            packages[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            packages[name] = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "packages": packages}
+
+
+def compare_with_baseline(results: dict[str, Result], baseline: dict, tolerance: float) -> list[str]:
+    """
+    Замеры, медиана которых хуже базовой линии больше чем на tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if not reference:
+            continue
+        limit = reference["median_us"] * (1 + tolerance)
+        if result.median_us > limit:
+            regressions.append(f"{name}: {result.median_us:.1f} мкс против {reference['median_us']:.1f} мкс "
+                               f"(+{result.median_us / reference['median_us'] * 100 - 100:.0f}%)")
+    return regressions
+
+
+def results_document(results: dict[str, Result]) -> dict:
+    return {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment_info(),
+        "results": {name: {**result._asdict(), "over_budget": result.over_budget} for name, result in results.items()},
+    }
+
+
+def run_suite(groups: list[str], quick: bool, repeat: int, work_dir: str, api_url: str) -> dict[str, Result]:
+    builders = {
+        "render": lambda: render_cases(quick),
+        "parse": lambda: parse_cases(quick),
+        "storage": lambda: storage_cases(quick, work_dir),
+        "middleware": lambda: middleware_cases(quick),
+        "dispatch": lambda: dispatch_cases(quick, api_url),
+    }
+    results = {}
+    for group in groups:
+        for case in builders[group]():
+            result = run_case(case, repeat)
+            results[case.name] = result
+            mark = "  ПРЕВЫШЕН БЮДЖЕТ" if result.over_budget else ""
+            print(f"{case.name:<28} медиана {result.median_us:>11.1f} мкс  мин {result.min_us:>11.1f} мкс  "
+                  f"память {result.peak_kib:>9.1f} / {result.budget_kib:.0f} КиБ{mark}", flush=True)
+    return results
+
+
+def start_app(work_dir: str):
+    """
+    Собирает приложение в work_dir (data.json, логи и снимки состояний пишутся туда) и делает
+    ADMIN_ID администратором. Возвращает приложение и заглушку Bot API.
+    """
+    os.chdir(work_dir)
+    from app import config
+    from app.bot_logging import setup_app_logging
+    from app.factory import create_app
+    from tools.fake_bot_api import FakeBotApiServer
+
+    application = create_app()
+    setup_app_logging("WARNING")
+    application.runtime.config_watcher.stop() # Набор подменяет ADMIN_IDS; перечитывание config.ini вернуло бы их обратно
+    config.ADMIN_IDS = frozenset({ADMIN_ID})
+    config._publish_snapshot()
+
+    server = FakeBotApiServer()
+    server.start()
+    return application, server
+
+
+def stop_app(application, server) -> None:
+    application.shutdown()
+    server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"группы замеров через запятую: {', '.join(GROUPS)}")
+    parser.add_argument("--quick", action="store_true", help="меньше повторов, без самых больших входных данных")
+    parser.add_argument("--repeat", type=int, default=None, help="серий в каждом замере (по умолчанию 5, с --quick 3)")
+    parser.add_argument("--json", dest="json_path", help="записать результаты в JSON ('-' — в stdout)")
+    parser.add_argument("--baseline", help="JSON с базовой линией для сравнения")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="допустимое ухудшение медианы относительно базовой линии (0.25 = 25%%)")
+    parser.add_argument("--save-baseline", help="сохранить результаты как базовую линию")
+    args = parser.parse_args()
+
+    groups = [group.strip() for group in args.only.split(",") if group.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"неизвестные группы: {', '.join(sorted(unknown))}")
+    repeat = args.repeat or (3 if args.quick else 5)
+    # Пути из аргументов — относительно каталога запуска, а не временного каталога бота
+    paths = {name: os.path.abspath(path) if path and path != "-" else path
+             for name, path in (("json", args.json_path), ("baseline", args.baseline), ("save", args.save_baseline))}
+    baseline = None
+    if paths["baseline"]:
+        with open(paths["baseline"], encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    sys.path.insert(0, os.getcwd())
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as work_dir:
+        original_dir = os.getcwd()
+        application, server = start_app(work_dir)
+        try:
+            results = run_suite(groups, args.quick, repeat, work_dir, server.api_url)
+        finally:
+            stop_app(application, server)
+            os.chdir(original_dir)
+
+    document = results_document(results)
+    if paths["json"] == "-":
+        json.dump(document, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif paths["json"]:
+        with open(paths["json"], "w", encoding="utf-8") as file:
+            json.dump(document, file, ensure_ascii=False, indent=2)
+    if paths["save"]:
+        with open(paths["save"], "w", encoding="utf-8") as file:
+            json.dump(document, file, ensure_ascii=False, indent=2)
+        print(f"Базовая линия сохранена: {paths['save']}", file=sys.stderr)
+
+    failures = [f"{name}: память {result.peak_kib:.1f} КиБ при бюджете {result.budget_kib:.0f} КиБ"
+                for name, result in results.items() if result.over_budget]
+    if baseline is not None:
+        failures.extend(compare_with_baseline(results, baseline, args.tolerance))
+    if failures:
+        print("Регрессии:", *failures, sep="\n  ", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
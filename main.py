@@ -1,11 +1,83 @@
-from app import bot
+import multiprocessing
+import threading
+
+from telebot import TeleBot, types
+
+from app import config
+from app.bot_logging import stop_app_logging
+from app.factory import create_app, create_update_poller, start_runtime
+from app.sharding import ShardedDispatcher, ShardedWebhookServer
+from app.updates import allowed_updates_for, handled_update_types
+from app.webhook import WebhookServer
 
 import logging
 logger = logging.getLogger(__name__)
 
+
+def webhook_options() -> dict:
+    return dict(
+        path=config.WEBHOOK_PATH,
+        secret_token=config.WEBHOOK_SECRET,
+        max_body_bytes=config.WEBHOOK_MAX_BODY_KB * 1024,
+    )
+
+
+def run_webhook(bot: TeleBot, server: WebhookServer, allowed_updates: list[str]):
+    if config.WEBHOOK_URL:
+        bot.set_webhook(url=config.WEBHOOK_URL, secret_token=config.WEBHOOK_SECRET or None,
+                        allowed_updates=allowed_updates)
+        logger.info(f"Webhook зарегистрирован: {config.WEBHOOK_URL}")
+    server.start()
+    try:
+        threading.Event().wait() # Ждем Ctrl+C, запросы обслуживает поток сервера
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+def run_single_process():
+    application = create_app()
+    bot = application.bot
+    logger.info(f"Starting Telegram bot ({config.UPDATE_MODE} mode)...")
+    try:
+        # Прогрев ждет PREWARM_DELAY секунд, чтобы бот сначала начал принимать обновления
+        application.start_prewarm()
+        if config.UPDATE_MODE == "webhook":
+            run_webhook(bot, WebhookServer(bot, config.WEBHOOK_LISTEN, config.WEBHOOK_PORT, **webhook_options()),
+                        allowed_updates_for(bot))
+        else:
+            def handle(updates: list[dict]):
+                bot.process_new_updates([types.Update.de_json(update) for update in updates])
+
+            create_update_poller(handle, allowed_updates_for(bot)).run()
+    finally:
+        application.shutdown()
+
+
+def run_sharded():
+    runtime = start_runtime()
+    logger.info(f"Starting Telegram bot ({config.UPDATE_MODE} mode, {config.SHARD_WORKERS} worker processes)...")
+    dispatcher = ShardedDispatcher(config.SHARD_WORKERS, config.SHARD_QUEUE_SIZE, config.SHARD_DRAIN_TIMEOUT)
+    dispatcher.start()
+    try:
+        if config.UPDATE_MODE == "webhook":
+            # Бот диспетчера нужен только для setWebhook: обработчики выполняют воркеры
+            server = ShardedWebhookServer(dispatcher, config.WEBHOOK_LISTEN, config.WEBHOOK_PORT, **webhook_options())
+            run_webhook(TeleBot(config.TOKEN, threaded=False), server, handled_update_types())
+        else:
+            create_update_poller(dispatcher.dispatch, handled_update_types()).run()
+    finally:
+        dispatcher.stop()
+        runtime.stop()
+
+
 if __name__ == "__main__":
-    logger.info("Starting Telegram bot...")
-    
-    bot.polling(non_stop=True, interval=0)
+    multiprocessing.freeze_support() # Нужно для пула процессов отрисовки в сборках PyInstaller
+    if config.SHARD_WORKERS > 0:
+        run_sharded()
+    else:
+        run_single_process()
 
-    logger.info("Bot has stopped.")
\ No newline at end of file
+    logger.info("Bot has stopped.")
+    stop_app_logging()
@@ -0,0 +1,39 @@
+import asyncio
+import multiprocessing
+
+from app import config
+from app.async_app import create_async_bot
+from app.bot_logging import stop_app_logging
+from app.factory import start_prewarm, start_runtime
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+async def run_async_bot():
+    async_bot = create_async_bot()
+    start_prewarm(async_bot)
+    try:
+        await async_bot.polling(non_stop=True, interval=0)
+    finally:
+        await async_bot.close_session()
+        async_bot.user_barcodes.close()
+        async_bot.photo_file_ids.stop()
+        async_bot.current_states.storage.stop()
+        async_bot.auth_middleware_instance_ref.access_tracker.stop()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support() # Нужно для пула процессов отрисовки в сборках PyInstaller
+    runtime = start_runtime()
+    logger.info("Starting Telegram bot (asyncio mode)...")
+    if config.SHARD_WORKERS > 0:
+        logger.warning("SHARD_WORKERS поддерживается только в main.py, бот запущен одним процессом.")
+
+    try:
+        asyncio.run(run_async_bot())
+    finally:
+        runtime.stop()
+
+    logger.info("Bot has stopped.")
+    stop_app_logging()
@@ -0,0 +1,150 @@
+# Файл: tests/test_outbound.py
+"""
+OutboundScheduler против локальной заглушки Bot API (tools/fake_bot_api), которая отвечает 429
+при превышении частоты запросов в чат.
+"""
+import threading
+import time
+
+import pytest
+from telebot import TeleBot, apihelper
+
+from app.handlers.common import send_prepared_photo
+from app.utils.barcode_cache import ReadOnlyBytesIO
+from app.utils.outbound import OutboundScheduler
+from app.utils.saving_and_loading import FileIdIndex
+from tools.fake_bot_api import FILE_SIZES_PARAM, FakeBotApiServer
+
+CHAT_ID = 1001
+OTHER_CHAT_ID = 1002
+RESULT_TIMEOUT = 10
+
+
+class CallClock:
+    """
+    Время успешных вызовов заглушки по чатам.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: dict[int, list[tuple[float, str, dict]]] = {}
+
+    def on_call(self, method: str, params: dict) -> None:
+        with self._lock:
+            self.calls.setdefault(int(params.get("chat_id") or 0), []).append((time.monotonic(), method, params))
+
+    def times(self, chat_id: int) -> list[float]:
+        with self._lock:
+            return [called_at for called_at, _, _ in self.calls.get(chat_id, [])]
+
+
+def start_api(monkeypatch, chat_rate: float = 0, retry_after: int = 1) -> tuple[FakeBotApiServer, CallClock]:
+    server = FakeBotApiServer(chat_rate=chat_rate, retry_after=retry_after)
+    clock = CallClock()
+    server.on_call = clock.on_call
+    server.start()
+    monkeypatch.setattr(apihelper, "API_URL", server.api_url)
+    return server, clock
+
+
+@pytest.fixture
+def bot(tmp_path):
+    bot = TeleBot("1:test", threaded=False)
+    bot.photo_file_ids = FileIdIndex(str(tmp_path / "file_ids.json"))
+    return bot
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(**kwargs) -> OutboundScheduler:
+        scheduler = OutboundScheduler(**kwargs)
+        scheduler.start()
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.stop()
+
+
+@pytest.fixture
+def api(monkeypatch):
+    servers = []
+
+    def start(**kwargs):
+        server, clock = start_api(monkeypatch, **kwargs)
+        servers.append(server)
+        return server, clock
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def test_retry_after_is_honoured(api, bot, make_scheduler):
+    server, clock = api(chat_rate=1, retry_after=1)
+    # Собственный лимит планировщика выше лимита заглушки: второй запрос получит 429
+    scheduler = make_scheduler(private_rate=100, max_retries=3)
+    futures = [scheduler.submit(CHAT_ID, bot.send_message, CHAT_ID, f"text {i}") for i in range(2)]
+    for future in futures:
+        future.result(timeout=RESULT_TIMEOUT)
+
+    assert server.rejected_count >= 1
+    assert scheduler.stats()["retried_429"] == server.rejected_count
+    first, second = clock.times(CHAT_ID)
+    assert second - first >= 0.9 # Повтор не раньше retry_after
+    assert [params["text"] for _, _, params in clock.calls[CHAT_ID]] == ["text 0", "text 1"]
+
+
+def test_merge_key_supersedes_pending_job(api, bot, make_scheduler):
+    server, clock = api()
+    scheduler = make_scheduler(private_rate=100)
+    release = threading.Event()
+    blocker = scheduler.submit(CHAT_ID, release.wait, RESULT_TIMEOUT)
+    # Пока чат занят, правки с одним ключом заменяют друг друга
+    edits = [scheduler.submit(CHAT_ID, bot.send_message, CHAT_ID, f"progress {i}", merge_key=("edit", 1))
+             for i in range(3)]
+    release.set()
+    blocker.result(timeout=RESULT_TIMEOUT)
+    edits[-1].result(timeout=RESULT_TIMEOUT)
+
+    assert all(edit.cancelled() for edit in edits[:-1])
+    assert scheduler.stats()["merged"] == 2
+    assert [params["text"] for _, _, params in clock.calls[CHAT_ID]] == ["progress 2"]
+
+
+def test_photo_stream_is_rewound_on_retry(api, bot, make_scheduler):
+    server, clock = api(chat_rate=1, retry_after=1)
+    scheduler = make_scheduler(private_rate=100, max_retries=3)
+    png = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+    futures = [scheduler.submit(CHAT_ID, send_prepared_photo, bot, CHAT_ID,
+                                (code, f"key-{code}", ReadOnlyBytesIO(png)), code)
+               for code in ("4006381333931", "5901234123457")]
+    for future in futures:
+        assert future.result(timeout=RESULT_TIMEOUT) is True
+
+    assert server.rejected_count >= 1 # Вторая фотография загружалась повторно после 429
+    assert server.empty_upload_count == 0
+    uploads = [params[FILE_SIZES_PARAM] for _, method, params in clock.calls[CHAT_ID] if method == "sendPhoto"]
+    assert uploads == [{"photo": len(png)}] * 2
+
+
+def test_per_chat_pacing(api, bot, make_scheduler):
+    # Заглушка отвечает 429 на запросы в чат чаще чем раз в 0.8 с, планировщик шлет не чаще раза в секунду
+    server, clock = api(chat_rate=1.25)
+    scheduler = make_scheduler(private_rate=1, max_retries=0)
+    futures = [scheduler.submit(CHAT_ID, bot.send_message, CHAT_ID, f"text {i}") for i in range(3)]
+    other = scheduler.submit(OTHER_CHAT_ID, bot.send_message, OTHER_CHAT_ID, "other")
+    other.result(timeout=RESULT_TIMEOUT)
+    other_done = time.monotonic()
+    for future in futures:
+        future.result(timeout=RESULT_TIMEOUT)
+
+    assert server.rejected_count == 0
+    times = clock.times(CHAT_ID)
+    assert len(times) == 3
+    assert min(later - earlier for earlier, later in zip(times, times[1:])) >= 0.9
+    # Очередь одного чата не задерживает другой
+    assert other_done < times[1]
@@ -0,0 +1,86 @@
+# Файл: tests/test_webhook.py
+"""
+WebhookServer от начала до конца: сервер на свободном порту и записанные обновления
+из tools/sample_updates.jsonl, отправленные так же, как это делает tools/post_updates.
+"""
+import http.client
+import os
+import threading
+
+import pytest
+
+from app.webhook import SECRET_TOKEN_HEADER, WebhookServer
+from tools.post_updates import load_updates, post_update
+
+SAMPLE_UPDATES = os.path.join(os.path.dirname(__file__), "..", "tools", "sample_updates.jsonl")
+SECRET = "s3cr3t"
+MAX_BODY_BYTES = 4096
+
+
+class RecordingBot:
+    """
+    Вместо TeleBot: запоминает обновления, переданные в process_new_updates.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.updates = []
+
+    def process_new_updates(self, updates):
+        with self._lock:
+            self.updates.extend(updates)
+
+
+@pytest.fixture
+def webhook():
+    bot = RecordingBot()
+    server = WebhookServer(bot, "127.0.0.1", 0, "/webhook", secret_token=SECRET, max_body_bytes=MAX_BODY_BYTES)
+    server.start()
+    try:
+        yield server, bot
+    finally:
+        server.stop()
+
+
+def _url(server: WebhookServer) -> str:
+    return f"http://127.0.0.1:{server.port}{server.path}"
+
+
+def _post_raw(server: WebhookServer, body: bytes, secret: str = SECRET) -> int:
+    connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+    try:
+        connection.request("POST", server.path, body=body,
+                           headers={"Content-Type": "application/json", SECRET_TOKEN_HEADER: secret})
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def test_recorded_updates_are_accepted(webhook):
+    server, bot = webhook
+    updates = load_updates(SAMPLE_UPDATES)
+    statuses = [post_update(_url(server), update, SECRET) for update in updates]
+    assert statuses == [200] * len(updates)
+    assert [update.update_id for update in bot.updates] == [update["update_id"] for update in updates]
+    assert bot.updates[0].message.text == updates[0]["message"]["text"]
+
+
+def test_wrong_secret_is_rejected(webhook):
+    server, bot = webhook
+    update = load_updates(SAMPLE_UPDATES)[0]
+    assert post_update(_url(server), update, "wrong") == 401
+    assert post_update(_url(server), update, None) == 401
+    assert bot.updates == []
+
+
+def test_oversized_body_is_rejected(webhook):
+    server, bot = webhook
+    assert _post_raw(server, b"{" + b" " * MAX_BODY_BYTES + b"}") == 413
+    assert bot.updates == []
+
+
+@pytest.mark.parametrize("body", [b"not json", b"\xff\xfe", b"[1, 2, 3]", b"{}"])
+def test_garbage_is_rejected(webhook, body):
+    server, bot = webhook
+    assert _post_raw(server, body) == 400
+    assert bot.updates == []
@@ -0,0 +1,310 @@
+# Файл: tools/fake_bot_api.py
+"""
+Локальная заглушка Bot API для проверки бота без Telegram.
+
+Отвечает на методы, которые использует бот (getMe, getUpdates, sendMessage, sendPhoto,
+sendMediaGroup и т.д.), и может имитировать лимиты Telegram: при превышении заданной
+частоты запросов в чат возвращает 429 с retry_after. Доля ответов может заменяться
+ошибкой 500 (error_rate), а getUpdates отдает обновления, поставленные через push_updates(),
+с long polling, как настоящий Bot API.
+
+    python -m tools.fake_bot_api --port 8081 --chat-rate 1 --retry-after 1 --error-rate 0.01
+
+В config.ini бота:
+    API_URL = http://127.0.0.1:8081/bot{0}/{1}
+    API_FILE_URL = http://127.0.0.1:8081/file/bot{0}/{1}
+
+Файлы для getFile добавляются через add_file(); они отдаются по пути /file/bot<token>/documents/<file_id>.
+"""
+import argparse
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые возвращают отправленное сообщение
+MESSAGE_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "editMessageText", "editMessageCaption", "editMessageMedia"}
+# Методы, которые возвращают True
+BOOLEAN_METHODS = {"answerCallbackQuery", "deleteMessage", "setWebhook", "deleteWebhook", "setMyCommands", "sendChatAction"}
+MAX_LONG_POLL_SECONDS = 50 # Telegram держит getUpdates не дольше 50 секунд
+FILE_SIZES_PARAM = "_file_sizes" # Параметр вызова в calls и on_call: {поле формы: размер файла в байтах}
+
+
+class FakeBotApiServer(ThreadingHTTPServer):
+    """
+    HTTP-сервер, имитирующий Bot API. Все полученные вызовы сохраняются в calls.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, chat_rate: float = 0, retry_after: int = 1,
+                 latency: float = 0.0, error_rate: float = 0.0, seed: int | None = None):
+        """
+        Args:
+            chat_rate (float): Сколько запросов в секунду разрешено в один чат; 0 — без ограничения.
+            retry_after (int): Значение retry_after в ответах 429.
+            latency (float): Искусственная задержка ответа, секунды.
+            error_rate (float): Доля запросов (кроме getUpdates), на которые отвечать 500.
+            seed (int | None): Зерно генератора для error_rate, чтобы прогоны были воспроизводимы.
+        """
+        self.chat_rate = chat_rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls: list[tuple[str, dict]] = []
+        self.files: dict[str, bytes] = {}
+        self.rejected_count = 0
+        self.failed_count = 0
+        self.empty_upload_count = 0 # Загруженные файлы нулевого размера
+        # Вызывается для каждого успешно обработанного запроса (method, params) в потоке сервера
+        self.on_call: Callable[[str, dict], None] | None = None
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1000)
+        self._last_call_by_chat: dict[str, float] = {}
+        self._updates: deque[dict] = deque()
+        self._update_ids = itertools.count(1)
+        self._updates_cond = threading.Condition()
+        self._closing = False
+        self._thread: threading.Thread | None = None
+        super().__init__((host, port), _FakeBotApiHandler)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    @property
+    def api_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.port}/bot{{0}}/{{1}}"
+
+    @property
+    def file_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.port}/file/bot{{0}}/{{1}}"
+
+    def add_file(self, file_id: str, content: bytes) -> None:
+        self.files[file_id] = content
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._updates_cond:
+            self._closing = True
+            self._updates_cond.notify_all() # Отпускаем ожидающие long polling запросы
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def push_updates(self, updates: Iterable[dict]) -> list[int]:
+        """
+        Ставит обновления в очередь getUpdates. update_id назначается, если не задан.
+        """
+        ids = []
+        with self._updates_cond:
+            for update in updates:
+                update.setdefault("update_id", next(self._update_ids))
+                self._updates.append(update)
+                ids.append(update["update_id"])
+            self._updates_cond.notify_all()
+        return ids
+
+    @property
+    def pending_updates(self) -> int:
+        with self._updates_cond:
+            return len(self._updates)
+
+    def get_updates(self, params: dict) -> list[dict]:
+        """
+        Как getUpdates: подтверждает обновления до offset и ждет новых не дольше timeout секунд.
+        """
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + min(float(params.get("timeout") or 0), MAX_LONG_POLL_SECONDS)
+        with self._updates_cond:
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_cond.wait(remaining)
+            return list(itertools.islice(self._updates, limit))
+
+    def should_fail(self, method: str) -> bool:
+        if not self.error_rate or method == "getUpdates":
+            return False
+        with self._lock:
+            if self._random.random() >= self.error_rate:
+                return False
+            self.failed_count += 1
+        return True
+
+    def is_rate_limited(self, chat_id) -> bool:
+        if not self.chat_rate or chat_id is None:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last_call = self._last_call_by_chat.get(str(chat_id))
+            if last_call is not None and now - last_call < 1 / self.chat_rate:
+                self.rejected_count += 1
+                return True
+            self._last_call_by_chat[str(chat_id)] = now
+        return False
+
+    def build_result(self, method: str, params: dict):
+        chat = {"id": int(params.get("chat_id") or 1), "type": "private"}
+        message_id = next(self._message_ids)
+        message = {"message_id": message_id, "date": int(time.time()), "chat": chat}
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        if method == "getUpdates":
+            return self.get_updates(params)
+        if method == "getFile":
+            file_id = params.get("file_id", "")
+            return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": len(self.files.get(file_id, b"")),
+                    "file_path": f"documents/{file_id}"}
+        if method == "sendMediaGroup":
+            media = json.loads(params.get("media") or "[]")
+            return [dict(message, message_id=message_id * 100 + i, photo=[_photo_size(f"G{message_id}_{i}")])
+                    for i in range(len(media))]
+        if method == "sendPhoto":
+            message["photo"] = [_photo_size(f"F{message_id}")]
+        if method in ("sendMessage", "editMessageText"):
+            message["text"] = params.get("text", "")
+        if method in MESSAGE_METHODS:
+            return message
+        if method in BOOLEAN_METHODS:
+            return True
+        return message
+
+
+def _photo_size(file_id: str) -> dict:
+    return {"file_id": file_id, "file_unique_id": f"u{file_id}", "width": 1, "height": 1}
+
+
+class _FakeBotApiHandler(BaseHTTPRequestHandler):
+    server: FakeBotApiServer
+
+    def log_message(self, format, *args):
+        logger.debug("Fake Bot API %s - %s", self.address_string(), format % args)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.startswith("/file/"):
+            self._send_file(path.rsplit("/", 1)[-1])
+            return
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _send_file(self, file_id: str):
+        content = self.server.files.get(file_id)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _read_params(self) -> dict:
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        content_type = self.headers.get("Content-Type", "")
+        if "multipart/form-data" in content_type:
+            # Содержимое файлов (фото) не храним, только размер: пустая загрузка — ошибка бота (например,
+            # повтор после 429 с непромотанным BytesIO)
+            form = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+            file_sizes = {}
+            for part in form.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if part.get_filename() is None:
+                    params[name] = part.get_content()
+                else:
+                    file_sizes[name] = len(part.get_payload(decode=True) or b"")
+            if file_sizes:
+                params[FILE_SIZES_PARAM] = file_sizes
+                empty_count = sum(1 for size in file_sizes.values() if size == 0)
+                if empty_count:
+                    with self.server._lock:
+                        self.server.empty_upload_count += empty_count
+        elif "json" in content_type and body:
+            params.update(json.loads(body))
+        elif body:
+            params.update({key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()})
+        return params
+
+    def _handle(self):
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        params = self._read_params()
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.is_rate_limited(params.get("chat_id")):
+            status, response = 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {server.retry_after}",
+                "parameters": {"retry_after": server.retry_after},
+            }
+        elif server.should_fail(method):
+            status, response = 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+        else:
+            with server._lock:
+                server.calls.append((method, params))
+            status, response = 200, {"ok": True, "result": server.build_result(method, params)}
+            if server.on_call is not None and method != "getUpdates":
+                server.on_call(method, params)
+
+        body = json.dumps(response).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент закрыл соединение, не дождавшись ответа (например, бот остановлен во время long polling)
+            logger.debug("Fake Bot API: клиент отключился до ответа на %s", method)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Telegram Bot API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chat-rate", type=float, default=0, help="allowed requests per second per chat (0 = unlimited)")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after value in 429 responses")
+    parser.add_argument("--latency", type=float, default=0.0, help="artificial response delay, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    server = FakeBotApiServer(args.host, args.port, args.chat_rate, args.retry_after, args.latency, args.error_rate)
+    logger.info(f"Fake Bot API: {server.api_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"Обработано вызовов: {len(server.calls)}, ответов 429: {server.rejected_count}, "
+                    f"ответов 500: {server.failed_count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+# Файл: tools/load_test.py
+"""
+Нагрузочный тест: бот (main.py) в отдельном процессе против локальной заглушки Bot API.
+
+    python -m tools.load_test --rate 20 --duration 30 --users 200 --mix gen=0.5,codes=0.3,spam=0.2
+    python -m tools.load_test --replay updates.jsonl --rate 50 --admin-ids 42,43
+    python -m tools.load_test --set OUTBOUND_GLOBAL_RATE=1000 --set BARCODE_ENGINE=fast --error-rate 0.01
+
+Генератор ставит обновления в очередь getUpdates заглушки с заданной частотой (открытая модель:
+расписание не ждет ответов бота) и ловит ответы. Задержка считается от постановки обновления
+в очередь до первого ответа на него: сообщения с reply_to на это обновление, а если бот отвечает
+без reply_to — первого сообщения в тот же чат. /codes моделируется двумя шагами: список кодов
+пользователь отправляет, когда получил подсказку бота. Пользователи /gen и /codes не пересекаются:
+команда, отправленная во время ввода списка, только отменяет ввод. На спам неавторизованных
+пользователей бот не отвечает, такие обновления только считаются.
+
+Бот запускается во временном каталоге со своим config.ini (на основе config.ini.default,
+путь передается через BOT_CONFIG), поэтому рабочие данные проекта не затрагиваются.
+Пиковый RSS берется из VmHWM в /proc (Linux): отдельно для основного процесса и суммарно
+с процессами пула отрисовки.
+"""
+import argparse
+import configparser
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.barcode_utils import ean13_checksum
+
+from .fake_bot_api import FakeBotApiServer
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_PATH = os.path.join(PROJECT_DIR, "main.py")
+DEFAULT_CONFIG_PATH = os.path.join(PROJECT_DIR, "config.ini.default")
+CONFIG_SECTION_NAME = "Settings"
+CONFIG_ENV_VAR = "BOT_CONFIG" # См. app/config.py
+
+DEFAULT_MIX = "gen=0.5,codes=0.3,spam=0.2"
+ACTION_KINDS = ("gen", "codes", "spam")
+REPLY_METHODS = {"sendMessage", "sendPhoto", "sendMediaGroup", "sendDocument"}
+FIRST_USER_ID = 10_000_000
+FIRST_SPAMMER_ID = 90_000_000
+CODES_PER_PASTE = 20
+CODE_POOL_SIZE = 500 # Коды для /gen повторяются: часть запросов попадает в кэш изображений, как в жизни
+STARTUP_TIMEOUT = 60 # Сколько ждать первого getUpdates от бота, секунды
+STOP_TIMEOUT = 30
+
+
+def ean13(digits12: str) -> str:
+    return digits12 + str(ean13_checksum(digits12))
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ACTION_KINDS:
+            raise ValueError(f"неизвестный тип запроса '{kind}', допустимы: {', '.join(ACTION_KINDS)}")
+        mix[kind] = float(weight)
+    if sum(mix.values()) <= 0:
+        raise ValueError("сумма долей должна быть положительной")
+    return mix
+
+
+def percentile(sorted_values: list[float], share: float) -> float | None:
+    if not sorted_values:
+        return None
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    return statistics.quantiles(sorted_values, n=100, method="inclusive")[int(share * 100) - 1]
+
+
+def make_message_update(message_id: int, user_id: int, text: str) -> dict:
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": message}
+
+
+class SyntheticStream:
+    """
+    Бесконечный поток обновлений из смеси /gen, /codes и спама. Каждый элемент — (вид, обновление, текст
+    следующего сообщения пользователя или None).
+    """
+
+    def __init__(self, mix: dict[str, float], users: int, seed: int):
+        self.random = random.Random(seed)
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + max(2, users)))
+        self.gen_user_ids = self.user_ids[::2]
+        self.codes_user_ids = self.user_ids[1::2]
+        self.message_ids = itertools.count(1)
+        self.code_pool = [self._random_code() for _ in range(CODE_POOL_SIZE)]
+
+    def _random_code(self) -> str:
+        return ean13("".join(self.random.choice("0123456789") for _ in range(12)))
+
+    def __iter__(self):
+        while True:
+            kind = self.random.choices(self.kinds, self.weights)[0]
+            message_id = next(self.message_ids)
+            if kind == "gen":
+                user_id = self.random.choice(self.gen_user_ids)
+                yield kind, make_message_update(message_id, user_id, f"/gen {self.random.choice(self.code_pool)}"), None
+            elif kind == "codes":
+                user_id = self.random.choice(self.codes_user_ids)
+                paste = "\n".join(self.random.sample(self.code_pool, CODES_PER_PASTE))
+                yield kind, make_message_update(message_id, user_id, "/codes"), paste
+            else:
+                spammer_id = FIRST_SPAMMER_ID + self.random.randrange(1_000_000)
+                yield kind, make_message_update(message_id, spammer_id, "/gen"), None
+
+    def next_message_id(self) -> int:
+        return next(self.message_ids)
+
+
+class ReplayStream:
+    """
+    Обновления из JSONL-файла (по одному объекту Update в строке, например сохраненные ответы getUpdates),
+    по кругу. update_id и message_id назначаются заново, чтобы повторные проходы не совпадали.
+    """
+
+    def __init__(self, path: str, admin_ids: set[int]):
+        with open(path, encoding="utf-8") as file:
+            self.updates = [json.loads(line) for line in file if line.strip()]
+        if not self.updates:
+            raise ValueError(f"в файле {path} нет обновлений")
+        self.admin_ids = admin_ids
+        self.message_ids = itertools.count(1)
+
+    @staticmethod
+    def sender_ids(path: str) -> set[int]:
+        with open(path, encoding="utf-8") as file:
+            return {update["message"]["from"]["id"] for update in map(json.loads, filter(str.strip, file))
+                    if "message" in update and "from" in update["message"]}
+
+    def __iter__(self):
+        for update in itertools.cycle(self.updates):
+            update = json.loads(json.dumps(update))
+            update.pop("update_id", None)
+            message = update.get("message")
+            if message is None:
+                yield "other", update, None
+                continue
+            message["message_id"] = next(self.message_ids)
+            message["date"] = int(time.time())
+            sender_id = (message.get("from") or {}).get("id")
+            kind = "spam" if sender_id not in self.admin_ids else "replay"
+            yield kind, update, None
+
+    def next_message_id(self) -> int:
+        return next(self.message_ids)
+
+
+class LatencyTracker:
+    """
+    Сопоставляет ответы бота, увиденные заглушкой, с отправленными обновлениями.
+    """
+
+    def __init__(self, server: FakeBotApiServer, stream):
+        self.server = server
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._pending: dict[int, OrderedDict[int, tuple[float, str, str | None]]] = {}
+        self.latencies: dict[str, list[float]] = {}
+        self.sent: dict[str, int] = {}
+        self.first_sent_at: float | None = None
+        self.last_answer_at: float | None = None
+
+    def push(self, kind: str, update: dict, followup: str | None) -> None:
+        message = update.get("message")
+        now = time.perf_counter()
+        with self._lock:
+            self.sent[kind] = self.sent.get(kind, 0) + 1
+            if self.first_sent_at is None:
+                self.first_sent_at = now
+            if message is not None and kind not in ("spam", "other"):
+                chat_pending = self._pending.setdefault(message["chat"]["id"], OrderedDict())
+                chat_pending[message["message_id"]] = (now, kind, followup)
+        self.server.push_updates([update])
+
+    @property
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(chat_pending) for chat_pending in self._pending.values())
+
+    def on_call(self, method: str, params: dict) -> None:
+        if method not in REPLY_METHODS or not params.get("chat_id"):
+            return
+        chat_id = int(params["chat_id"])
+        reply_to = _reply_to_message_id(params)
+        now = time.perf_counter()
+        with self._lock:
+            chat_pending = self._pending.get(chat_id)
+            if not chat_pending:
+                return
+            if reply_to is not None and reply_to in chat_pending:
+                sent_at, kind, followup = chat_pending.pop(reply_to)
+            elif reply_to is None:
+                _, (sent_at, kind, followup) = chat_pending.popitem(last=False)
+            else:
+                return # Ответ на уже учтенное сообщение (например, второй альбом)
+            if not chat_pending:
+                del self._pending[chat_id]
+            self.latencies.setdefault(kind, []).append(now - sent_at)
+            self.last_answer_at = now
+        if followup is not None:
+            # Пользователь получил подсказку /codes и отправляет список
+            self.push("codes_paste", make_message_update(self.stream.next_message_id(), chat_id, followup), None)
+
+
+def _reply_to_message_id(params: dict) -> int | None:
+    if params.get("reply_to_message_id"):
+        return int(params["reply_to_message_id"])
+    reply_parameters = params.get("reply_parameters")
+    if reply_parameters:
+        if isinstance(reply_parameters, str):
+            reply_parameters = json.loads(reply_parameters)
+        return int(reply_parameters.get("message_id"))
+    return None
+
+
+def write_bot_config(path: str, server: FakeBotApiServer, admin_ids: set[int], overrides: list[str],
+                     base_config: str) -> None:
+    config_parser = configparser.ConfigParser()
+    config_parser.read(base_config, encoding="utf-8")
+    if not config_parser.has_section(CONFIG_SECTION_NAME):
+        config_parser.add_section(CONFIG_SECTION_NAME)
+    settings = {
+        "TOKEN": "123456789:load-test",
+        "ADMIN_IDS": ",".join(map(str, sorted(admin_ids))),
+        "LOG_LEVEL": "WARNING",
+        "API_URL": server.api_url,
+        "API_FILE_URL": server.file_url,
+        "UPDATE_MODE": "polling",
+    }
+    for override in overrides:
+        key, _, value = override.partition("=")
+        settings[key.strip()] = value.strip()
+    for key, value in settings.items():
+        config_parser.set(CONFIG_SECTION_NAME, key, value)
+    with open(path, "w", encoding="utf-8") as file:
+        config_parser.write(file)
+
+
+def _vm_hwm_kib(pid: int) -> int | None:
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _child_pids(pid: int) -> list[int]:
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children", encoding="ascii") as file:
+                children.extend(int(child) for child in file.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def peak_rss_mib(pid: int) -> tuple[float | None, float | None]:
+    """
+    Пиковый RSS основного процесса и сумма пиков вместе с дочерними процессами, МиБ.
+    """
+    main_kib = _vm_hwm_kib(pid)
+    if main_kib is None:
+        return None, None
+    total_kib = main_kib + sum(_vm_hwm_kib(child) or 0 for child in _child_pids(pid))
+    return main_kib / 1024, total_kib / 1024
+
+
+def start_bot(work_dir: str, config_path: str) -> subprocess.Popen:
+    env = dict(os.environ, **{CONFIG_ENV_VAR: config_path})
+    log_file = open(os.path.join(work_dir, "bot_stdout.log"), "wb")
+    return subprocess.Popen([sys.executable, MAIN_PATH], cwd=work_dir, env=env, stdout=log_file,
+                            stderr=subprocess.STDOUT)
+
+
+def wait_for_polling(server: FakeBotApiServer, bot_process: subprocess.Popen) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if any(method == "getUpdates" for method, _ in list(server.calls)):
+            return
+        if bot_process.poll() is not None:
+            raise RuntimeError(f"бот завершился при запуске с кодом {bot_process.returncode}")
+        time.sleep(0.1)
+    raise RuntimeError(f"бот не начал опрос getUpdates за {STARTUP_TIMEOUT} с")
+
+
+def stop_bot(bot_process: subprocess.Popen) -> None:
+    if bot_process.poll() is not None:
+        return
+    bot_process.send_signal(signal.SIGINT) # main.py досылает очередь и сохраняет данные в finally
+    try:
+        bot_process.wait(STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        bot_process.kill()
+        bot_process.wait()
+
+
+def run_load(tracker: LatencyTracker, stream, rate: float, duration: float, drain_timeout: float) -> tuple[float, int]:
+    """
+    Ставит обновления по расписанию rate в секунду в течение duration секунд и ждет ответов
+    не дольше drain_timeout. Возвращает фактическую длительность постановки и число поставленных
+    по расписанию обновлений (без ответных сообщений пользователей).
+    """
+    started = time.perf_counter()
+    scheduled = 0
+    for index, (kind, update, followup) in enumerate(stream):
+        due = started + index / rate
+        if due - started >= duration:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        tracker.push(kind, update, followup)
+        scheduled += 1
+    pushed_for = time.perf_counter() - started
+    deadline = time.monotonic() + drain_timeout
+    while tracker.pending_count and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return pushed_for, scheduled
+
+
+def build_report(tracker: LatencyTracker, pushed_for: float, scheduled: int, rss: tuple[float | None, float | None],
+                 server: FakeBotApiServer, args) -> dict:
+    all_latencies = sorted(itertools.chain.from_iterable(tracker.latencies.values()))
+    answered = len(all_latencies)
+    window = ((tracker.last_answer_at or 0) - (tracker.first_sent_at or 0)) or pushed_for
+
+    def summary(values: list[float]) -> dict:
+        values = sorted(values)
+        return {
+            "count": len(values),
+            **{f"p{share}_ms": round(percentile(values, share / 100) * 1000, 1) if values else None
+               for share in (50, 95, 99)},
+        }
+
+    return {
+        "rate_target": args.rate,
+        "rate_actual": round(scheduled / pushed_for, 1) if pushed_for else None,
+        "duration_s": round(pushed_for, 1),
+        "sent": tracker.sent,
+        "answered": answered,
+        "unanswered": tracker.pending_count,
+        "throughput_per_s": round(answered / window, 1) if window > 0 else None,
+        "latency": summary(all_latencies),
+        "latency_by_kind": {kind: summary(values) for kind, values in sorted(tracker.latencies.items())},
+        "peak_rss_mib": round(rss[0], 1) if rss[0] is not None else None,
+        "peak_rss_with_workers_mib": round(rss[1], 1) if rss[1] is not None else None,
+        "api_429": server.rejected_count,
+        "api_500": server.failed_count,
+        "empty_uploads": server.empty_upload_count,
+    }
+
+
+def print_report(report: dict) -> None:
+    latency = report["latency"]
+    print(f"Отправлено: {sum(report['sent'].values())} ({', '.join(f'{k}={v}' for k, v in report['sent'].items())}), "
+          f"частота {report['rate_actual']}/с при цели {report['rate_target']}/с за {report['duration_s']} с")
+    print(f"Ответов: {report['answered']}, без ответа: {report['unanswered']}, "
+          f"пропускная способность: {report['throughput_per_s']}/с")
+    print(f"Задержка: p50 {latency['p50_ms']} мс, p95 {latency['p95_ms']} мс, p99 {latency['p99_ms']} мс")
+    for kind, values in report["latency_by_kind"].items():
+        print(f"  {kind:<12} n={values['count']:<6} p50 {values['p50_ms']} мс, p95 {values['p95_ms']} мс, "
+              f"p99 {values['p99_ms']} мс")
+    print(f"Пиковый RSS бота: {report['peak_rss_mib']} МиБ, вместе с пулом отрисовки: "
+          f"{report['peak_rss_with_workers_mib']} МиБ")
+    print(f"Ответов заглушки 429: {report['api_429']}, 500: {report['api_500']}")
+    if report["empty_uploads"]:
+        print(f"ВНИМАНИЕ: пустых загрузок файлов: {report['empty_uploads']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of main.py against the local fake Bot API.")
+    parser.add_argument("--rate", type=float, default=20, help="updates per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--users", type=int, default=200, help="authorized synthetic users")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"synthetic request mix (default {DEFAULT_MIX})")
+    parser.add_argument("--replay", help="JSONL file with recorded updates instead of the synthetic mix")
+    parser.add_argument("--admin-ids", help="comma-separated admin ids for --replay (default: every sender)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for late replies")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake API response delay, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake API calls answered with 500")
+    parser.add_argument("--chat-rate", type=float, default=0, help="fake API per-chat limit before 429 (0 = off)")
+    parser.add_argument("--config", default=DEFAULT_CONFIG_PATH, help="base bot config (default config.ini.default)")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a bot config value, may be repeated")
+    parser.add_argument("--keep-dir", action="store_true", help="keep the bot work directory (logs, data)")
+    parser.add_argument("--json", dest="json_path", help="write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    if args.replay:
+        admin_ids = ({int(value) for value in args.admin_ids.split(",") if value.strip()} if args.admin_ids
+                     else ReplayStream.sender_ids(args.replay))
+        stream = ReplayStream(args.replay, admin_ids)
+    else:
+        try:
+            stream = SyntheticStream(parse_mix(args.mix), args.users, args.seed)
+        except ValueError as e:
+            parser.error(str(e))
+        admin_ids = set(stream.user_ids)
+
+    server = FakeBotApiServer(chat_rate=args.chat_rate, latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+    tracker = LatencyTracker(server, stream)
+    server.on_call = tracker.on_call
+    server.start()
+    work_dir = tempfile.mkdtemp(prefix="bot-load-")
+    bot_process = None
+    try:
+        config_path = os.path.join(work_dir, "config.ini")
+        write_bot_config(config_path, server, admin_ids, args.overrides, args.config)
+        bot_process = start_bot(work_dir, config_path)
+        wait_for_polling(server, bot_process)
+        pushed_for, scheduled = run_load(tracker, stream, args.rate, args.duration, args.drain_timeout)
+        rss = peak_rss_mib(bot_process.pid)
+    finally:
+        if bot_process is not None:
+            stop_bot(bot_process)
+        server.stop()
+        if args.keep_dir:
+            print(f"Рабочий каталог бота: {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = build_report(tracker, pushed_for, scheduled, rss, server, args)
+    if args.json_path == "-":
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
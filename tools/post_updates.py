@@ -0,0 +1,68 @@
+# Файл: tools/post_updates.py
+"""
+Отправляет записанные обновления Telegram на локальный webhook бота — без подключения к Telegram.
+
+Файл с обновлениями — JSON Lines: по одному объекту Update на строку
+(например, скопированные из ответа getUpdates). Пример: tools/sample_updates.jsonl.
+
+    python -m tools.post_updates tools/sample_updates.jsonl --url http://127.0.0.1:8443/webhook --secret s3cr3t
+"""
+import argparse
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def post_update(url: str, update: dict, secret: str | None = None, timeout: float = 10.0) -> int:
+    """
+    Отправляет одно обновление и возвращает HTTP-статус ответа.
+    """
+    body = json.dumps(update).encode("utf-8")
+    request = urllib.request.Request(url, data=body, method="POST", headers={"Content-Type": "application/json"})
+    if secret:
+        request.add_header(SECRET_TOKEN_HEADER, secret)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded Telegram updates against a local webhook.")
+    parser.add_argument("updates", help="JSON Lines file with Update objects")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/webhook")
+    parser.add_argument("--secret", default=None, help="value for the secret token header")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=1, help="how many times to replay the file")
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates) * args.repeat
+    # Уникальные update_id, чтобы повторы выглядели как новые обновления
+    for i, update in enumerate(updates):
+        update = dict(update)
+        update["update_id"] = i + 1
+        updates[i] = update
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        statuses = list(pool.map(lambda u: post_update(args.url, u, args.secret), updates))
+    elapsed = time.perf_counter() - started
+
+    summary = {status: statuses.count(status) for status in sorted(set(statuses))}
+    print(f"Отправлено {len(updates)} обновлений за {elapsed:.2f} с ({len(updates) / elapsed:.1f}/с). Статусы: {summary}")
+    sys.exit(0 if set(statuses) == {200} else 1)
+
+
+if __name__ == "__main__":
+    main()